@@ -0,0 +1,70 @@
+""" Wall time and peak memory of calcPosterior (loading the traces and the posterior
+calculations, without figures) at several trace lengths, for each Model on the
+bundled data.
+
+A short chain is sampled once per model, then its traces are tiled to each trace
+length (the cost of the calculations depends on the number of samples, not on their
+values). Each calcPosterior runs in its own process, so that its peak resident memory
+(ru_maxrss) is not hidden by a previous run.
+
+Usage (from the main folder):
+    python benchmarks/benchCalcPosterior.py [trace lengths, default 100,200,400] [models, default all]
+"""
+import sys, os, time, pickle, resource, shutil, multiprocessing
+import numpy as np
+import common
+import dayEst, timeEst, timeTestHom, timeControlEst
+
+models={'dayEst':(dayEst,common.dayData),
+        'timeEst':(timeEst,common.timeData),
+        'timeTestHom':(timeTestHom,common.timeData),
+        'timeControlEst':(timeControlEst,common.timeData)}
+
+def tileTraces(saveTo,length):
+    """Rewrites the traces of the MCMC pickle, tiled to length samples."""
+    traces=pickle.load(open(saveTo+'-MCMC.pickle.orig','rb'))
+    for name,chains in traces.items():
+        if name!='_state_':
+            for chain,arr in chains.items():
+                chains[chain]=np.resize(arr,(length,)+arr.shape[1:])
+    pickle.dump(traces,open(saveTo+'-MCMC.pickle','wb'),pickle.HIGHEST_PROTOCOL)
+
+def _calc(model,path,queue):
+    """Runs calcPosterior in a child process and returns its wall time and memory."""
+    sys.stdout=open(os.devnull,'w')
+    mod=model.Model.savedModel(path,bRandomIni=False,bLoadTraces=False)
+    rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t=time.time()
+    mod.calcPosterior(bOverWrite=True,bPlot=False)
+    t=time.time()-t
+    peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((t,peak/1024.,(peak-rss)/1024.))
+
+def main(lengths=(100,200,400),names=None):
+    folder=common.tmpFolder()
+    try:
+        for name in (names or sorted(models)):
+            model,data=models[name]
+            mod=common.setup(model,data(),folder)
+            mod.sample(min(lengths))
+            os.rename(mod.saveTo+'-MCMC.pickle',mod.saveTo+'-MCMC.pickle.orig')
+            for length in lengths:
+                tileTraces(mod.saveTo,length)
+                queue=multiprocessing.Queue()
+                p=multiprocessing.Process(target=_calc,args=(model,mod.path,queue))
+                p.start()
+                p.join()
+                if p.exitcode!=0:
+                    raise RuntimeError("calcPosterior of %s failed with %i samples"%(name,length))
+                t,peak,increase=queue.get()
+                case='%s %i samples'%(name,length)
+                common.record('calcPosterior time',case,t,'s')
+                common.record('calcPosterior memory',case,peak,'MB peak')
+                common.record('calcPosterior memory',case+' increase',increase,'MB')
+    finally:
+        shutil.rmtree(folder)
+
+if __name__=='__main__':
+    lengths=[int(l) for l in sys.argv[1].split(',')] if len(sys.argv)>1 else (100,200,400)
+    names=sys.argv[2].split(',') if len(sys.argv)>2 else None
+    main(lengths,names)
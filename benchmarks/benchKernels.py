@@ -0,0 +1,62 @@
+""" Throughput of the kernels of the likelihoods (utils.pi_het and utils.kpdfInt) over
+grids of parameter values, in kernel values computed per second.
+
+Each kernel is timed vectorized over a grid (one call for the whole grid, as in the
+posterior calculations) and with scalar calls (one call per value). pi_het is also
+timed with the precomputed table of piTable (built in a temporary folder).
+
+Usage (from the main folder):
+    python benchmarks/benchKernels.py [grid size per parameter, default 20]
+"""
+import sys, os, shutil
+import numpy as np
+import common
+import utils as ut
+import piTable
+
+def grids(n):
+    """Parameter grids of n values per parameter."""
+    doses=np.concatenate(([0],10**np.linspace(0,10,n-1)))
+    ps=10**np.linspace(-8,-4,n)
+    shapes=10**np.linspace(-1,1,n)
+    times=np.arange(n,dtype=float)*60./n
+    cgs=np.linspace(1,20,n)
+    taus=np.linspace(1,50,n)
+    return doses,ps,shapes,times,cgs,taus
+
+def main(n=20):
+    doses,ps,shapes,times,cgs,taus=grids(n)
+
+    # pi_het over doses x p x a x b
+    D,P,A,B=np.meshgrid(doses,ps,shapes,shapes,indexing='ij')
+    r=common.rate(lambda: ut.pi_het(D,P,A,B,0.01))
+    common.record('kernels','pi_het vectorized (%i values)'%D.size,r*D.size,'values/s')
+    sub=slice(0,min(D.size,2000))
+    Ds,Ps,As,Bs=D.ravel()[sub],P.ravel()[sub],A.ravel()[sub],B.ravel()[sub]
+    def scalar():
+        for i in xrange(len(Ds)):
+            ut.pi_het(Ds[i],Ps[i],As[i],Bs[i],0.01)
+    r=common.rate(scalar)
+    common.record('kernels','pi_het scalar',r*len(Ds),'values/s')
+    folder=common.tmpFolder()
+    piTable.build(os.path.join(folder,'piTable.npy'))
+    piTable.use(os.path.join(folder,'piTable.npy'))
+    r=common.rate(lambda: ut.pi_het(D,P,A,B,0.01))
+    common.record('kernels','pi_het table (%i values)'%D.size,r*D.size,'values/s')
+    piTable.use(None)
+    shutil.rmtree(folder)
+
+    # kpdfInt over times x shape x scale x k
+    T1,C,TAU,K=np.meshgrid(times,cgs,taus,[0,0.001,0.005],indexing='ij')
+    r=common.rate(lambda: ut.kpdfInt(T1,T1+1,C,TAU,K))
+    common.record('kernels','kpdfInt vectorized (%i values)'%T1.size,r*T1.size,'values/s')
+    sub=slice(0,min(T1.size,2000))
+    T1s,Cs,TAUs,Ks=T1.ravel()[sub],C.ravel()[sub],TAU.ravel()[sub],K.ravel()[sub]
+    def scalar():
+        for i in xrange(len(T1s)):
+            ut.kpdfInt(T1s[i],T1s[i]+1,Cs[i],TAUs[i],Ks[i])
+    r=common.rate(scalar)
+    common.record('kernels','kpdfInt scalar',r*len(T1s),'values/s')
+
+if __name__=='__main__':
+    main(int(sys.argv[1]) if len(sys.argv)>1 else 20)
@@ -0,0 +1,60 @@
+""" Log-probability evaluations per second and end-to-end sampling iterations per second
+of each Model, on the bundled data and on simulated datasets with more hosts per dose
+(see common.scaledTimeData).
+
+A logp evaluation changes the values of all continuous parameters (alternating between
+two values, so that pymc's cache of the last values is not used and all likelihoods
+are computed again) and computes the log-probability of the whole model. Sampling runs
+M.sample with the model's default step methods, in memory (db='ram'), from the initial
+values of the priors.
+
+Usage (from the main folder):
+    python benchmarks/benchModels.py [niterations, default 200] [scales, default 1,4,16]
+"""
+import sys, time, shutil
+import common
+import utils as ut
+import dayEst, timeEst, timeTestHom, timeControlEst
+
+models=[('dayEst',dayEst,common.dayData,common.scaledDayData),
+        ('timeEst',timeEst,common.timeData,common.scaledTimeData),
+        ('timeTestHom',timeTestHom,common.timeData,common.scaledTimeData),
+        ('timeControlEst',timeControlEst,common.timeData,common.scaledTimeData)]
+
+def logpRate(mod):
+    """Log-probability evaluations per second, changing all continuous parameters at each evaluation."""
+    M=ut.py.MCMC(mod,db='ram')
+    pars=[getattr(mod,p) for p in mod.parameters if getattr(mod,p).value.dtype.kind=='f']
+    values=[[par.value for par in pars],[par.value*1.001 for par in pars]]
+    state={'i':0}
+    def evaluate():
+        state['i']^=1
+        for par,v in zip(pars,values[state['i']]):
+            par.value=v
+        return M.logp
+    return common.rate(evaluate)
+
+def samplingRate(mod,niterations):
+    """Sampling iterations per second."""
+    M=ut.py.MCMC(mod,db='ram')
+    t=time.time()
+    M.sample(niterations,progress_bar=False)
+    return niterations/(time.time()-t)
+
+def main(niterations=200,scales=(1,4,16)):
+    folder=common.tmpFolder()
+    try:
+        for name,model,bundled,scaled in models:
+            for scale in scales:
+                data=bundled() if scale==1 else scaled(scale)
+                case='%s %s'%(name,data.dataName)
+                mod=common.setup(model,data,folder)
+                common.record('logp',case,logpRate(mod),'evaluations/s')
+                common.record('sampling',case,samplingRate(mod,niterations),'iterations/s')
+    finally:
+        shutil.rmtree(folder)
+
+if __name__=='__main__':
+    niterations=int(sys.argv[1]) if len(sys.argv)>1 else 200
+    scales=[int(s) for s in sys.argv[2].split(',')] if len(sys.argv)>2 else (1,4,16)
+    main(niterations,scales)
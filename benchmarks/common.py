@@ -0,0 +1,92 @@
+""" Shared functions of the benchmarks: paths, datasets, timing and the results file.
+
+Results of every benchmark are appended to ./benchmarks/results.csv (tab-separated),
+one line per measure, with the date, git revision and host, so that performance can
+be tracked over time.
+"""
+import sys, os, time, datetime, platform, subprocess, tempfile
+import numpy as np
+
+ROOT=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Priors are imported as lib.priors.X, relative to the main folder
+os.chdir(ROOT)
+sys.path.insert(0,ROOT)
+sys.path.insert(0,os.path.join(ROOT,'lib'))
+import matplotlib
+matplotlib.use('Agg')
+import dataFunctions as df
+
+RESULTS=os.path.join(ROOT,'benchmarks','results.csv')
+COLUMNS=['date','revision','host','python','benchmark','case','value','unit']
+
+# Parameter values used to simulate the scaled-up datasets (close to the estimates
+# from the bundled data)
+PARAMS={'p':2e-6,'a2':0.5,'b2':2.,'eps':0.001,'meanU':117.,'sU':120.,'k':0.0012,
+        'meanI1':22.,'sI1':12.,'meanI2':26.,'sI2':12.}
+
+def revision():
+    try:
+        return subprocess.check_output(['git','rev-parse','--short','HEAD'],cwd=ROOT,stderr=open(os.devnull,'w')).strip()
+    except (OSError,subprocess.CalledProcessError):
+        return 'unknown'
+
+def record(benchmark,case,value,unit):
+    """Appends a measure to the results file and prints it."""
+    bNew=not os.path.exists(RESULTS)
+    f=open(RESULTS,'a')
+    if bNew:
+        f.write('\t'.join(COLUMNS)+'\n')
+    f.write('\t'.join([datetime.datetime.now().strftime('%Y-%m-%d %H:%M'),revision(),platform.node(),
+                       platform.python_version(),benchmark,case,'%.6g'%value,unit])+'\n')
+    f.close()
+    print "%-22s %-40s %12.6g %s"%(benchmark,case,value,unit)
+
+def rate(fn,minTime=0.5,repeats=3):
+    """Calls per second of fn (best of repeats, each running for at least minTime)."""
+    best=0
+    for r in range(repeats):
+        n=0
+        t0=time.time()
+        while True:
+            fn()
+            n+=1
+            dt=time.time()-t0
+            if dt>=minTime:
+                break
+        best=max(best,n/dt)
+    return best
+
+def timeData():
+    """Bundled survival data."""
+    return df.TimeData.fromCSV('./data/Wneg.csv','./data/Wpos.csv','wolb2012')
+
+def dayData():
+    """Bundled day-mortality data."""
+    return df.DayData.fromCSV('./data/wolb2012_day30.csv','wolb2012')
+
+def scaledTimeData(scale,seed=0):
+    """Survival data simulated with the design of the bundled data, with scale times
+more hosts per dose."""
+    d=timeData()
+    np.random.seed(seed)
+    return df.TimeData.fromSimulation(PARAMS,d.doses,d.nhosts1*scale,d.nhosts2*scale,d.times,'wolb2012x%i'%scale)
+
+def scaledDayData(scale,seed=0):
+    """Day-mortality data simulated with the design of the bundled data, with scale
+times more hosts per dose."""
+    d=dayData()
+    np.random.seed(seed)
+    return df.DayData.fromSimulation(PARAMS,d.doses,d.nhosts1*scale,d.nhosts2*scale,'wolb2012x%i'%scale)
+
+def setup(model,data,folder):
+    """Sets a model up in folder, from the initial values of its priors. The priors
+modules hold the stochastics of the model: they are imported again, so that the model
+does not share them with (and sampling does not compute the likelihoods of) the
+models set up before it in this process."""
+    for name in [n for n in sys.modules if n.startswith('lib.priors.')]:
+        del sys.modules[name]
+    return model.Model.setup(data,savePath=folder,bOverWrite=True,bRandomIni=False)
+
+def tmpFolder():
+    """Temporary folder for the results of the benchmarked models."""
+    return tempfile.mkdtemp(prefix='benchmark_')
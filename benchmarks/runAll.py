@@ -0,0 +1,19 @@
+""" Runs all benchmarks, results are appended to ./benchmarks/results.csv.
+
+Usage (from the main folder):
+    python benchmarks/runAll.py [--quick]
+With --quick, smaller grids, shorter runs and shorter traces (to check that the
+benchmarks run, not to compare results).
+"""
+import sys
+import common
+import benchKernels, benchModels, benchCalcPosterior
+
+if '--quick' in sys.argv:
+    benchKernels.main(10)
+    benchModels.main(20,(1,4))
+    benchCalcPosterior.main((10,20))
+else:
+    benchKernels.main()
+    benchModels.main()
+    benchCalcPosterior.main()
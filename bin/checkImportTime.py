@@ -0,0 +1,39 @@
+""" Checks the import time of the modules in ./lib against a budget.
+
+Each module is imported in a fresh python process (best of a few repeats), and the
+slow optional dependencies (pymc, matplotlib, scipy.stats...) should not have been
+imported: they are loaded lazily, only by the code paths that need them (see
+utils.lazyImport). Exits with status 1 if a module is over budget.
+
+Usage (from the main folder):
+    python bin/checkImportTime.py [budget in seconds, default 0.3]
+"""
+import sys, subprocess
+
+modules=['utils','dataFunctions','modelFunctions','timeEst','timeGroupsEst','timeReplicatesEst','dayEst','timeTestHom','timeControlEst','smc','loo']
+lazy=['pymc','matplotlib','pylab','mpl_toolkits.axes_grid1','scipy.stats','scipy.integrate']
+budget=float(sys.argv[1]) if len(sys.argv)>1 else 0.3
+repeats=3
+
+code="""import sys, time
+sys.path.append('lib')
+t=time.time()
+import %s
+t=time.time()-t
+print t
+print ' '.join([m for m in %r if m in sys.modules])
+"""
+
+bOver=False
+print '\t'.join(['Module','time (s)','slow modules imported'])
+for mod in modules:
+    times=[]
+    for r in range(repeats):
+        out=subprocess.check_output([sys.executable,'-c',code%(mod,lazy)]).split('\n')
+        times.append(float(out[0]))
+        loaded=out[1]
+    t=min(times)
+    bOver|=(t>budget)|(loaded!='')
+    print '\t'.join([mod,'%.3f'%t,loaded if loaded else '-'])+('\tOVER BUDGET' if (t>budget)|(loaded!='') else '')
+
+sys.exit(1 if bOver else 0)
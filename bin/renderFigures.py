@@ -0,0 +1,20 @@
+""" Renders the figures of a results folder, from the posterior calculations saved by
+calcPosterior (e.g. after mod.calcPosterior(bPlot=False) in a batch run).
+
+Usage (from the main folder):
+    python bin/renderFigures.py modelName resultsFolder [figFormat]
+Example:
+    python bin/renderFigures.py timeEst ./results/wolb2012_timeEst/
+"""
+import sys, os, glob
+sys.path.append('lib')
+import render
+
+modelName=sys.argv[1]
+path=sys.argv[2]
+figFormat=sys.argv[3] if len(sys.argv)>3 else 'png'
+
+for f in sorted(glob.glob(os.path.join(path,'*-postcalc.pickle'))):
+    saveTo=f[:-len('-postcalc.pickle')]
+    print "Rendering figures of "+os.path.basename(saveTo)
+    render.renderFigures(modelName,saveTo,figFormat=figFormat)
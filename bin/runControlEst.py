@@ -8,7 +8,6 @@ Parameters estimated:
 from matplotlib import use
 use('Agg') # To save figures to disk, comment to have figures as pop-ups
 import sys
-import pymc as py
 # Import libraries
 sys.path.append('lib')
 import timeControlEst as controlEst
@@ -24,15 +23,23 @@ burnin=0
 thinF=1
 
 mod=controlEst.Model.setup(data,bRandomIni=False, bOverWrite=True)
-M=py.MCMC(mod,db='pickle', dbname=mod.saveTo+'-MCMC.pickle')
-M.sample(niterations, burnin, thinF)
-M.db.close()
+M=mod.sample(niterations, burnin, thinF)
+
+# Alternatively, instead of guessing niterations, burnin and thinF, sample parallel chains until
+# split R-hat and effective sample sizes reach their targets (burnin and thinF are then saved 
+# with the results and used by calcPosterior):
+#mod.sampleUntilConverged(nchains=4,rhatMax=1.01,essMin=400)
+
+# With only a few parameters, the posterior can also be evaluated over an adaptive grid instead 
+# of sampled (faster, and without Monte Carlo error; the weighted grid is then used by calcPosterior):
+#mod.gridPosterior(nprocs=4)
 
 # Check traces
+#import pymc as py
 #py.Matplot.plot(M,path=mod.path)
 
 # The following can always be done in a later session using the folder to the results:
-# mod= timeControlEst.savedModel(folder)
+# mod= timeControlEst.Model.savedModel(folder)
 
 # Posterior calculations and plots. see mod.calcPosterior documentation for help
 # Burnin can be also be set to 0 above, and thinning to 1, and be determined only after analysing the traces
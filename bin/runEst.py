@@ -21,8 +21,6 @@ Assumptions:
 from matplotlib import use
 use('Agg') # To save figures to disk, comment to have figures as pop-ups
 import sys
-import pickle
-import pymc as py
         
 # Import libraries
 sys.path.append('lib')
@@ -30,6 +28,8 @@ import timeEst
 
 # Import Data - see TimeData documentation for more information: help(timeEst.TimeData)
 data=timeEst.TimeData.fromCSV(dataPath1='./data/Wneg.csv',dataPath2='./data/Wpos.csv',dataName='wolb2012')
+# Alternatively, keep a binary copy of the data next to the csv files, read again only when they change:
+#data=timeEst.TimeData.fromCache('./data/wolb2012.dat','./data/Wneg.csv','./data/Wpos.csv','wolb2012')
 
 # Initialize model - see Model documentation for more information: help(timeEst.Model)
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -39,20 +39,64 @@ burnin=0
 thinF=1
 
 mod=timeEst.Model.setup(data=data,bRandomIni=False, bOverWrite=True)
-M=py.MCMC(mod,db='pickle', dbname=mod.saveTo+'-MCMC.pickle')
-M.sample(niterations, burnin, thinF)
-M.db.close()
+# Time spent in each stage (sampling, posterior calculations, figures...) is saved in '-runReport.json'.
+# To also profile some stages with cProfile (saved in the results folder as profile-<stage>.prof):
+#import instrument
+#instrument.profile(['sampling','posterior calculations'],mod.path)
+M=mod.sample(niterations, burnin, thinF)
+# The infection parameters (p, a2, b2, eps and the numbers of infected hosts) mix slower than the
+# mortality parameters, and their updates are cheaper: to update them several times per iteration
+#M=mod.sample(niterations, burnin, thinF, infectionSteps=5)
+# The proposals rejected, and why (outside the prior, potentials, Metropolis ratio), are printed
+# after sampling. Many proposals of p, a2, b2, meanI and sI fall outside their priors: sample them
+# on the log scale instead, and reflect the proposals of the numbers of infected hosts at 0 and n:
+#mod=timeEst.Model.setup(data=data,bRandomIni=False, bOverWrite=True, priorsFile='priors_timeEstReparam')
+#M=mod.sample(niterations, burnin, thinF, bReflect=True)
+
+# Alternatively, instead of guessing niterations, burnin and thinF, sample parallel chains until
+# split R-hat and effective sample sizes reach their targets (burnin and thinF are then saved 
+# with the results and used by calcPosterior):
+#mod.sampleUntilConverged(nchains=4,rhatMax=1.01,essMin=400)
+
+# For long runs that may be interrupted (e.g. on preemptible nodes), sample with periodic checkpoints
+# instead of mod.sample above, and resume an interrupted run from its results folder:
+#import checkpoint
+#checkpoint.sample(mod,niterations,burnin,thinF)
+#mod=checkpoint.resume(folder,'timeEst')
 
 # Check traces
+#import pymc as py
 #py.Matplot.plot(M,path=mod.path)
 
+# For long runs, store the traces compactly (numbers of infected hosts as 1 or 2 byte integers, the
+# quantities that are only plotted as float32, compressed) in '-MCMC.npz', used from then on instead
+# of '-MCMC.pickle' (the file sizes and load times of both are printed):
+#mod.compactTraces(bFloat32=True,bCompress=True,bRemove=True)
+
 # The following can always be done in a later session using the folder to the results:
-# mod= timeEst.savedModel(folder)
+# mod= timeEst.Model.savedModel(folder)
+# Runs are recorded in an index of the results folder (./results/runs.sqlite), to find the folders of
+# the runs of a dataset, model and priors (most recent first) without opening each of them:
+#import runIndex
+#folder=runIndex.find(data=data,model='timeEst',priorsFile='priors_timeEst')[0]['path']
+# (folders of results saved before the index are added with runIndex.scan())
 
 # Posterior calculations and plots. see mod.calcPosterior documentation for help
 # Burnin can be also be set to 0 above, and thinning to 1, and be determined only after analysing the traces
 # In such cases, set burnin and thinF parameters in the call below.
 mod.calcPosterior()
+# For batch runs, skip the figures (only csv files and posterior calculations are saved) and render them 
+# later, in parallel, with: python bin/renderFigures.py timeEst folder
+#mod.calcPosterior(bPlot=False)
 
 # The posterior samples of parameter called X (see in priors) can be accessed in mod.Xs
 # For example, the posterior samples of p are in mod.ps 
+
+# For model comparison, set up the model with bPointwise=True (saves the log-likelihood of each
+# observation in the traces) and estimate the out-of-sample predictive accuracy (also saved in '-loo.csv'):
+#res=mod.looWaic(burnin,thinF)
+
+# Prior sensitivity: reweight the posterior samples to the priors of another file in ./lib/priors
+# (e.g. a copy of priors_timeEst.py with a wider prior for eps), without sampling again.
+# Results are saved with the suffix '-reweighted_'+priorsFile, check the effective sample size.
+#res=mod.reweight('priors_timeEst_wideEps',burnin,thinF)
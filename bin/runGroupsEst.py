@@ -0,0 +1,36 @@
+""" Estimation of infection and mortality parameters from survival over time of several
+groups (e.g. fly lines) compared to a reference group, in a single run.
+
+Parameters estimated: as in runEst.py, with ag, bg, meanIg, sIg for each group g>1
+(see help(timeGroupsEst.Model)). The mortality parameters of uninfected hosts (meanU,
+sU, k) are shared by all groups.
+"""
+from matplotlib import use
+use('Agg') # To save figures to disk, comment to have figures as pop-ups
+import sys
+
+# Import libraries
+sys.path.append('lib')
+import timeGroupsEst
+
+# Import Data - one csv file per group, the reference group first (same format as for runEst.py)
+# see help(timeGroupsEst.GroupsTimeData)
+data=timeGroupsEst.GroupsTimeData.fromCSV(['./data/Wneg.csv','./data/Wpos.csv'],'wolb2012',groupNames=['Wolbachia-','Wolbachia+'])
+
+# Initialize model - see Model documentation for more information: help(timeGroupsEst.Model)
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+niterations=5
+burnin=0
+thinF=1
+
+mod=timeGroupsEst.Model.setup(data=data,bRandomIni=False, bOverWrite=True)
+M=mod.sample(niterations, burnin, thinF)
+
+# Alternatively, sample parallel chains until convergence targets are met:
+#mod.sampleUntilConverged(nchains=4,rhatMax=1.01,essMin=400)
+
+# The following can always be done in a later session using the folder to the results:
+# mod= timeGroupsEst.Model.savedModel(folder)
+
+# Posterior calculations and plots. see mod.calcPosterior documentation for help
+mod.calcPosterior()
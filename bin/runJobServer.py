@@ -0,0 +1,32 @@
+""" Local service running fits submitted as jobs (see lib/jobQueue.py), on a pool of worker
+processes that keep the libraries imported between jobs.
+
+Usage (from the folder of DISE):
+    python bin/runJobServer.py [nworkers] [port]
+
+Jobs are then submitted, followed and cancelled over HTTP (http://127.0.0.1:8750/jobs), or from
+python with the functions of jobQueue.
+"""
+from matplotlib import use
+use('Agg')
+import sys
+
+sys.path.append('lib')
+import jobQueue
+
+nworkers=int(sys.argv[1]) if len(sys.argv)>1 else 2
+port=int(sys.argv[2]) if len(sys.argv)>2 else 8750
+jobQueue.serve(port=port,nworkers=nworkers)
+
+# Example, from another session:
+#import jobQueue
+#job={'model':'timeEst',
+#     'data':{'class':'TimeData','method':'fromCSV','kwargs':{'dataPath1':'./data/Wneg.csv','dataPath2':'./data/Wpos.csv','dataName':'wolb2012'}},
+#     'setup':{'bRandomIni':False},
+#     'sampler':{'method':'sample','kwargs':{'niterations':300000,'burnin':100000,'thinF':100}},
+#     'calcPosterior':{'bPlot':False}}
+#jid=jobQueue.submit(job,priority=1)
+#jobQueue.stream(jid)       # prints the output of the job until it ends
+#jobQueue.status(jid)['result']['path']
+#jobQueue.cancel(jid)
+# or with curl: curl -d @job.json http://127.0.0.1:8750/jobs, curl http://127.0.0.1:8750/jobs/1/stream
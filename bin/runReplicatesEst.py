@@ -0,0 +1,38 @@
+""" Joint estimation of infection and mortality parameters from replicate experiments
+of survival over time, with partial pooling of the parameters across replicates.
+
+Parameters estimated: those of runEst.py for each replicate (X_rR), and their mean and
+standard deviation on the log scale across replicates (mu_X, sd_X), see
+help(timeReplicatesEst.Model).
+"""
+from matplotlib import use
+use('Agg') # To save figures to disk, comment to have figures as pop-ups
+import sys
+
+# Import libraries
+sys.path.append('lib')
+import timeReplicatesEst
+
+# Import Data - one pair of csv files (group 1, group 2) per replicate, in the format of runEst.py
+# see help(timeReplicatesEst.ReplicatesTimeData)
+data=timeReplicatesEst.ReplicatesTimeData.fromCSV([('./data/Wneg.csv','./data/Wpos.csv')],'wolb2012')
+# or read all experiments of a long-format file (columns experiment, group, dose, day, alive):
+#data=timeReplicatesEst.ReplicatesTimeData.fromLongCSV('./data/wolb2012_long.csv','wolb2012')
+
+# Initialize model - see Model documentation for more information: help(timeReplicatesEst.Model)
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+niterations=5
+burnin=0
+thinF=1
+
+mod=timeReplicatesEst.Model.setup(data=data,bRandomIni=False, bOverWrite=True)
+M=mod.sample(niterations, burnin, thinF)
+
+# Alternatively, sample parallel chains until convergence targets are met:
+#mod.sampleUntilConverged(nchains=4,rhatMax=1.01,essMin=400)
+
+# The following can always be done in a later session using the folder to the results:
+# mod= timeReplicatesEst.Model.savedModel(folder)
+
+# Posterior calculations and plots. see mod.calcPosterior documentation for help
+mod.calcPosterior()
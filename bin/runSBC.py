@@ -0,0 +1,28 @@
+""" Simulation-based calibration of the sampler configuration (niterations, burnin, thinF).
+
+Parameters are drawn from the prior distributions, datasets with the same design as
+the observed data are simulated and fitted in parallel. For a calibrated
+configuration, the rank histograms of all parameters should be uniform.
+"""
+from matplotlib import use
+use('Agg') # To save figures to disk, comment to have figures as pop-ups
+import sys
+
+# Import libraries
+sys.path.append('lib')
+import timeEst
+import sbc
+
+# Template data, simulated datasets have the same doses, number of hosts and days of observation
+data=timeEst.TimeData.fromCSV(dataPath1='./data/Wneg.csv',dataPath2='./data/Wpos.csv',dataName='wolb2012')
+
+# Sampler configuration to check
+nsims=100
+niterations=20000
+burnin=10000
+thinF=100
+
+res=sbc.runSBC('timeEst',data,nsims=nsims,niterations=niterations,burnin=burnin,thinF=thinF)
+
+# The rank histograms are saved in ./results/sbc_timeEst, and the p-values of uniformity in res['pvalues']
+print res['pvalues']
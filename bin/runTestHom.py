@@ -21,7 +21,6 @@ Assumptions:
 from matplotlib import use
 use('Agg') # To save figures to disk, comment to have figures as pop-ups
 import sys
-import pymc as py
 
 # Import libraries
 sys.path.append('lib')
@@ -38,15 +37,19 @@ burnin=0
 thinF=1
 
 mod=testHom.Model.setup(data,bRandomIni=False, bOverWrite=True)
-M=py.MCMC(mod,db='pickle', dbname=mod.saveTo+'-MCMC.pickle')
-M.sample(niterations, burnin, thinF)
-M.db.close()
+M=mod.sample(niterations, burnin, thinF)
+
+# Alternatively, instead of guessing niterations, burnin and thinF, sample parallel chains until
+# split R-hat and effective sample sizes reach their targets (burnin and thinF are then saved 
+# with the results and used by calcPosterior):
+#mod.sampleUntilConverged(nchains=4,rhatMax=1.01,essMin=400)
 
 # Check traces
+#import pymc as py
 #py.Matplot.plot(M,path=mod.path)
 
 # The following can always be done in a later session using the folder to the results:
-# mod= timeTestHom.savedModel(folder)
+# mod= timeTestHom.Model.savedModel(folder)
 
 # Posterior calculations and plots. see mod.calcPosterior documentation for help
 # Burnin can be also be set to 0 above, and thinning to 1, and be determined only after analysing the traces
@@ -55,3 +58,7 @@ mod.calcPosterior()
 
 # The posterior samples of parameter called X (see in priors) can be accessed in mod.Xs
 # For example, the posterior samples of p are in mod.ps 
+
+# Quantitative comparison of the homogeneous and heterogeneous models of each group:
+# log evidences and Bayes factors estimated by sequential Monte Carlo (also saved in '-evidence.csv')
+#evid=mod.evidence(nparticles=1000)
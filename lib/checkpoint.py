@@ -0,0 +1,146 @@
+""" MCMC sampling with periodic checkpoints, and resuming of interrupted runs.
+
+The sampler runs by chunks of iterations. After each chunk:
+- the samples kept from the chunk (after burn-in and thinning) are written to a new
+trace chunk file in the results folder (mod.saveTo+'-trace%05i.pickle'), files
+already written are never rewritten;
+- the state of the sampler is written to mod.saveTo+'-checkpoint.pickle': values of
+all stochastics, state of the step methods (adaptive proposal scales, acceptance
+counts), state of the random number generator and number of iterations done. The
+file is first written to a temporary file and renamed, so that a crash while
+writing leaves the previous checkpoint intact.
+
+The number of iterations per chunk grows when writing a checkpoint takes more than
+maxOverhead of the time spent sampling the chunk, so that the checkpoint overhead
+stays bounded.
+
+When all iterations are done, the chunks are gathered in the usual pickle database
+(mod.saveTo+'-MCMC.pickle', see Models.loadMCMC) and removed.
+
+Example:
+    mod=timeEst.Model.setup(data)
+    checkpoint.sample(mod,niterations=300000,burnin=100000,thinF=100)
+    # After a crash or preemption, in a new session:
+    mod=checkpoint.resume('./results/wolb2012_timeEst/','timeEst')
+"""
+import os, pickle, importlib, numpy as np
+import instrument as ins
+
+def _checkpointFile(mod):
+    return mod.saveTo+'-checkpoint.pickle'
+
+def _chunkFile(mod,ci):
+    return mod.saveTo+'-trace%05i.pickle'%ci
+
+def _dump(obj,filename):
+    """Writes obj to filename atomically (write to a temporary file, then rename)."""
+    tmp=filename+'.tmp'
+    f=open(tmp,'wb')
+    pickle.dump(obj,f,pickle.HIGHEST_PROTOCOL)
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.rename(tmp,filename)
+
+def _restoreState(M,state):
+    """Restores the values of the stochastics and the state of the step methods."""
+    for s in M.stochastics:
+        if s.__name__ in state['stochastics']:
+            s.value=state['stochastics'][s.__name__]
+    M.assign_step_methods()
+    for sm in set(sum([list(M.step_method_dict[s]) for s in M.stochastics],[])):
+        sm.__dict__.update(state['step_methods'].get(sm._id,{}))
+    np.random.set_state(state['random'])
+
+def _run(mod,M,ck,maxOverhead,verbose):
+    """Samples the remaining iterations of the checkpoint ck."""
+    niterations,burnin,thinF=ck['niterations'],ck['burnin'],ck['thinF']
+    while ck['iteration']<niterations:
+        start=ck['iteration']
+        n=min(ck['chunkSize'],niterations-start)
+        ins.start('sampling')
+        M.sample(n,tune_interval=min(n,1000),progress_bar=False)
+        ts=ins.stop('sampling')
+        ins.count('iterations',n)
+        ins.start('checkpoints')
+
+        # Iterations kept, as pymc's sample(niterations,burnin,thinF)
+        its=np.arange(start,start+n)
+        keep=(its>=burnin)&((its-burnin)%thinF==0)
+        chunk=dict([(name,np.asarray(M.trace(name,chain=-1)[:])[keep]) for name in M.db.trace_names[-1]])
+        for name in M.db.trace_names[-1]:
+            M.db._traces[name]._trace[M.db.chains-1]=None
+        if keep.any():
+            _dump(chunk,_chunkFile(mod,len(ck['chunks'])))
+            ck['chunks'].append(os.path.basename(_chunkFile(mod,len(ck['chunks']))))
+
+        ck['iteration']=start+n
+        state=M.get_state()
+        ck['stochastics']=state['stochastics']
+        ck['step_methods']=state['step_methods']
+        ck['random']=np.random.get_state()
+        _dump(ck,_checkpointFile(mod))
+        tc=ins.stop('checkpoints')
+        if tc>maxOverhead*ts:
+            ck['chunkSize']*=2
+        if verbose:
+            print "Checkpoint at iteration %i of %i (%.1fs sampling, %.2fs checkpoint)"%(ck['iteration'],niterations,ts,tc)
+
+    # Gather the chunks in a pickle database with a single chain
+    chunks=[pickle.load(open(os.path.join(mod.path,c),'rb')) for c in ck['chunks']]
+    traces={}
+    for name in chunks[0] if chunks else []:
+        traces[name]={0:np.concatenate([c[name] for c in chunks])}
+    pickle.dump(traces,open(mod.saveTo+'-MCMC.pickle','wb'),pickle.HIGHEST_PROTOCOL)
+    for c in ck['chunks']:
+        os.remove(os.path.join(mod.path,c))
+    os.remove(_checkpointFile(mod))
+    mod.updateMetadata(niterations=niterations)
+    ins.fileWritten(mod.saveTo+'-MCMC.pickle')
+    ins.writeReport(mod.saveTo+'-runReport.json',mod.runStart)
+    mod.indexRun(settings={'sampler':'MCMC with checkpoints','burnin':burnin,'thinF':thinF})
+    print "Finished sampling, traces saved in "+mod.name+'-MCMC.pickle'
+    return M
+
+def sample(mod,niterations,burnin=0,thinF=1,chunkSize=1000,maxOverhead=0.05,verbose=True):
+    """Samples with checkpoints (see module documentation).
+
+Input:
+- mod (Model): model to sample from, e.g. from timeEst.Model.setup.
+- niterations, burnin, thinF (int): as for pymc's MCMC.sample. The burn-in and
+thinning are applied to the saved traces.
+- chunkSize (int): initial number of iterations between checkpoints.
+- maxOverhead (float): maximum time spent writing checkpoints, as a fraction of the
+time spent sampling.
+- verbose (bool): print each checkpoint.
+
+Returns the pymc MCMC object.
+"""
+    import pymc as py
+    M=py.MCMC(mod,db='ram')
+    ck={'niterations':niterations,'burnin':burnin,'thinF':thinF,'iteration':0,'chunkSize':chunkSize,'chunks':[]}
+    return _run(mod,M,ck,maxOverhead,verbose)
+
+def resume(path,modelName,maxOverhead=0.05,verbose=True):
+    """Resumes an interrupted run from its results folder.
+
+Input:
+- path (str): results folder of the run.
+- modelName (str): name of the model module, e.g. 'timeEst'.
+- maxOverhead (float), verbose (bool): see sample.
+
+Returns the model, with the traces saved as after an uninterrupted run.
+"""
+    import pymc as py
+    model=importlib.import_module(modelName)
+    mod=model.Model.savedModel(path,bLoadTraces=False)
+    ck=pickle.load(open(_checkpointFile(mod),'rb'))
+    M=py.MCMC(mod,db='ram')
+    _restoreState(M,ck)
+    # Chunks written after the last checkpoint are discarded
+    for c in os.listdir(mod.path):
+        if c.startswith(mod.name+'-trace') and c not in ck['chunks']:
+            os.remove(os.path.join(mod.path,c))
+    print "Resuming %s at iteration %i of %i"%(mod.name,ck['iteration'],ck['niterations'])
+    _run(mod,M,ck,maxOverhead,verbose)
+    return mod
@@ -0,0 +1,269 @@
+""" Convergence diagnostics and sampling until convergence with parallel chains.
+
+Diagnostics follow Vehtari, Gelman, Simpson, Carpenter and Burkner (2021):
+- splitRhat: rank-normalized split R-hat (maximum of the bulk and folded versions).
+- essBulk: effective sample size of the rank-normalized split chains.
+- essTail: minimum of the effective sample sizes of the 5% and 95% quantiles.
+
+sampleUntilConverged runs independent chains of a model in worker processes. Each
+chain samples chunks of iterations and streams them to a ConvergenceMonitor in the
+main process. Sampling stops as soon as, for every parameter and after discarding
+the first half of each chain as burn-in, R-hat is below rhatMax and both ESS are
+above essMin. The traces of all chains are saved as a pickle database (one chain
+per key, see Models.loadMCMC) and the chosen burn-in and thinning factor are saved
+in the model metadata, where Models.calcPosterior picks them up.
+
+Worker processes are forked (Unix) and sample from a copy of the model.
+"""
+import multiprocessing, pickle, numpy as np
+import scipy.stats as st
+import instrument as ins
+
+def _autocovariance(x):
+    """Autocovariance of each row of x, computed with FFT."""
+    n=x.shape[1]
+    x=x-x.mean(1)[:,None]
+    nfft=2**int(np.ceil(np.log2(2*n)))
+    f=np.fft.rfft(x,nfft)
+    return np.fft.irfft(f*np.conj(f),nfft)[:,:n]/n
+
+def _split(chains):
+    """Splits each chain (rows) in two halves."""
+    chains=np.asarray(chains,float)
+    half=chains.shape[1]//2
+    return np.concatenate([chains[:,:half],chains[:,chains.shape[1]-half:]])
+
+def _rankNormalize(chains):
+    r=st.rankdata(chains.ravel()).reshape(chains.shape)
+    return st.norm.ppf((r-0.375)/(chains.size+0.25))
+
+def _rhat(chains):
+    m,n=chains.shape
+    W=chains.var(1,ddof=1).mean()
+    B=n*chains.mean(1).var(ddof=1)
+    if W==0:
+        return 1. if B==0 else np.inf
+    return (((n-1.)/n*W+B/n)/W)**0.5
+
+def _ess(chains):
+    m,n=chains.shape
+    if n<4:
+        return np.nan
+    acov=_autocovariance(chains)
+    W=acov[:,0].mean()*n/(n-1.)
+    varPlus=W*(n-1.)/n
+    if m>1:
+        varPlus+=chains.mean(1).var(ddof=1)
+    if varPlus==0:
+        return float(m*n)
+    rho=1-(W-acov.mean(0))/varPlus
+    rho[0]=1
+    # Geyer's initial monotone sequence
+    npairs=n//2
+    P=rho[:2*npairs].reshape(npairs,2).sum(1)
+    neg=np.nonzero(P<=0)[0]
+    if len(neg):
+        P=P[:neg[0]]
+    P=np.minimum.accumulate(P)
+    tau=max(-1+2*P.sum(),1./np.log10(m*n))
+    return m*n/tau
+
+def splitRhat(chains):
+    """Rank-normalized split R-hat of chains (one chain per row)."""
+    s=_split(chains)
+    folded=np.abs(s-np.median(s))
+    return max(_rhat(_rankNormalize(s)),_rhat(_rankNormalize(folded)))
+
+def essBulk(chains):
+    """Bulk effective sample size of chains (one chain per row)."""
+    return _ess(_rankNormalize(_split(chains)))
+
+def essTail(chains):
+    """Tail effective sample size of chains (one chain per row): minimum of the
+effective sample sizes of the 5% and 95% quantiles."""
+    s=_split(chains)
+    q=np.percentile(s,[5,95])
+    return min(_ess((s<=q[0]).astype(float)),_ess((s<=q[1]).astype(float)))
+
+class ConvergenceMonitor(object):
+    """ Collects chunks of traces streamed from parallel chains and computes
+convergence diagnostics on the second half of the chains.
+
+Input:
+- names (list of str): names of the parameters to monitor.
+- nchains (int): number of chains.
+- rhatMax (float): maximum split R-hat for convergence.
+- essMin (float): minimum bulk and tail effective sample sizes for convergence.
+"""
+    def __init__(self,names,nchains,rhatMax=1.01,essMin=400):
+        self.names=names
+        self.nchains=nchains
+        self.rhatMax=rhatMax
+        self.essMin=essMin
+        self.chunks=[{} for c in range(nchains)]
+
+    def add(self,chain,chunk):
+        """Adds a chunk (dict of arrays, one per traced variable) to a chain."""
+        for n,v in chunk.items():
+            self.chunks[chain].setdefault(n,[]).append(np.asarray(v))
+
+    def trace(self,chain,name):
+        """Returns the whole trace of a variable for a chain."""
+        chunks=self.chunks[chain][name]
+        if len(chunks)>1:
+            # Concatenate once, later chunks are appended to the result
+            self.chunks[chain][name]=chunks=[np.concatenate(chunks)]
+        return chunks[0]
+
+    def niterations(self):
+        """Number of iterations of the shortest chain."""
+        return min([len(self.trace(c,self.names[0])) for c in range(self.nchains)])
+
+    def diagnose(self):
+        """Returns the convergence diagnostics of each parameter, after discarding
+the first half of the chains, as a dictionnary {name: (rhat, essBulk, essTail)}."""
+        n=self.niterations()
+        burnin=n//2
+        res={}
+        for name in self.names:
+            chains=np.array([self.trace(c,name)[burnin:n] for c in range(self.nchains)],float)
+            chains=chains.reshape(chains.shape[0],chains.shape[1],-1)
+            # Multivariate nodes: worst element
+            diags=[(splitRhat(chains[:,:,j]),essBulk(chains[:,:,j]),essTail(chains[:,:,j])) for j in range(chains.shape[2])]
+            res[name]=(max([d[0] for d in diags]),min([d[1] for d in diags]),min([d[2] for d in diags]))
+        return res
+
+    def converged(self,diags):
+        """Have all parameters reached the targets?"""
+        return all([(d[0]<=self.rhatMax)&(d[1]>=self.essMin)&(d[2]>=self.essMin) for d in diags.values()])
+
+    def thinning(self,diags):
+        """Burn-in (first half of the chains) and thinning factor keeping about one
+sample per effective sample (bulk) of the worst parameter, and at least essMin
+samples."""
+        n=self.niterations()
+        burnin=n//2
+        ess=min([d[1] for d in diags.values()])
+        thinF=max(1,int(self.nchains*(n-burnin)/max(ess,self.essMin)))
+        return burnin,thinF
+
+def _redraw(M,mod):
+    """Draws new values of the parameters of mod from their prior distributions (latent
+variables from the new values of their parents), until the posterior is not zero.
+The nodes are kept: setting the likelihood up again (Models.resetParameters) would
+add nodes to the same priors, and change the posterior."""
+    import pymc as py
+    stochs=[getattr(mod,par) for par in mod.parameters if hasattr(getattr(mod,par,None),'random')]
+    while True:
+        [s.random() for s in stochs]
+        try:
+            if np.isfinite(M.logp):
+                return
+        except py.ZeroProbability:
+            pass
+
+def _chainWorker(conn,mod,chain,seed,chunkSize):
+    """Samples one chain by chunks of chunkSize iterations while the main process asks
+for more. Runs in a worker process."""
+    import pymc as py
+    np.random.seed(seed)
+    M=py.MCMC(mod,db='ram')
+    if chain>0:
+        # Overdispersed initial values, chain 0 keeps those of the model
+        _redraw(M,mod)
+    while conn.recv():
+        M.sample(chunkSize,tune_interval=min(chunkSize,1000),progress_bar=False)
+        conn.send(dict([(n,np.asarray(M.trace(n,chain=-1)[:])) for n in M.db.trace_names[-1]]))
+        # Chunks already sent are freed in this process
+        for n in M.db.trace_names[-1]:
+            M.db._traces[n]._trace[M.db.chains-1]=None
+    conn.close()
+
+def sampleUntilConverged(mod,nchains=4,chunkSize=1000,minIterations=2000,maxIterations=200000,rhatMax=1.01,essMin=400,names=None,seed=None,verbose=True):
+    """Samples parallel chains until convergence (see module documentation).
+
+Input:
+- mod (Model): model to sample from, e.g. from timeEst.Model.setup.
+- nchains (int): number of chains, each in its own worker process.
+- chunkSize (int): number of iterations sampled by each chain between checks.
+- minIterations (int): minimum number of iterations per chain before checking.
+- maxIterations (int): maximum number of iterations per chain, sampling stops even
+if not converged.
+- rhatMax (float): maximum split R-hat.
+- essMin (float): minimum bulk and tail effective sample size.
+- names (list of str): parameters to monitor, defaults to mod.parameters.
+- seed (int): seed of the chains (chain i uses seed+i), random if None.
+- verbose (bool): print diagnostics at each check.
+
+Returns a dictionnary with:
+- converged (bool): were the targets met?
+- niterations, burnin, thinF (int): iterations per chain, chosen burn-in and thinning.
+- diagnostics (dict): {name: (rhat, essBulk, essTail)} at the last check.
+The traces are saved in mod.saveTo+'-MCMC.pickle', the diagnostics in
+'-convergence.csv'.
+"""
+    if names==None:
+        names=mod.parameters
+    if seed==None:
+        seed=np.random.randint(2**30)
+    monitor=ConvergenceMonitor(names,nchains,rhatMax,essMin)
+    conns=[]
+    procs=[]
+    for c in range(nchains):
+        parent,child=multiprocessing.Pipe()
+        p=multiprocessing.Process(target=_chainWorker,args=(child,mod,c,seed+c,chunkSize))
+        p.start()
+        conns.append(parent)
+        procs.append(p)
+
+    diags={}
+    bConverged=False
+    ins.start('sampling')
+    try:
+        while True:
+            for conn in conns:
+                conn.send(True)
+            for c,conn in enumerate(conns):
+                monitor.add(c,conn.recv())
+            n=monitor.niterations()
+            if n<min(minIterations,maxIterations):
+                continue
+            with ins.stage('convergence diagnostics'):
+                diags=monitor.diagnose()
+            bConverged=monitor.converged(diags)
+            if verbose:
+                worst=max(diags,key=lambda k: diags[k][0])
+                print "%i iterations per chain: max R-hat %.3f (%s), min bulk ESS %.0f, min tail ESS %.0f"%(n,diags[worst][0],worst,min([d[1] for d in diags.values()]),min([d[2] for d in diags.values()]))
+            if bConverged or n>=maxIterations:
+                break
+    finally:
+        for conn in conns:
+            try:
+                conn.send(False)
+            except IOError:
+                pass
+        for p in procs:
+            p.join()
+        ins.stop('sampling')
+
+    if not bConverged:
+        print "Warning: convergence targets not met after %i iterations per chain."%n
+    burnin,thinF=monitor.thinning(diags)
+
+    traces={}
+    for name in monitor.chunks[0]:
+        traces[name]=dict([(c,monitor.trace(c,name)[:n]) for c in range(nchains)])
+    pickle.dump(traces,open(mod.saveTo+'-MCMC.pickle','wb'),pickle.HIGHEST_PROTOCOL)
+
+    f=open(mod.saveTo+'-convergence.csv','w')
+    f.write('\t'.join(['Parameter','R-hat','bulk ESS','tail ESS'])+'\n')
+    for name in names:
+        f.write('\t'.join([name,'%.3f'%diags[name][0],'%.0f'%diags[name][1],'%.0f'%diags[name][2]])+'\n')
+    f.close()
+    mod.updateMetadata(niterations=n,nchains=nchains,burnin=burnin,thinF=thinF,converged=bConverged)
+    ins.count('iterations',n*nchains)
+    ins.fileWritten(mod.saveTo+'-MCMC.pickle')
+    ins.writeReport(mod.saveTo+'-runReport.json',mod.runStart)
+    mod.indexRun(settings={'sampler':'MCMC until converged','chunkSize':chunkSize,'rhatMax':rhatMax,'essMin':essMin})
+    print "Sampled %i chains of %i iterations, burn-in %i and thinning factor %i, see "%(nchains,n,burnin,thinF)+mod.name+'-convergence.csv'
+    return {'converged':bConverged,'niterations':n,'burnin':burnin,'thinF':thinF,'diagnostics':diags}
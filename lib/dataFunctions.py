@@ -1,20 +1,234 @@
-""" Includes all functions relative to reading/saving data. """
-import csv, pickle
+""" Includes all functions relative to reading/saving data. 
+
+Data objects can be saved in a binary container (see Data.save), read back with 
+memory mapping (Data.fromBinary), and cached next to their csv files (Data.fromCache):
+- a first line 'DISEDATA1', the length of the header (8 bytes), and a JSON header 
+with the class, the non-array attributes, the dtype, shape and offset of each array, 
+a content hash (sha1 of the attributes and of the bytes of the arrays), and the size, 
+modification time and sha1 of the source files.
+- the arrays, each aligned on 64 bytes.
+
+The arrays of Data objects are read-only, so that copies (Data.copy, models built
+from the same data, TimeData.reduce) share them instead of copying them.
+"""
+import pickle, json, hashlib, os, struct
 import numpy as np
-from copy import deepcopy
 import utils as ut
 
+_MAGIC='DISEDATA1\n'
+_ALIGN=64
+
 class Data(object):
     @classmethod
     def fromPickle(DayData,filename):
-        saved=pickle.load(open(filename))
+        saved=pickle.load(open(filename,'rb'))
         return DayData(**saved)
     
     def copy(self):
-        return self.__class__(**self.__dict__)
+        """Returns a copy that shares the (read-only) arrays of this object: attributes
+        can be replaced in the copy without changing this object."""
+        data=self.__class__.__new__(self.__class__)
+        data.__dict__.update([(k,_readonly(v)) for k,v in self.__dict__.items()])
+        return data
+    
+    def contentHash(self):
+        """Returns the sha1 of the content of the data (class, attributes and arrays), 
+        without the paths of the files it was read from (see runIndex)."""
+        arrays=[]
+        attrs=_withoutPaths(_encode(self,arrays,''))
+        return _hash(attrs,[a for k,a in arrays])
     
     def pickle(self, filename):
-        pickle.dump(self.__dict__,open(filename,'w'))
+        pickle.dump(self.__dict__,open(filename,'wb'),pickle.HIGHEST_PROTOCOL)
+    
+    def save(self,filename,sources=None):
+        """Saves the data in a binary container (see the documentation of this module).
+
+        Input:
+        - filename (str): path of the container.
+        - sources (list of str): files the data was read from, to detect when the 
+        container is out of date. Defaults to the dataPath attributes.
+        """
+        arrays=[]
+        attrs=_encode(self,arrays,'')
+        if sources==None:
+            sources=_dataPaths(self)
+        header={'format':1,'attrs':attrs,'arrays':[],
+                'sources':dict([(os.path.abspath(p),_fileInfo(p)) for p in sources if p and os.path.isfile(p)])}
+        offset=0
+        for key,arr in arrays:
+            header['arrays'].append({'key':key,'dtype':arr.dtype.str,'shape':list(arr.shape),'offset':offset})
+            offset+=-(-arr.nbytes//_ALIGN)*_ALIGN
+        header['hash']=_hash(attrs,[a for k,a in arrays])
+        text=json.dumps(header,sort_keys=True)
+        start=-(-(len(_MAGIC)+8+len(text))//_ALIGN)*_ALIGN
+        tmp=filename+'.tmp'
+        f=open(tmp,'wb')
+        f.write(_MAGIC+struct.pack('<Q',len(text))+text)
+        for (key,arr),a in zip(arrays,header['arrays']):
+            f.seek(start+a['offset'])
+            f.write(arr.tobytes())
+        f.close()
+        os.rename(tmp,filename)
+    
+    @classmethod
+    def fromBinary(Data,filename,bVerify=True):
+        """Loads data saved with save. Arrays are memory mapped (read-only), and only 
+        read from disk when used.
+
+        Input:
+        - filename (str): path of the container.
+        - bVerify (bool): check the content hash (True, default), raises DataError if 
+        the container is corrupted. This reads all the arrays from disk: with False,
+        arrays are only read when used.
+
+        Returns a Data object of the class that was saved (prints a warning if the 
+        source files changed since, see isStale).
+        """
+        header,start=_readHeader(filename)
+        arrays={}
+        for a in header['arrays']:
+            shape=tuple(a['shape'])
+            if np.prod(shape)==0:
+                arrays[a['key']]=_readonly(np.empty(shape,a['dtype']))
+            else:
+                arrays[a['key']]=np.memmap(filename,dtype=a['dtype'],mode='r',offset=start+a['offset'],shape=shape)
+        if bVerify and _hash(header['attrs'],[arrays[a['key']] for a in header['arrays']])!=header['hash']:
+            raise DataError("%s is corrupted (content hash does not match), read the data again from the csv files."%filename)
+        if _staleSources(header['sources']):
+            print "Warning: the source files of %s changed since it was saved (%s)."%(filename,', '.join(_staleSources(header['sources'])))
+        data=_decode(header['attrs'],arrays)
+        if not isinstance(data,Data):
+            raise DataError("%s contains a %s, not a %s."%(filename,data.__class__.__name__,Data.__name__))
+        return data
+    
+    @staticmethod
+    def isStale(filename):
+        """Returns True if the container is missing, or if any of its source files 
+        changed since it was saved."""
+        if not os.path.exists(filename):
+            return True
+        return bool(_staleSources(_readHeader(filename)[0]['sources']))
+    
+    @classmethod
+    def fromCache(Data,cacheFile,*args,**kwargs):
+        """Loads the data from the binary container cacheFile if it is up to date with
+        its source files. Else, reads the data with fromCSV(*args,**kwargs) and saves 
+        it to cacheFile. The content hash of an up to date container is not checked 
+        (see fromBinary), so that its arrays are only read from disk when used.
+
+        Example:
+            data=TimeData.fromCache('./data/wolb2012.dat','./data/Wneg.csv','./data/Wpos.csv','wolb2012')
+        """
+        if not Data.isStale(cacheFile):
+            try:
+                return Data.fromBinary(cacheFile,bVerify=False)
+            except DataError, e:
+                print "Warning: %s, reading the csv files again."%e
+        data=Data.fromCSV(*args,**kwargs)
+        # Sources from the dataPath attributes, also when fromCSV takes lists of paths
+        data.save(cacheFile)
+        return data
+
+def _readonly(value):
+    """Returns value with read-only arrays (also in lists and Data objects). Arrays 
+    that are read-only (of other Data objects, or memory mapped) are shared, others are
+    copied once, as the caller may still modify them."""
+    if isinstance(value,np.ndarray):
+        if value.flags.writeable:
+            value=value.copy()
+            value.flags.writeable=False
+        return value
+    if isinstance(value,(list,tuple)):
+        return [_readonly(v) for v in value]
+    if isinstance(value,Data):
+        return value.copy()
+    return value
+
+def _encode(value,arrays,key):
+    """JSON-compatible description of value, with its arrays appended to arrays."""
+    if isinstance(value,Data):
+        return {'__data__':value.__class__.__name__,'attrs':dict([(k,_encode(v,arrays,key+'/'+k)) for k,v in value.__dict__.items()])}
+    if isinstance(value,np.ndarray):
+        if value.dtype.hasobject:
+            raise DataError("Cannot save array %s of objects."%key)
+        arrays.append((key,np.ascontiguousarray(value)))
+        return {'__array__':key}
+    if isinstance(value,(list,tuple)):
+        return [_encode(v,arrays,'%s/%i'%(key,i)) for i,v in enumerate(value)]
+    if isinstance(value,np.generic):
+        return value.item()
+    return value
+
+def _decode(value,arrays):
+    if isinstance(value,dict) and '__array__' in value:
+        return arrays[value['__array__']]
+    if isinstance(value,dict) and '__data__' in value:
+        data=globals()[value['__data__']].__new__(globals()[value['__data__']])
+        data.__dict__.update(dict([(str(k),_decode(v,arrays)) for k,v in value['attrs'].items()]))
+        return data
+    if isinstance(value,list):
+        return [_decode(v,arrays) for v in value]
+    if isinstance(value,unicode):
+        return str(value)
+    return value
+
+def _hash(attrs,arrays):
+    h=hashlib.sha1(json.dumps(attrs,sort_keys=True))
+    for arr in arrays:
+        h.update(arr.dtype.str+str(arr.shape))
+        h.update(np.ascontiguousarray(arr).tobytes())
+    return h.hexdigest()
+
+def _withoutPaths(value):
+    """Encoded data (see _encode) without its dataPath attributes."""
+    if isinstance(value,dict) and '__data__' in value:
+        return {'__data__':value['__data__'],'attrs':dict([(k,_withoutPaths(v)) for k,v in value['attrs'].items() if not k.startswith('dataPath')])}
+    if isinstance(value,list):
+        return [_withoutPaths(v) for v in value]
+    return value
+
+def _dataPaths(value):
+    """Paths of the files the data was read from (dataPath... attributes)."""
+    paths=[]
+    if isinstance(value,Data):
+        for k,v in value.__dict__.items():
+            if k.startswith('dataPath'):
+                paths+=[v] if isinstance(v,str) else [p for p in (v or []) if isinstance(p,str)]
+            else:
+                paths+=_dataPaths(v)
+    elif isinstance(value,(list,tuple)):
+        for v in value:
+            paths+=_dataPaths(v)
+    return sorted(set(paths))
+
+def _fileInfo(path):
+    h=hashlib.sha1(open(path,'rb').read()).hexdigest()
+    return {'size':os.path.getsize(path),'mtime':os.path.getmtime(path),'sha1':h}
+
+def _staleSources(sources):
+    """Source files that changed (files that no longer exist are not checked)."""
+    stale=[]
+    for path,info in sorted(sources.items()):
+        if not os.path.isfile(path):
+            continue
+        if os.path.getsize(path)!=info['size'] or (os.path.getmtime(path)!=info['mtime'] and _fileInfo(path)['sha1']!=info['sha1']):
+            stale.append(path)
+    return stale
+
+def _readHeader(filename):
+    """Returns the header of a binary container and the offset of its arrays."""
+    f=open(filename,'rb')
+    magic=f.read(len(_MAGIC))
+    if magic!=_MAGIC:
+        f.close()
+        raise DataError("%s is not a binary data container."%filename)
+    n=struct.unpack('<Q',f.read(8))[0]
+    text=f.read(n)
+    f.close()
+    if len(text)!=n:
+        raise DataError("%s is truncated."%filename)
+    return json.loads(text),-(-(len(_MAGIC)+8+n)//_ALIGN)*_ALIGN
 
 class DayData(Data):
     """ Prepares data recorded a fixed amount of time after challenge for model definition. Initialize
@@ -36,7 +250,7 @@ class DayData(Data):
     """
     def __init__(self, response1, response2,nhosts1,nhosts2,doses,dataName):
         for v in ['response1','response2','nhosts1','nhosts2','doses','dataName']:
-            setattr(self,v,deepcopy(eval(v)))
+            setattr(self,v,_readonly(eval(v)))
             
     
     @classmethod
@@ -59,34 +273,59 @@ class DayData(Data):
 
         Returns a Data object. 
         """
-        reader=csv.reader(open(dataPath))
-        l=np.array(list(reader))
-        names=['group','dose','response','nhosts']
-        if bool(set(names).difference(set(['group','dose','response','nhosts']))):
-            print "The column labels do not correspond exactly to {group, dose, response, nhosts}. Please check that order of the data in the columns is correct."
-        else:
-            names=l[0]
-        
-        grouped={}
-        for i in range(len(l[0])):
-            grouped[names[i]]=l[1:,i]
-        
-        grouped['group']=grouped['group'].astype(int)
-        grouped['dose']=grouped['dose'].astype(float)
-        grouped['response']=grouped['response'].astype(int)
-        grouped['nhosts']=grouped['nhosts'].astype(int)
+        cols,names=ut.readTable(dataPath,[('group',int),('dose',float),('response',int),('nhosts',int)])
+        sel1=cols['group']==1
+        sel2=cols['group']==2
+        (doses1,response1,nhosts1)=[cols[c][sel1] for c in ('dose','response','nhosts')]
+        (doses2,response2,nhosts2)=[cols[c][sel2] for c in ('dose','response','nhosts')]
         
-        doses1=grouped['dose'][grouped['group']==1]
-        doses2=grouped['dose'][grouped['group']==2]
-        response1=grouped['response'][grouped['group']==1]
-        response2=grouped['response'][grouped['group']==2]
-        nhosts1=grouped['nhosts'][grouped['group']==1]
-        nhosts2=grouped['nhosts'][grouped['group']==2]
-        
-        if np.any(doses1!=doses2):
+        if len(doses1)!=len(doses2) or np.any(doses1!=doses2):
             raise DataError("Doses not the same in two datasets, please check the data")
         
         return DayData(response1, response2,nhosts1,nhosts2,doses1,dataName)
+    
+    @classmethod
+    def fromLongCSV(DayData,dataPath,day,dataName=None):
+        """Prepares the data of all experiments of a long-format file, with the
+        response observed at a given day (see TimeData.fromLongCSV for the format).
+
+        Input:
+        - dataPath (str): path to the long-format csv file.
+        - day (int): day of observation, the response is the number of hosts dead by then.
+        - dataName (str): prefix of the names of the experiments, which are named 
+        after the experiment column if None.
+
+        Returns a list of DayData objects, one per experiment.
+        """
+        res=[]
+        for name,doses,times,alive in _longExperiments(dataPath,dataName,2):
+            if day not in times:
+                raise DataError("Day %i not observed in experiment %s of %s"%(day,name,dataPath))
+            response=alive[:,:,0]-alive[:,:,list(times).index(day)]
+            res.append(DayData(response[0],response[1],alive[0,:,0],alive[1,:,0],doses,name))
+        return res
+    
+    @classmethod
+    def fromSimulation(DayData,params,doses,nhosts1,nhosts2,dataName):
+        """Simulates the response of hosts challenged with each dose, in both groups.
+
+        Input:
+        - params (dict): values of p, a2, b2 and eps (see priors_dayEst).
+        - doses (float arr): doses used to challenge hosts, 0 for control.
+        - nhosts1, nhosts2 (int arr): number of hosts challenged with each dose in 
+        group 1 (homogeneous) and group 2 (heterogeneous).
+        - dataName (str): descriptor of the simulated data.
+
+        Returns a DayData object. 
+        """
+        doses=np.asarray(doses,float)
+        nhosts1=np.asarray(nhosts1,int)
+        nhosts2=np.asarray(nhosts2,int)
+        pi1=ut.pi_hom(doses,params['p'],params['eps'])*(doses>0)
+        pi2=ut.pi_het(doses,params['p'],params['a2'],params['b2'],params['eps'])*(doses>0)
+        response1=np.random.binomial(nhosts1,pi1)
+        response2=np.random.binomial(nhosts2,pi2)
+        return DayData(response1, response2,nhosts1,nhosts2,doses,dataName)
 
 
 
@@ -105,22 +344,10 @@ class TimeData(Data):
     - dataPath1, dataPath2 (str): file from which the data was read.
     """
     def __init__(self,timesDeath1,timesDeath2,survivors1,survivors2,nhosts1,nhosts2,tmax,times,doses,ndoses,dataName,dataPath1,dataPath2, alldata=None):
-        
-        self.timesDeath1=deepcopy(timesDeath1)
-        self.timesDeath2=deepcopy(timesDeath2)
-        self.survivors1=deepcopy(survivors1)
-        self.survivors2=deepcopy(survivors2)
-        self.nhosts1=deepcopy(nhosts1)
-        self.nhosts2=deepcopy(nhosts2)        
-        self.tmax=deepcopy(tmax)
-        self.times=deepcopy(times)
-        self.doses=deepcopy(doses)
-        self.ndoses=deepcopy(ndoses)
-        self.dataName=deepcopy(dataName)
-        self.dataPath1=deepcopy(dataPath1)
-        self.dataPath2=deepcopy(dataPath2)
+        for v in ['timesDeath1','timesDeath2','survivors1','survivors2','nhosts1','nhosts2','tmax','times','doses','ndoses','dataName','dataPath1','dataPath2']:
+            setattr(self,v,_readonly(eval(v)))
         if alldata:
-            self.alldata=alldata
+            self.alldata=alldata.copy()
     
     @classmethod
     def fromCSV(TimeData,dataPath1,dataPath2, dataName):
@@ -155,23 +382,222 @@ class TimeData(Data):
         
         return TimeData(timesDeath1,timesDeath2,survivors1,survivors2,nhosts1,nhosts2,tmax1,times1,doses1,ndoses1,dataName,dataPath1,dataPath2)         
     
+    @classmethod
+    def fromLongCSV(TimeData,dataPath,dataName=None):
+        """Prepares the data of all experiments of a long-format file, read in one pass.
+
+            Input:
+            - dataPath (str): path to a csv file with a header line and one line per 
+            count of hosts alive, with columns experiment (name of the experiment), 
+            group (1 or 2), dose, day (from 0, the number of challenged hosts) and alive 
+            (number of hosts alive at that day). Each experiment can have its own doses 
+            and days of observation, but each group and dose should be observed at 
+            every day of the experiment.
+            - dataName (str): prefix of the names of the experiments, which are named 
+            after the experiment column if None.
+
+            Returns a list of TimeData objects, one per experiment.
+        """
+        res=[]
+        for name,doses,times,alive in _longExperiments(dataPath,dataName,2):
+            timesDeath1,timesDeath2=[ut.deathTimes(times,alive[gi]) for gi in (0,1)]
+            res.append(TimeData(timesDeath1,timesDeath2,alive[0,:,-1],alive[1,:,-1],alive[0,:,0],alive[1,:,0],times[-1],times,doses,len(doses),name,dataPath,dataPath))
+        return res
+    
+    @classmethod
+    def fromSimulation(TimeData,params,doses,nhosts1,nhosts2,times,dataName):
+        """Simulates survival over time of hosts challenged with each dose, in both groups.
+
+        Each host is infected with the probability given by the homogeneous (group 1) 
+        or heterogeneous (group 2) model. Its time to death is the first of a Gamma 
+        distributed time (infected or old-age) and a time-independent Uniform [0,1/k] 
+        death, and is observed at the first day in times on or after it.
+
+            Input:
+            - params (dict): values of p, a2, b2, eps, meanU, sU, k, meanI1, sI1, meanI2 
+            and sI2 (see priors_timeEst).
+            - doses (float arr): doses used to challenge hosts, 0 for control.
+            - nhosts1, nhosts2 (int arr): number of hosts challenged with each dose.
+            - times (int arr): days of observation, starting from 0.
+            - dataName (str): descriptor of the simulated data.
+
+            Returns a TimeData object. 
+        """
+        doses=np.asarray(doses,float)
+        times=np.asarray(times,int)
+        tmax=times[-1]
+        pis=[ut.pi_hom(doses,params['p'],params['eps'])*(doses>0),
+             ut.pi_het(doses,params['p'],params['a2'],params['b2'],params['eps'])*(doses>0)]
+        res=[]
+        for gi,nhosts in enumerate([nhosts1,nhosts2]):
+            nhosts=np.asarray(nhosts,int)
+            infected=np.random.binomial(nhosts,pis[gi])
+            meanI=params['meanI%i'%(gi+1)]
+            sI=params['sI%i'%(gi+1)]
+            timesDeath=[]
+            survivors=np.zeros(len(doses),int)
+            for di in xrange(len(doses)):
+                n=nhosts[di]
+                # The first infected[di] hosts are infected, the others die of old-age
+                s=np.where(np.arange(n)<infected[di],sI,params['sU'])
+                mean=np.where(np.arange(n)<infected[di],meanI,params['meanU'])
+                tdeath=np.minimum(np.random.gamma(s,mean/s),np.random.uniform(0,1./params['k'],n))
+                tdeath=tdeath[tdeath<=tmax]
+                survivors[di]=n-len(tdeath)
+                timesDeath.append(np.sort(times[np.searchsorted(times,tdeath)]))
+            res.append((timesDeath,survivors,nhosts))
+        
+        ((timesDeath1,survivors1,nhosts1),(timesDeath2,survivors2,nhosts2))=res
+        return TimeData(timesDeath1,timesDeath2,survivors1,survivors2,nhosts1,nhosts2,tmax,times,doses,len(doses),dataName,None,None)
+    
     def reduce(self,index):
-        """ Retain only data from one dose, for example control (index=(data.doses==0) ). """
+        """ Retain only data from one dose, for example control (index=(data.doses==0) ).
+        The times of death are those of the first dose retained. The full data is kept
+        in alldata, which shares the arrays of this object (nothing is copied but the 
+        arrays of the retained dose). """
         alldata=self.copy()
         data=alldata
         d=self
-        alldata.nhosts1=data.nhosts1.astype(float)
-        alldata.nhosts2=data.nhosts2.astype(float)
-        d.nhosts1=data.nhosts1.astype(float)[data.doses==0]
-        d.nhosts2=data.nhosts2.astype(float)[data.doses==0]
-        d.timesDeath1=np.array(data.timesDeath1)[data.doses==0][0]
-        d.timesDeath2=np.array(data.timesDeath2)[data.doses==0][0]
-        d.survivors1=data.survivors1[data.doses==0]
-        d.survivors2=data.survivors2[data.doses==0]
-        d.doses=data.doses[data.doses==0]
+        index=np.asarray(index)
+        alldata.nhosts1=_readonly(data.nhosts1.astype(float))
+        alldata.nhosts2=_readonly(data.nhosts2.astype(float))
+        d.nhosts1=_readonly(data.nhosts1[index])
+        d.nhosts2=_readonly(data.nhosts2[index])
+        d.timesDeath1=[t for t,b in zip(data.timesDeath1,index) if b][0]
+        d.timesDeath2=[t for t,b in zip(data.timesDeath2,index) if b][0]
+        d.survivors1=_readonly(data.survivors1[index])
+        d.survivors2=_readonly(data.survivors2[index])
+        d.doses=_readonly(data.doses[index])
         d.ndoses=len(d.doses)
         self.alldata=alldata
 
+class GroupsTimeData(Data):
+    """Stores data from survival over time of any number of groups challenged with the
+    same doses (e.g. several fly lines compared to one reference line).
+
+    Properties:
+    - timesDeath (list of lists of arrays): observed times of deaths for each group
+    and each dose.
+    - survivors (int arr): number of survivors up to tmax (groups x doses).
+    - nhosts (int arr): number of challenged hosts (groups x doses).
+    - tmax (int): last day of observation
+    - times (int arr): an array with days. Starts from 0 (day of challenge) to tmax.
+    - doses (float arr): an array with the doses used to challenge hosts.
+    - ndoses (int): number of doses.
+    - ngroups (int): number of groups, the first one is the reference group.
+    - groupNames (list of str): names of the groups, used in figures.
+    - dataPaths (list of str): files from which the data was read.
+    """
+    def __init__(self,timesDeath,survivors,nhosts,tmax,times,doses,ndoses,ngroups,dataName,dataPaths,groupNames=None):
+        for v in ['timesDeath','survivors','nhosts','tmax','times','doses','ndoses','ngroups','dataName','dataPaths']:
+            setattr(self,v,_readonly(eval(v)))
+        if groupNames==None:
+            groupNames=['group %i'%(gi+1) for gi in range(ngroups)]
+        self.groupNames=list(groupNames)
+
+    @classmethod
+    def fromCSV(GroupsTimeData,dataPaths,dataName,groupNames=None):
+        """Prepares data of survival over time of several groups for model definition.
+
+            Input:
+            - dataPaths (list of str): paths to csv files corresponding to the survival
+            over time of each group, the first one being the reference group. Each file
+            has the same format as for TimeData.fromCSV, with the same doses and days of
+            observation.
+            - dataName (str): descriptive text string, with no spaces, used to name
+            folder and files of saved results (ex: 'wolb2012').
+            - groupNames (list of str): names of the groups, defaults to 'group 1',
+            'group 2'...
+
+            Returns a GroupsTimeData object.
+        """
+        read=[ut.readcsv(path) for path in dataPaths]
+        (timesDeath,survivors,tmax,times,doses,ndoses,nhosts)=zip(*read)
+        for gi in range(1,len(dataPaths)):
+            if ~((tmax[gi]==tmax[0])&(len(times[gi])==len(times[0]))&(sum(times[gi]==times[0])==len(times[0]))):
+                raise DataError("Times of observation not the same in all datasets, please check the data in %s and %s"%(dataPaths[0],dataPaths[gi]))
+            if ~((ndoses[gi]==ndoses[0])&(sum(doses[gi]==doses[0])==ndoses[0])):
+                raise DataError("Doses not the same in all datasets, please check the data in %s and %s"%(dataPaths[0],dataPaths[gi]))
+
+        return GroupsTimeData(list(timesDeath),np.array(survivors),np.array(nhosts),tmax[0],times[0],doses[0],ndoses[0],len(dataPaths),dataName,list(dataPaths),groupNames)
+
+    @classmethod
+    def fromTimeData(GroupsTimeData,data,groupNames=None):
+        """Returns the data of both groups of a TimeData object as a GroupsTimeData."""
+        return GroupsTimeData([data.timesDeath1,data.timesDeath2],np.array([data.survivors1,data.survivors2]),
+                              np.array([data.nhosts1,data.nhosts2]),data.tmax,data.times,data.doses,data.ndoses,2,
+                              data.dataName,[data.dataPath1,data.dataPath2],groupNames)
+
+    @classmethod
+    def fromLongCSV(GroupsTimeData,dataPath,dataName=None):
+        """Prepares the data of all experiments of a long-format file (see
+        TimeData.fromLongCSV for the format, with groups 1, 2, 3...).
+
+        Returns a list of GroupsTimeData objects, one per experiment.
+        """
+        res=[]
+        for name,doses,times,alive in _longExperiments(dataPath,dataName):
+            timesDeath=[ut.deathTimes(times,alive[gi]) for gi in range(len(alive))]
+            res.append(GroupsTimeData(timesDeath,alive[:,:,-1],alive[:,:,0],times[-1],times,doses,len(doses),len(alive),name,[dataPath]))
+        return res
+
+    def deathCounts(self):
+        """Returns the number of deaths in each interval between days of observation
+        (groups x doses x times, where index ti counts the deaths in
+        ]times[ti-1],times[ti]], the first column is 0)."""
+        counts=np.zeros((self.ngroups,self.ndoses,len(self.times)),int)
+        for gi in range(self.ngroups):
+            for di in range(self.ndoses):
+                counts[gi,di]=np.bincount(np.searchsorted(self.times,self.timesDeath[gi][di]).astype(int),minlength=len(self.times))
+        return counts
+
+class ReplicatesTimeData(Data):
+    """Stores data from replicate experiments of survival over time of two groups,
+    each with its own doses and days of observation.
+
+    Properties:
+    - replicates (list of TimeData): data of each replicate.
+    - nreplicates (int): number of replicates.
+    - dataName (str): descriptor of the data, the names of the replicates are those
+    of each TimeData.
+    """
+    def __init__(self,replicates,dataName,nreplicates=None):
+        self.replicates=[r.copy() for r in replicates]
+        self.nreplicates=len(replicates)
+        self.dataName=dataName
+
+    @classmethod
+    def fromCSV(ReplicatesTimeData,dataPaths,dataName):
+        """Prepares data of replicate experiments for model definition.
+
+            Input:
+            - dataPaths (list of (str, str)): paths to the csv files of group 1 and group 2
+            of each replicate, in the format of TimeData.fromCSV.
+            - dataName (str): descriptive text string, with no spaces, used to name
+            folder and files of saved results (ex: 'wolb2012'). Replicates are named
+            dataName+'_r1', dataName+'_r2'...
+
+            Returns a ReplicatesTimeData object.
+        """
+        return ReplicatesTimeData([TimeData.fromCSV(path1,path2,'%s_r%i'%(dataName,ri+1)) for ri,(path1,path2) in enumerate(dataPaths)],dataName)
+
+    @classmethod
+    def fromLongCSV(ReplicatesTimeData,dataPath,dataName):
+        """Prepares the experiments of a long-format file as replicates (see 
+        TimeData.fromLongCSV for the format)."""
+        return ReplicatesTimeData(TimeData.fromLongCSV(dataPath,dataName),dataName)
+
+def _longExperiments(dataPath,dataName=None,ngroups=None):
+    """Reads a long-format file (see TimeData.fromLongCSV) and returns (name, doses, 
+    times, alive) for each experiment, with alive as groups x doses x times."""
+    res=[]
+    for experiment,groups,doses,times,alive in ut.readLong(dataPath):
+        name=experiment if dataName==None else '%s_%s'%(dataName,experiment)
+        if ngroups!=None and list(groups)!=range(1,ngroups+1):
+            raise DataError("Experiment %s of %s should have groups %s"%(experiment,dataPath,', '.join([str(g) for g in range(1,ngroups+1)])))
+        res.append((name,doses,times,alive))
+    return res
+
 class DataError(Exception):
     """ Throw an exception in case the data isn't in the correct format."""
     def __init__( self, value ):
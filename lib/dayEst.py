@@ -9,8 +9,10 @@ Parameters estimated:
 
 # Import libraries
 from copy import deepcopy
-import pickle, pymc as py, numpy as np, scipy as sc, scipy.special as sp, scipy.stats as st, pylab as pl, sys, os, importlib, shutil
+import pickle, numpy as np, scipy as sc, scipy.special as sp, sys, os, importlib, shutil
 import utils as ut
+# Slow to import, loaded when first used (see utils.lazyImport)
+py,st,pl=ut.py,ut.st,ut.pl
 import modelFunctions as mf
 import dataFunctions as df
 
@@ -31,18 +33,22 @@ Possible plots:
 """
     __defaultPrior__='priors_dayEst'
     __defaultName__='_dayEst'
+    # Figures rendered after the posterior calculations (see render)
+    __figures__=['plotPosterior']
+    # Parameters evaluated on a log scale by gridPosterior
+    __gridLog__=('p','a2','b2')
     #~~~~~~~~~~~~~~~~~~~~~~~~~#
     #~~ Setting up the MCMC ~~#
     #~~~~~~~~~~~~~~~~~~~~~~~~~#
     @ut.doc_inherit
-    def __init__(self,data, priors, name, path, bRandomIni):
+    def __init__(self,data, priors, name, path, bRandomIni, bPointwise=False):
         m=self
         d=data
         self.d=d
         
         # The following are the variables needed for plots
         m.vals=('x2','pi1_ci','pi2_ci')
-        super(Model,self).__init__(data,priors,name,path,bRandomIni)
+        super(Model,self).__init__(data,priors,name,path,bRandomIni,bPointwise)
     
     @ut.doc_inherit
     def likelihood_setup(self,bRandomIni):
@@ -62,6 +68,16 @@ Possible plots:
             m.L1=py.Binomial('L1',n=d.nhosts1[d.doses>0].tolist(),p=m.pi1,value=d.response1[d.doses>0],observed=True)
             m.L2=py.Binomial('L2',n=d.nhosts2[d.doses>0].tolist(),p=m.pi2,value=d.response2[d.doses>0],observed=True)
             m.liks=['L1','L2']
+            
+            # Log-likelihood of each dose, for model comparison (see looWaic)
+            if m.bPointwise:
+                m.pointwiseGroups={'all':['ll1','ll2']}
+                for g in (1,2):
+                    n=getattr(d,'nhosts%i'%g)[d.doses>0]
+                    r=getattr(d,'response%i'%g)[d.doses>0]
+                    lbinom=sp.gammaln(n+1)-sp.gammaln(r+1)-sp.gammaln(n-r+1)
+                    setattr(m,'ll%i'%g,py.Lambda('ll%i'%g,lambda pi=getattr(m,'pi%i'%g),n=n,r=r,lbinom=lbinom: (lbinom+sp.xlogy(r,pi)+sp.xlog1py(n-r,-pi)).astype(np.float32),trace=True))
+                    m.pointwise['ll%i'%g]=np.ones(len(n),int)
             sum([getattr(m,l).logp for l in m.liks])
         except py.ZeroProbability, e:
             zeroprob=1
@@ -84,8 +100,8 @@ Possible plots:
         pi2_ci=np.zeros([3,len(x2)])
         nx=0
         for i in range(len(x2)):
-            pi1_ci[:,i]=ut.confint(ut.pi_hom(x2[i],ps,epss))
-            pi2_ci[:,i]=ut.confint(ut.pi_het(x2[i],ps ,a2s,b2s,epss))
+            pi1_ci[:,i]=ut.confint(ut.pi_hom(x2[i],ps,epss),self.weights)
+            pi2_ci[:,i]=ut.confint(ut.pi_het(x2[i],ps ,a2s,b2s,epss),self.weights)
             progBar.iter(1./len(x2))
         
         progBar.finish()
@@ -96,14 +112,31 @@ Possible plots:
             res[v]=eval(v)
         for v in self.parameters:
             res[v+'s']=eval(v+'s')
-        pickle.dump(res,open(self.saveTo+'-postcalc.pickle','w'))
-        
-        self.__plot__()
+        self.savePostcalc(res)
     
-    def __plot__(self):
+    def __plot__(self,bPlot=True,nprocs=1):
         print "Results will be saved in "+self.path
         self.write_vals()
-        self.plotPosterior()
+        if bPlot:
+            self.render(nprocs=nprocs)
+    
+    def logLikData(self):
+        """ Data of the vectorized likelihood (see logLik and gridPosterior). """
+        d=self.d
+        i=d.doses>0
+        return {'doses':d.doses[i],'nhosts':[d.nhosts1[i],d.nhosts2[i]],'response':[d.response1[i],d.response2[i]]}
+
+def logLik(thetas,data):
+    """Log-likelihood of the responses of both groups (the Binomial likelihoods L1 and L2
+of the model) for each row of thetas (p, a2, b2, eps), see Model.gridPosterior."""
+    p,a2,b2,eps=[v[:,None] for v in np.asarray(thetas,float).T]
+    doses=data['doses'][None,:]
+    res=0.
+    with np.errstate(all='ignore'):
+        for pi,n,r in zip([ut.pi_hom(doses,p,eps),ut.pi_het(doses,p,a2,b2,eps)],data['nhosts'],data['response']):
+            res=res+(sp.gammaln(n+1)-sp.gammaln(r+1)-sp.gammaln(n-r+1)+sp.xlogy(r,pi)+sp.xlog1py(n-r,-pi)).sum(1)
+    res[np.isnan(res)]=-np.inf
+    return res
 
 
 DayData=df.DayData
@@ -0,0 +1,180 @@
+""" Deterministic posterior of models with few parameters (e.g. timeControlEst, dayEst),
+evaluated over an adaptive grid instead of sampled with MCMC.
+
+The log-posterior is evaluated at the centres of the cells of a regular grid over a
+box around the posterior mode (on a log scale for positive parameters, see
+Models.gridPosterior). The box is found from the mode by moving along each parameter
+until the log-posterior drops by `drop`, and widened while its outer cells hold more
+than tol of the posterior mass (the posterior of correlated parameters is wider than
+their conditional profiles). The cells holding most of the mass are then split in
+2**ndim, nrefine times, so that the grid is fine where the posterior is.
+
+Each cell centre is a sample, weighted by the posterior mass of its cell (density x
+volume, normalized), as the importance weights of Models.reweight: write_vals and the
+posterior calculations use them. The sum of the masses estimates the marginal
+likelihood, and the change of the estimates at the last refinement their error.
+
+The log-posterior is evaluated for batches of cells at once (a function of an array,
+one row per cell, see smc.Evaluator to split it across worker processes), in chunks
+of chunkSize rows.
+"""
+import itertools, numpy as np
+from smc import logsumexp
+
+def findBox(logPost,u0,drop=15.,step=1e-3,maxDoublings=60,nbisect=30):
+    """Finds the mode of the log-posterior and a box around it.
+
+Input:
+- logPost (function): log-posterior density of each row of an array (-inf outside of
+its support).
+- u0 (float arr): starting point of the search for the mode.
+- drop (float): the box extends, along each parameter from the mode, to where the
+log-posterior is drop lower than at the mode (or to the edge of its support).
+- step (float): first step of the search, relative to the value at the mode (or
+absolute, for values smaller than 1).
+- maxDoublings, nbisect (int): the step is doubled until the log-posterior is lower
+than the threshold, then the threshold is located by bisection.
+
+Returns (mode, lower, upper, edges), edges (bool arr, 2 x nparameters) tells whether
+each bound (lower, upper) is the edge of the support of the posterior.
+"""
+    import scipy.optimize as so
+    u0=np.array(u0,float)
+    ndim=len(u0)
+    def f(u):
+        lp=logPost(np.atleast_2d(u))[0]
+        return -lp if np.isfinite(lp) else 1e300
+    mode=so.fmin(f,u0,xtol=1e-8,ftol=1e-10,maxiter=2000*ndim,maxfun=4000*ndim,disp=False)
+    lmax=-f(mode)
+    if lmax<-1e299:
+        raise ValueError("No parameter value with a non-zero posterior density found from %s."%u0)
+    threshold=lmax-drop
+    lower,upper=mode.copy(),mode.copy()
+    edges=np.zeros((2,ndim),bool)
+    for j in xrange(ndim):
+        h0=step*max(abs(mode[j]),1.)
+        for side,sgn in enumerate((-1,1)):
+            def lp(h):
+                u=mode.copy()
+                u[j]+=sgn*h
+                return logPost(u[None,:])[0]
+            # Steps doubled until below the threshold, then bisection between the last
+            # point above it (inner) and the first below (outer)
+            inner,outer=0.,h0
+            for it in xrange(maxDoublings):
+                if not lp(outer)>=threshold:
+                    break
+                inner,outer=outer,2*outer
+            for it in xrange(nbisect):
+                mid=(inner+outer)/2.
+                if lp(mid)>=threshold:
+                    inner=mid
+                else:
+                    outer=mid
+            edges[side,j]=not np.isfinite(lp(outer))
+            if side==0:
+                lower[j]=mode[j]-outer
+            else:
+                upper[j]=mode[j]+outer
+    return mode,lower,upper,edges
+
+def regularGrid(lower,upper,n):
+    """Returns the centres (ncells x ndim) and half-widths of the cells of a regular
+grid with n cells per dimension between lower and upper, and the index of each cell
+along each dimension."""
+    ndim=len(lower)
+    half=(np.asarray(upper,float)-lower)/(2.*n)
+    axes=[np.linspace(lower[j]+half[j],upper[j]-half[j],n) for j in xrange(ndim)]
+    idx=np.indices((n,)*ndim).reshape(ndim,-1).T
+    centres=np.array([axes[j][idx[:,j]] for j in xrange(ndim)]).T
+    return centres,np.tile(half,(len(centres),1)),idx
+
+def _weights(lp,half):
+    """Log of the posterior mass of each cell (not normalized) and normalized masses."""
+    with np.errstate(invalid='ignore'):
+        logm=lp+np.log(2*half).sum(1)
+    logm[np.isnan(logm)]=-np.inf
+    return logm,np.exp(logm-logsumexp(logm))
+
+def gridPosterior(logPost,lower,upper,edges=None,n=10,nrefine=3,tol=1e-4,maxExtend=10,maxCells=200000,chunkSize=20000,verbose=True):
+    """Evaluates the posterior over an adaptive grid.
+
+Input:
+- logPost (function): log-posterior density of each row of an array, -inf outside of
+its support.
+- lower, upper (float arr): box of the initial grid (see findBox).
+- edges (bool arr, 2 x ndim): whether each bound of the box is the edge of the
+support of the posterior (the box is not widened beyond it).
+- n (int): number of cells per dimension of the initial grid.
+- nrefine (int): number of refinements.
+- tol (float): fraction of the posterior mass allowed in the outer cells of the
+initial grid before it is widened, and left in cells that are not split at each
+refinement.
+- maxExtend (int): maximum number of times the initial grid is widened.
+- maxCells (int): maximum number of cells.
+- chunkSize (int): number of cells evaluated at once.
+- verbose (bool): print the number of cells and the estimates at each refinement.
+
+Returns a dictionnary with:
+- thetas (float arr): centre of each cell (ncells x ndim).
+- half (float arr): half-width of each cell along each dimension.
+- weights (float arr): normalized posterior mass of each cell.
+- logZ (float): log marginal likelihood (log of the sum of the masses).
+- logZs (list): logZ after each refinement.
+- means (list): posterior means after each refinement.
+- nevaluations (int): number of evaluations of the log-posterior.
+"""
+    lower,upper=np.array(lower,float),np.array(upper,float)
+    ndim=len(lower)
+    if edges is None:
+        edges=np.zeros((2,ndim),bool)
+    count=[0]
+    def evaluate(u):
+        count[0]+=len(u)
+        return np.concatenate([logPost(u[i:i+chunkSize]) for i in xrange(0,len(u),chunkSize)])
+
+    # Initial grid, widened while its outer cells hold more than tol of the mass
+    for it in xrange(maxExtend+1):
+        centres,half,idx=regularGrid(lower,upper,n)
+        lp=evaluate(centres)
+        if not np.isfinite(lp).any():
+            raise ValueError("The posterior density is zero over the whole grid.")
+        w=_weights(lp,half)[1]
+        width=upper-lower
+        bWidened=False
+        for j in xrange(ndim):
+            if not edges[0,j] and w[idx[:,j]==0].sum()>tol:
+                lower[j]-=width[j]/2.
+                bWidened=True
+            if not edges[1,j] and w[idx[:,j]==n-1].sum()>tol:
+                upper[j]+=width[j]/2.
+                bWidened=True
+        if not bWidened:
+            break
+
+    # Refinements: the cells holding 1-tol of the mass are split in 2**ndim
+    signs=np.array(list(itertools.product((-1,1),repeat=ndim)),float)
+    logZs=[]
+    means=[]
+    for level in xrange(nrefine+1):
+        logm,w=_weights(lp,half)
+        logZs.append(float(logsumexp(logm)))
+        means.append(np.dot(w,centres))
+        if verbose:
+            print "Grid posterior: %i cells, log marginal likelihood %.4f"%(len(centres),logZs[-1])
+        if level==nrefine:
+            break
+        order=np.argsort(-w)
+        nsplit=min(np.searchsorted(np.cumsum(w[order]),1-tol)+1,(maxCells-len(centres))//(len(signs)-1))
+        if nsplit<=0:
+            break
+        split=order[:nsplit]
+        h=half[split]/2.
+        newCentres=(centres[split][:,None,:]+signs[None,:,:]*h[:,None,:]).reshape(-1,ndim)
+        keep=np.ones(len(centres),bool)
+        keep[split]=False
+        centres=np.concatenate([centres[keep],newCentres])
+        half=np.concatenate([half[keep],np.repeat(h,len(signs),0)])
+        lp=np.concatenate([lp[keep],evaluate(newCentres)])
+    return {'thetas':centres,'half':half,'weights':w,'logZ':logZs[-1],'logZs':logZs,
+            'means':means,'nevaluations':count[0]}
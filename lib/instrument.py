@@ -0,0 +1,126 @@
+""" Timers, counters and profiling of the stages of a run, saved as a JSON run report.
+
+Stages (setup, random initialization, sampling, loading traces, each phase of the
+posterior calculations, figures...) are timed with stage(), as a context manager:
+    with instrument.stage('sampling'):
+        M.sample(niterations)
+Counters (calls of the kernels pi_het and kpdfInt, retries of the random
+initialization, logp evaluations...) are incremented with count(), and the bytes
+read and written with the files they come from or go to with fileRead() and
+fileWritten(). All are kept for the current process, until reset(). Several runs in
+the same process (e.g. models set up one after the other) each report their own part,
+from a snapshot taken when the run starts:
+    start=instrument.snapshot()
+    ...
+    instrument.writeReport(filename,since=start)
+
+Any stage can also be profiled with cProfile, see profile().
+
+The report is written as JSON with writeReport (done by Models after sampling and
+after the posterior calculations, see -runReport.json in the results folder).
+"""
+import time, os, json, cProfile
+from contextlib import contextmanager
+
+_stages={}
+_counters={}
+_bytes={'read':{},'written':{}}
+_profile={'stages':set(),'path':None}
+_open=[]
+
+def reset():
+    """Clears all timers and counters."""
+    _stages.clear()
+    _counters.clear()
+    _bytes['read'].clear()
+    _bytes['written'].clear()
+
+def snapshot():
+    """Returns a copy of the timers, counters and files recorded so far (see report)."""
+    return {'stages':dict([(n,dict(s)) for n,s in _stages.items()]),'counters':dict(_counters),
+            'read':dict(_bytes['read']),'written':dict(_bytes['written'])}
+
+def count(name,n=1):
+    """Increments counter name by n."""
+    _counters[name]=_counters.get(name,0)+n
+
+def fileRead(filename):
+    """Records the size of a file that was read."""
+    _bytes['read'][os.path.basename(filename)]=os.path.getsize(filename)
+
+def fileWritten(filename):
+    """Records the size of a file that was written."""
+    _bytes['written'][os.path.basename(filename)]=os.path.getsize(filename)
+
+def profile(stages,path):
+    """Profiles stages with cProfile, each profile is saved in path+'profile-'+stage+'.prof'
+(see the pstats module to read them).
+
+Input:
+- stages (list of str): names of the stages to profile, e.g. ['sampling'].
+- path (str): folder where the profiles are saved."""
+    _profile['stages']=set(stages)
+    _profile['path']=path
+
+def start(name):
+    """Starts timing stage name (see also stage)."""
+    prof=None
+    if name in _profile['stages']:
+        prof=cProfile.Profile()
+        prof.enable()
+    _open.append((name,time.time(),prof))
+
+def stop(name=None):
+    """Stops timing the last stage started or, if given, stage name (and the stages
+started inside it and left running, e.g. after an exception)."""
+    if (not _open) or (name!=None and name not in [o[0] for o in _open]):
+        return 0.
+    while name!=None and _open[-1][0]!=name:
+        stop()
+    n,t0,prof=_open.pop()
+    dt=time.time()-t0
+    if prof!=None:
+        prof.disable()
+        prof.dump_stats(os.path.join(_profile['path'],'profile-%s.prof'%n.replace(' ','_')))
+    s=_stages.setdefault(n,{'calls':0,'seconds':0.})
+    s['calls']+=1
+    s['seconds']+=dt
+    return dt
+
+@contextmanager
+def stage(name):
+    """Times (and profiles, see profile) the code run inside the with statement."""
+    start(name)
+    try:
+        yield
+    finally:
+        stop(name)
+
+def report(since=None):
+    """Returns the timers, counters and rates of the run as a dictionnary, since the
+snapshot since (see snapshot) if not None, else since the last reset."""
+    now=snapshot()
+    if since!=None:
+        stages={}
+        for n,s in now['stages'].items():
+            s0=since['stages'].get(n,{'calls':0,'seconds':0.})
+            if s['calls']>s0['calls']:
+                stages[n]={'calls':s['calls']-s0['calls'],'seconds':s['seconds']-s0['seconds']}
+        counters=dict([(c,v-since['counters'].get(c,0)) for c,v in now['counters'].items() if v!=since['counters'].get(c,0)])
+        files=[dict([(f,b) for f,b in now[k].items() if since[k].get(f)!=b]) for k in ('read','written')]
+        now={'stages':stages,'counters':counters,'read':files[0],'written':files[1]}
+    rates={}
+    samp=now['stages'].get('sampling')
+    if samp!=None and samp['seconds']>0:
+        for c in ('logp evaluations','iterations'):
+            if c in now['counters']:
+                rates[c+' per second']=now['counters'][c]/samp['seconds']
+    return {'stages':now['stages'],'counters':now['counters'],
+            'rates':rates,'bytes read':now['read'],'bytes written':now['written'],
+            'total bytes read':sum(now['read'].values()),'total bytes written':sum(now['written'].values())}
+
+def writeReport(filename,since=None):
+    """Writes the run report (see report) to filename as JSON."""
+    f=open(filename,'w')
+    json.dump(report(since),f,indent=1,sort_keys=True)
+    f.close()
@@ -0,0 +1,579 @@
+""" Local service running fits submitted as jobs, on a pool of worker processes that
+keep the libraries imported (pymc, scipy, the models) and the kernel cache (see
+utils.KernelCache) from one job to the next, instead of paying for them in each script.
+
+Jobs are kept in a SQLite queue (savePath/jobs.sqlite, ./results by default), so that
+queued jobs survive a restart of the service (jobs that were running are queued
+again). Each job is a JSON dictionnary, e.g.:
+    {"model": "timeEst",
+     "data": {"class": "TimeData", "method": "fromCSV",
+              "kwargs": {"dataPath1": "./data/Wneg.csv", "dataPath2": "./data/Wpos.csv", "dataName": "wolb2012"}},
+     "priorsFile": "priors_timeEst",
+     "setup": {"bRandomIni": false},
+     "sampler": {"method": "sample", "kwargs": {"niterations": 300000, "burnin": 100000, "thinF": 100}},
+     "calcPosterior": {"bPlot": true}}
+- model: module of the model (see models).
+- data: class of dataFunctions, and method reading the data (fromCSV, fromCache or
+fromBinary) with its arguments.
+- priorsFile: name of the priors file in ./lib/priors (the default of the model if
+missing).
+- setup: other arguments of Model.setup (resultsName, savePath, bOverWrite,
+bRandomIni, bPointwise).
+- sampler: method (sample, sampleUntilConverged, gridPosterior or checkpoint, see
+samplers) and its arguments.
+- compactTraces: arguments of Model.compactTraces, to store the traces compactly.
+- calcPosterior: arguments of Model.calcPosterior, or null to skip it.
+Jobs are run by priority (highest first), then in the order they were submitted. The
+results folder is allocated as for the scripts, and recorded in the run index (see
+runIndex.py).
+
+The service listens on http://127.0.0.1:8750 by default (see bin/runJobServer.py):
+- POST /jobs (the job, with an optional "priority") returns {"id": ...}.
+- GET /jobs (optionally ?status=queued...) lists the jobs, GET /jobs/<id> returns a
+job with its status (queued, running, done, failed, cancelled), its progress (last
+line printed) and its result (results folder and files saved, see runIndex.artifacts).
+- GET /jobs/<id>/log?offset=<bytes> returns what the job printed from offset, and
+GET /jobs/<id>/stream streams it until the job ends.
+- GET /jobs/<id>/artifacts/<name> returns a file saved by the job (e.g. postcalc).
+- POST /jobs/<id>/cancel cancels a job: queued jobs are removed from the queue, the
+worker process of a running job is stopped and replaced by a new one.
+- POST /jobs/<id>/priority ({"priority": ...}) changes the priority of a queued job.
+The functions submit, status, cancel and stream send these requests, e.g.:
+    jid=jobQueue.submit(job,priority=1)
+    jobQueue.stream(jid)            # prints the output of the job until it ends
+    jobQueue.status(jid)['result']['path']
+"""
+import os, re, sys, time, json, signal, sqlite3, traceback, importlib, urllib, urllib2, threading, multiprocessing
+import BaseHTTPServer, SocketServer, urlparse
+
+models=('timeEst','timeControlEst','timeGroupsEst','timeReplicatesEst','timeTestHom','dayEst')
+dataMethods=('fromCSV','fromCache','fromBinary')
+samplers=('sample','sampleUntilConverged','gridPosterior','checkpoint')
+statuses=('queued','running','done','failed','cancelled')
+defaultUrl='http://127.0.0.1:8750'
+
+class JobQueue(object):
+    """Persistent queue of jobs, in the SQLite database savePath/jobs.sqlite. Job logs
+are saved in savePath/jobs/<id>.log.
+
+Input:
+- savePath (str): results folder, ./results if None.
+"""
+    def __init__(self,savePath=None):
+        self.savePath=os.path.join('.','results') if savePath==None else savePath
+        self.filename=os.path.join(self.savePath,'jobs.sqlite')
+        self.logPath=os.path.join(self.savePath,'jobs')
+        if not os.path.exists(self.logPath):
+            os.makedirs(self.logPath)
+        conn=self._connect()
+        try:
+            conn.execute("""CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                status TEXT, priority INTEGER, spec TEXT, submitted REAL, started REAL,
+                finished REAL, worker INTEGER, cancel INTEGER DEFAULT 0, progress TEXT,
+                result TEXT, error TEXT)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobsQueue ON jobs (status, priority, id)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn=sqlite3.connect(self.filename,timeout=60,isolation_level=None)
+        conn.row_factory=sqlite3.Row
+        return conn
+
+    def _execute(self,sql,args=()):
+        """Executes sql in its own transaction, returns the rows and the id of the last
+        row inserted."""
+        conn=self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            cur=conn.execute(sql,args)
+            rows=cur.fetchall()
+            conn.execute('COMMIT')
+            return rows,cur.lastrowid,cur.rowcount
+        except:
+            try:
+                conn.execute('ROLLBACK')
+            except sqlite3.Error:
+                pass
+            raise
+        finally:
+            conn.close()
+
+    def logFile(self,jid):
+        return os.path.join(self.logPath,'%i.log'%jid)
+
+    def submit(self,spec,priority=0):
+        """Adds a job (see the module documentation) to the queue, returns its id."""
+        spec=validate(spec)
+        rows,jid,n=self._execute('INSERT INTO jobs (status,priority,spec,submitted) VALUES (?,?,?,?)',
+                                 ('queued',_priority(priority),json.dumps(spec,sort_keys=True),time.time()))
+        return jid
+
+    def get(self,jid):
+        """Returns the job jid as a dictionnary, or None if there is no such job."""
+        rows=self._execute('SELECT * FROM jobs WHERE id=?',(jid,))[0]
+        return _job(rows[0]) if rows else None
+
+    def list(self,status=None):
+        """Returns the jobs (of a given status if not None), by priority and id."""
+        if status==None:
+            rows=self._execute('SELECT * FROM jobs ORDER BY priority DESC, id')[0]
+        else:
+            rows=self._execute('SELECT * FROM jobs WHERE status=? ORDER BY priority DESC, id',(status,))[0]
+        return [_job(r) for r in rows]
+
+    def claim(self,worker):
+        """Marks the next queued job as running on worker, and returns it (None if the
+        queue is empty)."""
+        conn=self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row=conn.execute("SELECT * FROM jobs WHERE status='queued' ORDER BY priority DESC, id LIMIT 1").fetchone()
+            if row!=None:
+                conn.execute("UPDATE jobs SET status='running', worker=?, started=? WHERE id=?",(worker,time.time(),row['id']))
+            conn.execute('COMMIT')
+        except:
+            try:
+                conn.execute('ROLLBACK')
+            except sqlite3.Error:
+                pass
+            raise
+        finally:
+            conn.close()
+        return _job(row) if row!=None else None
+
+    def progress(self,jid,text):
+        self._execute('UPDATE jobs SET progress=? WHERE id=?',(text,jid))
+
+    def finish(self,jid,status,result=None,error=None):
+        """Sets the final status of a running job."""
+        return self._execute("UPDATE jobs SET status=?, finished=?, result=?, error=? WHERE id=? AND status='running'",
+                             (status,time.time(),None if result==None else json.dumps(result,sort_keys=True),error,jid))[2]>0
+
+    def cancel(self,jid):
+        """Cancels a queued job, or asks for a running job to be cancelled (see
+        WorkerPool.supervise). Returns the status of the job after the request."""
+        self._execute("UPDATE jobs SET status='cancelled', finished=? WHERE id=? AND status='queued'",(time.time(),jid))
+        self._execute("UPDATE jobs SET cancel=1 WHERE id=? AND status='running'",(jid,))
+        job=self.get(jid)
+        return None if job==None else job['status']
+
+    def setPriority(self,jid,priority):
+        """Changes the priority of a queued job, returns whether it was queued."""
+        return self._execute("UPDATE jobs SET priority=? WHERE id=? AND status='queued'",(_priority(priority),jid))[2]>0
+
+    def requeue(self,jid):
+        """Queues again a running job whose worker was stopped, returns whether it was
+        running."""
+        return self._execute("UPDATE jobs SET status='queued', worker=NULL, started=NULL WHERE id=? AND status='running'",(jid,))[2]>0
+
+    def requeueInterrupted(self):
+        """Queues again the jobs that were running when the service stopped."""
+        return self._execute("UPDATE jobs SET status='queued', worker=NULL, started=NULL, cancel=0 WHERE status='running'")[2]
+
+def _priority(priority):
+    if not isinstance(priority,(int,long)) or isinstance(priority,bool):
+        raise ValueError("The priority should be an integer.")
+    return priority
+
+def _job(row):
+    job=dict([(k,row[k]) for k in row.keys()])
+    for k in ('spec','result'):
+        job[k]=json.loads(job[k]) if job[k] else None
+    job['cancel']=bool(job['cancel'])
+    return job
+
+def validate(spec):
+    """Checks a job (see the module documentation), raises ValueError if it is not
+valid. Returns the job."""
+    if not isinstance(spec,dict):
+        raise ValueError("A job is a dictionnary.")
+    unknown=[k for k in spec if k not in ('model','data','priorsFile','setup','sampler','compactTraces','calcPosterior')]
+    if unknown:
+        raise ValueError("Unknown entries of the job: %s"%', '.join(sorted(unknown)))
+    if spec.get('model') not in models:
+        raise ValueError("model should be one of %s."%', '.join(models))
+    import dataFunctions as df
+    data=spec.get('data')
+    if not isinstance(data,dict) or data.get('method') not in dataMethods:
+        raise ValueError("data should give a class of dataFunctions and a method among %s."%', '.join(dataMethods))
+    Data=getattr(df,str(data.get('class')),None)
+    if not (isinstance(Data,type) and issubclass(Data,df.Data) and Data!=df.Data):
+        raise ValueError("Unknown data class %s, see the classes of dataFunctions (TimeData, DayData...)."%data.get('class'))
+    if not isinstance(data.get('args',[]),list) or not isinstance(data.get('kwargs',{}),dict):
+        raise ValueError("The arguments of the data method should be a list (args) and a dictionnary (kwargs).")
+    if spec.get('priorsFile')!=None and not re.match(r'^\w+$',spec['priorsFile']):
+        raise ValueError("priorsFile should be the name of a file in ./lib/priors, without extension.")
+    if spec.get('priorsFile')!=None and not os.path.exists(os.path.join('.','lib','priors',spec['priorsFile']+'.py')):
+        raise ValueError("No priors file %s in ./lib/priors."%spec['priorsFile'])
+    setup=spec.get('setup',{})
+    if not isinstance(setup,dict) or [k for k in setup if k not in ('resultsName','savePath','bOverWrite','bRandomIni','bPointwise')]:
+        raise ValueError("setup should only give resultsName, savePath, bOverWrite, bRandomIni and bPointwise.")
+    sampler=spec.get('sampler')
+    if not isinstance(sampler,dict) or sampler.get('method') not in samplers:
+        raise ValueError("sampler should give a method among %s."%', '.join(samplers))
+    for k in ('compactTraces','calcPosterior'):
+        if spec.get(k)!=None and not isinstance(spec[k],dict):
+            raise ValueError("%s should be a dictionnary of arguments, or null."%k)
+    return spec
+
+def runJob(spec):
+    """Runs a job (see the module documentation) in this process. Returns the results
+folder, the files saved (see runIndex.artifacts) and what the sampler returned (its
+JSON values)."""
+    import instrument as ins, runIndex, dataFunctions as df
+    ins.reset()
+    # The priors modules hold the stochastics of the model: imported again for each
+    # job, so that a model does not share them with the model of a previous job
+    for name in [n for n in sys.modules if n.startswith('lib.priors.')]:
+        del sys.modules[name]
+    model=importlib.import_module(spec['model'])
+    d=spec['data']
+    data=getattr(getattr(df,d['class']),d['method'])(*d.get('args',[]),**d.get('kwargs',{}))
+    mod=model.Model.setup(data,priorsFile=spec.get('priorsFile'),**_strKeys(spec.get('setup',{})))
+    sampler=spec['sampler']
+    kwargs=_strKeys(sampler.get('kwargs',{}))
+    if sampler['method']=='checkpoint':
+        import checkpoint
+        res=checkpoint.sample(mod,**kwargs)
+    elif sampler['method']=='gridPosterior':
+        kwargs['bCalc']=False
+        res=mod.gridPosterior(**kwargs)
+    else:
+        res=getattr(mod,sampler['method'])(**kwargs)
+    if spec.get('compactTraces')!=None and sampler['method']!='gridPosterior':
+        mod.compactTraces(**_strKeys(spec['compactTraces']))
+    calc=spec.get('calcPosterior',{})
+    if calc!=None:
+        mod.calcPosterior(**_strKeys(calc))
+    return {'path':mod.path,'artifacts':dict([(k,mod.path+f) for k,f in runIndex.artifacts(mod.saveTo).items()]),
+            'sampler':_jsonValues(res)}
+
+def _strKeys(kwargs):
+    """Keyword arguments from JSON (unicode keys and strings)."""
+    return dict([(str(k),str(v) if isinstance(v,unicode) else v) for k,v in kwargs.items()])
+
+def _jsonValues(res):
+    """Entries of the dictionnary res that can be saved as JSON."""
+    if not isinstance(res,dict):
+        return None
+    values={}
+    for k,v in res.items():
+        try:
+            json.dumps(v)
+            values[str(k)]=v
+        except (TypeError,ValueError):
+            pass
+    return values
+
+class _JobLog(object):
+    """File-like object receiving the output of a job: written to its log file, the
+    last line being saved as the progress of the job at most every interval seconds."""
+    def __init__(self,queue,jid,interval=1.):
+        self.queue=queue
+        self.jid=jid
+        self.interval=interval
+        self.f=open(queue.logFile(jid),'a')
+        self.last=''
+        self.tLast=0
+
+    def write(self,s):
+        self.f.write(s)
+        self.f.flush()
+        lines=[l for l in re.split(r'[\r\n]',s) if l.strip()]
+        if lines:
+            self.last=lines[-1].strip()
+            if time.time()-self.tLast>self.interval:
+                self.queue.progress(self.jid,self.last)
+                self.tLast=time.time()
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.queue.progress(self.jid,self.last)
+        self.f.close()
+
+def warmUp():
+    """Imports the libraries used by the jobs (in the service, before the worker
+    processes are started, so that they share them)."""
+    from matplotlib import use
+    use('Agg')
+    import utils as ut
+    # Attributes of the lazy modules, to import them (see utils.lazyImport)
+    ut.py.MCMC, ut.st.norm, ut.pl.figure
+    for m in models:
+        importlib.import_module(m)
+
+def _worker(savePath,worker,poll):
+    """Runs the jobs of the queue, one at a time, in a worker process."""
+    # Stopped by the service (Ctrl+C in a terminal also reaches the workers)
+    signal.signal(signal.SIGINT,signal.SIG_IGN)
+    signal.signal(signal.SIGTERM,signal.SIG_DFL)
+    queue=JobQueue(savePath)
+    stdout,stderr=sys.stdout,sys.stderr
+    while True:
+        job=queue.claim(worker)
+        if job==None:
+            time.sleep(poll)
+            continue
+        log=_JobLog(queue,job['id'])
+        sys.stdout=sys.stderr=log
+        try:
+            result=runJob(job['spec'])
+            status,error='done',None
+        except Exception:
+            result,status,error=None,'failed',traceback.format_exc()
+            log.write(error)
+        finally:
+            sys.stdout,sys.stderr=stdout,stderr
+            log.close()
+        queue.finish(job['id'],status,result,error)
+
+class WorkerPool(object):
+    """Worker processes running the jobs of a queue.
+
+Input:
+- queue (JobQueue): queue of jobs.
+- nworkers (int): number of worker processes.
+- poll (float): seconds between checks of the queue by idle workers.
+"""
+    def __init__(self,queue,nworkers=2,poll=0.5):
+        self.queue=queue
+        self.poll=poll
+        self.workers=[self._start(w) for w in xrange(nworkers)]
+
+    def _start(self,worker):
+        # Not daemonic: jobs start processes of their own (sampleUntilConverged, nprocs>1)
+        p=multiprocessing.Process(target=_worker,args=(self.queue.savePath,worker,self.poll))
+        p.start()
+        return p
+
+    def supervise(self):
+        """Stops the workers of the jobs cancelled while running, and replaces them and
+        the workers that died (their job fails)."""
+        running=dict([(j['worker'],j) for j in self.queue.list('running')])
+        for w,p in enumerate(self.workers):
+            job=running.get(w)
+            bStopped=False
+            if job!=None and job['cancel']:
+                job=self.queue.get(job['id'])
+                if job['status']!='running' or job['worker']!=w:
+                    # The job finished since, the worker may be running the next one
+                    continue
+                p.terminate()
+                p.join()
+                bStopped=True
+            elif not p.is_alive():
+                p.join()
+            else:
+                continue
+            # Jobs still assigned to the worker: the cancelled ones are cancelled, a job
+            # claimed just before the worker was stopped is queued again, and the job of
+            # a worker that died fails
+            for j in self.queue.list('running'):
+                if j['worker']!=w:
+                    continue
+                if j['cancel']:
+                    self.queue.finish(j['id'],'cancelled')
+                elif bStopped:
+                    self.queue.requeue(j['id'])
+                else:
+                    self.queue.finish(j['id'],'failed',error='Worker process exited with code %s.'%p.exitcode)
+            self.workers[w]=self._start(w)
+
+    def close(self):
+        for p in self.workers:
+            p.terminate()
+            p.join()
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """HTTP API of the service (see the module documentation)."""
+    def log_message(self,format,*args):
+        pass
+
+    def _send(self,code,obj):
+        body=json.dumps(obj,sort_keys=True)
+        self.send_response(code)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        """JSON dictionnary sent with the request, raises ValueError if it is not one."""
+        n=int(self.headers.getheader('Content-Length') or 0)
+        body=json.loads(self.rfile.read(n)) if n else {}
+        if not isinstance(body,dict):
+            raise ValueError("The body of the request should be a JSON dictionnary.")
+        return body
+
+    def _route(self):
+        url=urlparse.urlparse(self.path)
+        parts=[urllib.unquote(p) for p in url.path.split('/') if p]
+        query=dict(urlparse.parse_qsl(url.query))
+        if not parts or parts[0]!='jobs':
+            raise KeyError(url.path)
+        jid=int(parts[1]) if len(parts)>1 else None
+        if jid!=None and self.server.queue.get(jid)==None:
+            raise KeyError('job %i'%jid)
+        return parts[2:],jid,query
+
+    def do_GET(self):
+        try:
+            parts,jid,query=self._route()
+            queue=self.server.queue
+            if jid==None:
+                if query.get('status') not in (None,)+statuses:
+                    raise ValueError("Unknown status %s."%query['status'])
+                self._send(200,queue.list(query.get('status')))
+            elif not parts:
+                self._send(200,queue.get(jid))
+            elif parts==['log']:
+                text=_readLog(queue.logFile(jid),int(query.get('offset',0)))
+                self.send_response(200)
+                self.send_header('Content-Type','text/plain')
+                self.send_header('Content-Length',str(len(text)))
+                self.send_header('X-Job-Status',queue.get(jid)['status'])
+                self.end_headers()
+                self.wfile.write(text)
+            elif parts==['stream']:
+                self.send_response(200)
+                self.send_header('Content-Type','text/plain')
+                self.end_headers()
+                offset=0
+                while True:
+                    status=queue.get(jid)['status']
+                    text=_readLog(queue.logFile(jid),offset)
+                    self.wfile.write(text)
+                    self.wfile.flush()
+                    offset+=len(text)
+                    if not text and status not in ('queued','running'):
+                        break
+                    time.sleep(0.5)
+            elif len(parts)==2 and parts[0]=='artifacts':
+                artifacts=(queue.get(jid)['result'] or {}).get('artifacts',{})
+                if parts[1] not in artifacts:
+                    raise KeyError(parts[1])
+                self.send_response(200)
+                self.send_header('Content-Type','application/octet-stream')
+                self.send_header('Content-Length',str(os.path.getsize(artifacts[parts[1]])))
+                self.end_headers()
+                f=open(artifacts[parts[1]],'rb')
+                for chunk in iter(lambda: f.read(1<<20),''):
+                    self.wfile.write(chunk)
+                f.close()
+            else:
+                raise KeyError(self.path)
+        except KeyError, e:
+            self._send(404,{'error':'Not found: %s'%e.args[0]})
+        except ValueError, e:
+            self._send(400,{'error':str(e)})
+
+    def do_POST(self):
+        try:
+            parts,jid,query=self._route()
+            queue=self.server.queue
+            body=self._body()
+            if jid==None:
+                priority=body.pop('priority',0)
+                self._send(201,{'id':queue.submit(body,priority)})
+            elif parts==['cancel']:
+                self._send(200,{'id':jid,'status':queue.cancel(jid)})
+            elif parts==['priority']:
+                if 'priority' not in body:
+                    raise ValueError("No priority given.")
+                if not queue.setPriority(jid,body['priority']):
+                    raise ValueError("The priority of job %i cannot be changed, it is not queued."%jid)
+                self._send(200,queue.get(jid))
+            else:
+                raise KeyError(self.path)
+        except KeyError, e:
+            self._send(404,{'error':'Not found: %s'%e.args[0]})
+        except ValueError, e:
+            self._send(400,{'error':str(e)})
+
+def _readLog(filename,offset):
+    if not os.path.exists(filename):
+        return ''
+    f=open(filename,'rb')
+    f.seek(offset)
+    text=f.read()
+    f.close()
+    return text
+
+class _Server(SocketServer.ThreadingMixIn,BaseHTTPServer.HTTPServer):
+    daemon_threads=True
+    allow_reuse_address=True
+
+def serve(host='127.0.0.1',port=8750,nworkers=2,savePath=None,poll=0.5):
+    """Runs the service until interrupted (Ctrl+C or SIGTERM).
+
+Input:
+- host, port: address the service listens on (only local connections by default).
+- nworkers (int): number of worker processes running jobs at the same time.
+- savePath (str): results folder, with the queue (jobs.sqlite) and the logs of the
+jobs (./results if None).
+- poll (float): seconds between checks of the queue and of the workers.
+"""
+    if not os.path.exists(os.path.join('.','lib','priors')):
+        raise ValueError("Run the service from the folder of DISE (with ./lib and ./data).")
+    # Bound first: fails if the service is already running, before touching the queue
+    server=_Server((host,port),_Handler)
+    queue=JobQueue(savePath)
+    server.queue=queue
+    n=queue.requeueInterrupted()
+    if n:
+        print "%i interrupted jobs queued again."%n
+    warmUp()
+    signal.signal(signal.SIGTERM,lambda signum,frame: sys.exit(0))
+    pool=None
+    try:
+        pool=WorkerPool(queue,nworkers,poll)
+        thread=threading.Thread(target=server.serve_forever)
+        thread.daemon=True
+        thread.start()
+        print "Serving jobs on http://%s:%i with %i workers, queue in %s"%(host,port,nworkers,queue.filename)
+        while True:
+            pool.supervise()
+            time.sleep(poll)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        if pool!=None:
+            pool.close()
+        # Jobs stopped with the workers are queued again at the next start
+        print "Stopped serving jobs."
+
+def _request(url,data=None):
+    req=urllib2.Request(url,None if data==None else json.dumps(data),{'Content-Type':'application/json'})
+    try:
+        return json.loads(urllib2.urlopen(req).read())
+    except urllib2.HTTPError, e:
+        raise ValueError(json.loads(e.read()).get('error',str(e)))
+
+def submit(spec,priority=0,url=defaultUrl):
+    """Submits a job to the service at url, returns its id."""
+    spec=dict(spec)
+    spec['priority']=priority
+    return _request(url+'/jobs',spec)['id']
+
+def status(jid,url=defaultUrl):
+    """Returns the job jid (status, progress, result...) from the service at url."""
+    return _request(url+'/jobs/%i'%jid)
+
+def cancel(jid,url=defaultUrl):
+    """Cancels the job jid, returns its status."""
+    return _request(url+'/jobs/%i/cancel'%jid,{})['status']
+
+def stream(jid,url=defaultUrl,out=None):
+    """Writes the output of the job jid to out (sys.stdout if None) as it is printed,
+until the job ends. Returns the job."""
+    out=sys.stdout if out==None else out
+    f=urllib2.urlopen(url+'/jobs/%i/stream'%jid)
+    for line in iter(f.readline,''):
+        out.write(line)
+        out.flush()
+    return status(jid,url)
@@ -0,0 +1,134 @@
+""" Pointwise predictive accuracy from posterior samples of the log-likelihood.
+
+Both criteria take an array of log-likelihoods with one row per posterior sample and
+one column per observation. Columns can group identical observations (e.g. all hosts
+from the same group and dose dying in the same interval), with the number of
+observations of each column given in counts.
+
+- psisloo: leave-one-out cross-validation with Pareto smoothed importance sampling
+(Vehtari, Gelman and Gabry, 2017), all columns smoothed at once.
+- waic: Widely Applicable Information Criterion (Watanabe, 2010).
+"""
+import numpy as np
+try:
+    from scipy.special import logsumexp
+except ImportError:
+    from scipy.misc import logsumexp
+
+def gpdfit(x):
+    """Estimates the parameters of a generalized Pareto distribution for each column
+of x (sorted in increasing order along the first axis), following Zhang and Stephens
+(2009) with a weakly informative prior on the shape.
+
+Returns:
+- k (float arr): shape parameter of each column.
+- sigma (float arr): scale parameter of each column.
+"""
+    n=x.shape[0]
+    prior_bs=3
+    prior_k=10
+    m=30+int(np.sqrt(n))
+    b=1-np.sqrt(m/(np.arange(1,m+1)-0.5))
+    b=b[:,None]/(prior_bs*x[int(n/4.+0.5)-1][None,:])+1/x[-1][None,:]
+    # m x columns
+    k=np.log1p(-b[:,None,:]*x[None,:,:]).mean(1)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        L=n*(np.log(-b/k)-k-1)
+    w=1/np.exp(L[None,:,:]-L[:,None,:]).sum(1)
+    w[~np.isfinite(w)]=0
+    w/=w.sum(0)
+    bpost=(b*w).sum(0)
+    kpost=np.log1p(-bpost[None,:]*x).mean(0)
+    sigma=-kpost/bpost
+    kpost=(n*kpost+prior_k*0.5)/(n+prior_k)
+    return kpost,sigma
+
+def psislw(lw):
+    """Pareto smoothed importance sampling of the log-weights lw (samples x columns).
+
+Returns:
+- lw (float arr): smoothed and normalized log-weights.
+- k (float arr): estimated Pareto shape of each column. Estimates are reliable
+for k<0.7.
+"""
+    S,N=lw.shape
+    lw=lw-lw.max(0)
+    M=int(min(0.2*S,3*np.sqrt(S)))
+    k=np.zeros(N)
+    if M<5:
+        k.fill(np.inf)
+        return lw-logsumexp(lw,axis=0),k
+    order=np.argsort(lw,axis=0)
+    cols=np.arange(N)
+    cutoff=lw[order[S-M-1],cols]
+    tailidx=order[S-M:]
+    tail=lw[tailidx,cols]
+    exptail=np.exp(tail)-np.exp(cutoff)
+    ok=(exptail[-1]>0)&np.isfinite(cutoff)
+    if ok.any():
+        kk,sigma=gpdfit(exptail[:,ok])
+        p=(np.arange(1,M+1)-0.5)/M
+        with np.errstate(divide='ignore',invalid='ignore'):
+            q=sigma[None,:]*((1-p[:,None])**(-kk[None,:])-1)/kk[None,:]
+        smoothed=np.log(q+np.exp(cutoff[ok])[None,:])
+        # Smoothed weights are not allowed above the largest raw weight
+        smoothed=np.minimum(smoothed,0)
+        good=np.isfinite(kk)
+        okcols=cols[ok][good]
+        lw[tailidx[:,okcols],okcols]=smoothed[:,good]
+        k[okcols]=kk[good]
+        k[cols[ok][~good]]=np.inf
+    return lw-logsumexp(lw,axis=0),k
+
+def _summary(pointwise,counts):
+    n=counts.sum()
+    total=(counts*pointwise).sum()
+    mean=total/n
+    # sqrt(n*var) of the n (expanded) observations
+    se=((counts*(pointwise-mean)**2).sum())**0.5
+    return total,se
+
+def psisloo(loglik,counts=None):
+    """Leave-one-out cross-validation estimated with Pareto smoothed importance sampling.
+
+Input:
+- loglik (float arr): log-likelihood of each observation (columns) for each
+posterior sample (rows).
+- counts (int arr): number of identical observations in each column, defaults to 1.
+
+Returns a dictionnary with:
+- elpd_loo, se_elpd_loo: expected log pointwise predictive density and its standard error.
+- p_loo: effective number of parameters.
+- looic: -2*elpd_loo
+- loo_i (float arr): leave-one-out predictive density of one observation of each column.
+- k (float arr): Pareto shape of each column, estimates are unreliable when k>0.7.
+"""
+    loglik=np.asarray(loglik,float)
+    S,N=loglik.shape
+    counts=np.ones(N) if counts is None else np.asarray(counts,float)
+    lw,k=psislw(-loglik)
+    loo_i=logsumexp(loglik+lw,axis=0)
+    lppd_i=logsumexp(loglik,axis=0)-np.log(S)
+    elpd,se=_summary(loo_i,counts)
+    return {'elpd_loo':elpd,'se_elpd_loo':se,'p_loo':(counts*(lppd_i-loo_i)).sum(),'looic':-2*elpd,'loo_i':loo_i,'k':k}
+
+def waic(loglik,counts=None):
+    """Widely Applicable Information Criterion.
+
+Input:
+- loglik (float arr): log-likelihood of each observation (columns) for each
+posterior sample (rows).
+- counts (int arr): number of identical observations in each column, defaults to 1.
+
+Returns a dictionnary with:
+- elpd_waic, se_elpd_waic: expected log pointwise predictive density and its standard error.
+- p_waic: effective number of parameters.
+- waic: -2*elpd_waic
+"""
+    loglik=np.asarray(loglik,float)
+    S,N=loglik.shape
+    counts=np.ones(N) if counts is None else np.asarray(counts,float)
+    lppd_i=logsumexp(loglik,axis=0)-np.log(S)
+    p_i=loglik.var(0,ddof=1)
+    elpd,se=_summary(lppd_i-p_i,counts)
+    return {'elpd_waic':elpd,'se_elpd_waic':se,'p_waic':(counts*p_i).sum(),'waic':-2*elpd}
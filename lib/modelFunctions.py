@@ -1,17 +1,27 @@
 """ Super class Models includes all functions that are common to all models. """
-import os, sys, pickle, numpy as np, scipy.stats as st, pylab as pl
-import importlib, shutil, pymc as py
-from scipy.stats import scoreatpercentile as sap
-from mpl_toolkits.axes_grid1 import host_subplot
-from matplotlib import rcParams
+import os, sys, re, pickle, numpy as np
+import importlib, imp, shutil
 import utils as ut
+import instrument as ins
+# Slow to import, loaded when first used (see utils.lazyImport)
+py,st,pl,mpl=ut.py,ut.st,ut.pl,ut.mpl
 import dataFunctions as df
 import logging
 logging.captureWarnings(True)
 
 class Models(object):
     colors=['k','b']
-    def __init__(self, data, priors, name, path, bRandomIni):
+    # Parameters of the mortality block of the sampling schedule (see sample), with their
+    # hyperparameters and per-replicate values, unless the priors file lists them 
+    # (mortality=[...]). The other stochastics (infection parameters and numbers of 
+    # infected hosts) form the infection block.
+    __mortality__=re.compile(r'^(mu_|sd_)?(meanU|sU|k|meanI\d*|sI\d*|fI\d*|lsI\d*)(_r\d+)?$')
+    # Parameters evaluated on a log scale by gridPosterior
+    __gridLog__=()
+    def __init__(self, data, priors, name, path, bRandomIni, bPointwise=False):
+        # The run reports of this model only count what was done since (the timers and 
+        # counters are kept for the whole process, see instrument.py)
+        self.runStart=ins.snapshot()
         
         #Save runtime warnings in log file
         logging.basicConfig(filename=path+'warning.log', level=logging.WARNING)
@@ -22,6 +32,11 @@ class Models(object):
         self.saveTo=path+name
         self.path=path
         self.priors=priors
+        self.bPointwise=bPointwise
+        self.pointwise={}
+        self.pointwiseGroups={}
+        # Importance weights of the posterior samples, see reweight
+        self.weights=None
         if not hasattr(self,'d'):
             self.d=data.copy()
         m=self
@@ -29,7 +44,8 @@ class Models(object):
             setattr(m,v,None)
         
         #~~ Priors ~~
-        m.parameters=priors.parameters
+        # Copy the list, models extend it with their latent variables
+        m.parameters=list(priors.parameters)
         for key in m.parameters:
             setattr(m,key,getattr(priors,key))
         
@@ -39,7 +55,7 @@ class Models(object):
         self.likelihood_setup(bRandomIni)
     
     @classmethod    
-    def setup(Model,data, resultsName=None,savePath=None, bOverWrite=False,priorsFile=None, bRandomIni=True):
+    def setup(Model,data, resultsName=None,savePath=None, bOverWrite=False,priorsFile=None, bRandomIni=True, bPointwise=False):
         """Setting up Model.
 
 Input:
@@ -49,18 +65,18 @@ Input:
 - bOverWrite (bool): If a folder already exists, should it be overwritten (True) or should a subfolder be created (False, default)?
 - priorsFile (str): name of python file in ./lib/priors containing the definition of the prior distributions of the parameters.
 - bRandomIni (bool): should initial values be sampled randomly from prior distribution (True, default)? If not (False), parameter values set in prior file will be used (each parameter should have value=XX set in prior file).
+- bPointwise (bool): should the log-likelihood of each observation be saved in the traces (False, default)? Needed for model comparison with looWaic.
 
 Returns a Model object.
 """    
-        d=data.copy()
         if resultsName==None:
-            name=d.dataName+Model.__defaultName__
+            name=data.dataName+Model.__defaultName__
         else:
             name=resultsName
         
         priorsFile=priorsFile
         path= ut.initializeFolder(savePath,name,bOverWrite)
-        d.pickle(path+'data.pickle')
+        data.save(path+'data.dat')
         
         #~~ Priors ~~
         if priorsFile==None:
@@ -68,12 +84,181 @@ Returns a Model object.
         #Copy priors files to results folder
         priors=importlib.import_module('lib.priors.'+priorsFile)
         shutil.copyfile(os.path.join('.','lib','priors',priorsFile+'.py'), path+'prior.py')
-        return Model(d, priors, name, path,bRandomIni)
+        with ins.stage('setup'):
+            mod=Model(data, priors, name, path,bRandomIni,bPointwise)
+        import runIndex
+        mod.updateMetadata(model=Model.__module__,priorsFile=priorsFile,runIndex=runIndex.defaultPath(savePath))
+        mod.indexRun(model=Model.__module__,dataName=getattr(data,'dataName',None),dataHash=data.contentHash(),
+                     priorsFile=priorsFile,priorsHash=runIndex.fileHash(path+'prior.py'))
+        return mod
+    
+    @classmethod
+    def savedModel(Model,path,bRandomIni=True,bLoadTraces=True):
+        """Initializes a model from a saved results folder.
+
+Input:
+- path (str): results folder.
+- bRandomIni (bool): see setup.
+- bLoadTraces (bool): load the posterior samples if sampling has finished (True, 
+default), with the burn-in and thinning factor of the run metadata, or those of the
+grid posterior (see gridPosterior).
+
+Returns a Model object.
+"""
+        path+=('' if path[-1]==os.path.sep else os.path.sep)
+        if os.path.exists(path+'data.dat'):
+            data=df.Data.fromBinary(path+'data.dat')
+        else:
+            # Results folders saved before the binary data container
+            saved=pickle.load(open(path+'data.pickle','rb'))
+            if 'timesDeath1' in saved:
+                Data=df.TimeData
+            elif 'timesDeath' in saved:
+                Data=df.GroupsTimeData
+            elif 'replicates' in saved:
+                Data=df.ReplicatesTimeData
+            else:
+                Data=df.DayData
+            data=Data(**saved)
+        meta=pickle.load(open(path+'model.pickle'))
+        # Unique module name, so that models loaded from different folders keep their own priors
+        priors=imp.load_source('prior_'+meta['name'],path+'prior.py')
+        mod=Model(data,priors,meta['name'],path,bRandomIni,meta.get('bPointwise',False))
+        # __init__ rewrote model.pickle, keep the metadata of the run
+        mod.updateMetadata(**meta)
+        if bLoadTraces and os.path.exists(mod.posteriorFile()):
+            mod.loadMCMC(*mod._burninThin(None,None))
+        return mod
     
     def pickle(self):
-        save={'path':self.path,'saveTo':self.saveTo, 'name':self.name}
+        save={'path':self.path,'saveTo':self.saveTo, 'name':self.name, 'bPointwise':self.bPointwise}
         pickle.dump(save,open(self.path+'model.pickle','w')) 
     
+    def sample(self,niterations,burnin=0,thinF=1,infectionSteps=1,bReflect=False):
+        """Samples from the posterior with MCMC, the traces are saved in '-MCMC.pickle'.
+Same as:
+    M=py.MCMC(mod,db='pickle', dbname=mod.saveTo+'-MCMC.pickle')
+    mod.schedule(M,infectionSteps,bReflect)
+    M.sample(niterations, burnin, thinF)
+    M.db.close()
+with the sampling timed in the run report (see instrument.py).
+
+Input:
+- niterations, burnin, thinF (int): see pymc's MCMC.sample.
+- infectionSteps (int): number of updates of each stochastic of the infection block
+per iteration, i.e. per update of the mortality parameters (see schedule).
+- bReflect (bool): propose the numbers of infected hosts within [0, number of hosts]
+(True), instead of rejecting the proposals out of these bounds (False, default).
+
+The proposals rejected during this sampling are counted by cause (see schedule) and
+printed after sampling.
+
+Returns the pymc MCMC object.
+"""
+        M=py.MCMC(self,db='pickle', dbname=self.saveTo+'-MCMC.pickle')
+        self.schedule(M,infectionSteps,bReflect)
+        # Rejections of this sampling only
+        start=ins.snapshot()
+        with ins.stage('sampling'):
+            M.sample(niterations, burnin, thinF)
+        M.db.close()
+        printRejections(start)
+        ins.count('iterations',niterations)
+        ins.fileWritten(self.saveTo+'-MCMC.pickle')
+        ins.writeReport(self.saveTo+'-runReport.json',self.runStart)
+        self.indexRun(settings={'sampler':'MCMC','niterations':niterations,'burnin':burnin,'thinF':thinF,
+                                'infectionSteps':infectionSteps,'bReflect':bReflect})
+        return M
+    
+    def schedule(self,M,infectionSteps=1,bReflect=False):
+        """Sets the step methods of the stochastics (see scheduledStepMethod), to update 
+those of the infection block (those that are not mortality parameters, listed in 
+the priors file as mortality or else matched by __mortality__) infectionSteps times 
+per iteration, and to count the causes of the
+proposals rejected. The mortality block is expensive (kpdfInt over all changing 
+times), while updates of the infection block reuse the death and survival 
+probabilities computed for the current mortality parameters (cached by pymc and 
+ut.kernels), so that more effective samples are drawn per second of sampling.
+
+Input:
+- M (pymc MCMC): before sampling.
+- infectionSteps (int): number of updates of the infection block per iteration.
+- bReflect (bool): reflect the proposals of Binomial stochastics (the numbers of 
+infected hosts) about -1/2 and n+1/2, so that they stay in the support of their 
+prior. The proposals of pymc's DiscreteMetropolis are symmetric, and so are the 
+reflected ones (reflecting about 0 and n would propose 0 and n half as often as 
+they should be).
+"""
+        mortality=getattr(self.priors,'mortality',None)
+        for s in M.stochastics:
+            # Stochastics without children are drawn from their prior by pymc
+            if s.observed or M.step_method_dict[s] or not s.extended_children:
+                continue
+            cls=py.StepMethods.pick_best_methods(s).pop()
+            if issubclass(cls,py.Metropolis):
+                if mortality!=None:
+                    bMortality=s.__name__ in mortality
+                else:
+                    bMortality=self.__mortality__.match(s.__name__)!=None
+                nrepeat=1 if bMortality else infectionSteps
+                M.use_step_method(scheduledStepMethod(cls),s,nrepeat=nrepeat,
+                                  bReflect=bReflect and s.__class__.__name__=='Binomial')
+    
+    def metadata(self):
+        """ Returns the run metadata saved in model.pickle. """
+        return pickle.load(open(self.path+'model.pickle'))
+    
+    def updateMetadata(self,**kwargs):
+        """ Adds or updates entries of the run metadata saved in model.pickle (e.g. the
+        burn-in and thinning factor chosen by sampleUntilConverged). """
+        save=self.metadata()
+        save.update(kwargs)
+        pickle.dump(save,open(self.path+'model.pickle','w'))
+    
+    def indexRun(self,**fields):
+        """ Records the run in the index of its results folder (see runIndex.py), if it
+        has one: the run metadata and fields (settings, as a dictionnary, model...), the
+        time spent in each stage of the run (since the model was created) and the files
+        it saved. """
+        meta=self.metadata()
+        if meta.get('runIndex')==None or not os.path.exists(meta['runIndex']):
+            return
+        import runIndex
+        settings=dict([(k,v) for k,v in meta.items() if k not in ('path','saveTo','name','runIndex','model','priorsFile')])
+        settings.update(fields.pop('settings',{}))
+        # Stages of this run only (see instrument.snapshot)
+        timings=dict([(n,s['seconds']) for n,s in ins.report(self.runStart)['stages'].items()])
+        runIndex.update(meta['runIndex'],self.path,settings=settings,timings=timings,
+                        artifacts=runIndex.artifacts(self.saveTo),**fields)
+    
+    def sampleUntilConverged(self,nchains=4,chunkSize=1000,minIterations=2000,maxIterations=200000,rhatMax=1.01,essMin=400,seed=None):
+        """Samples parallel chains until split R-hat and bulk/tail effective sample sizes
+reach their targets (see convergence.py). The traces are saved as for a pickle 
+MCMC, and the chosen burnin and thinF in the run metadata, which calcPosterior uses
+by default.
+
+Input:
+- nchains (int): number of chains, each in its own worker process.
+- chunkSize (int): number of iterations sampled by each chain between checks.
+- minIterations, maxIterations (int): minimum and maximum iterations per chain.
+- rhatMax (float): maximum split R-hat.
+- essMin (float): minimum bulk and tail effective sample size.
+- seed (int): seed of the chains, random if None.
+
+Returns a dictionnary, see convergence.sampleUntilConverged.
+"""
+        import convergence
+        return convergence.sampleUntilConverged(self,nchains,chunkSize,minIterations,maxIterations,rhatMax,essMin,seed=seed)
+    
+    def _burninThin(self,burnin,thinF):
+        """ Burn-in and thinning factor, from the run metadata if None. """
+        meta=self.metadata()
+        if burnin==None:
+            burnin=meta.get('burnin',0)
+        if thinF==None:
+            thinF=meta.get('thinF',1)
+        return burnin,thinF
+    
     def resetParameters(self):
         """ Resets all parameters to random initial values. """
         print "Resetting parameter values to random values."
@@ -83,74 +268,396 @@ Returns a Model object.
         """ Sets up likelihoods. If bRandomIni, will reset all variables to random values."""
         m=self
         
+        ins.start('initialization')
         if bRandomIni:
             print "Looking for random initial values with non-zero likelihood..."""
             zeroprob=1
             while zeroprob:
-                [getattr(m,par).random() for par in m.parameters]
+                # Latent variables are only created by __lik_setup__
+                # (deterministic parameters of reparameterized priors have no random)
+                [getattr(m,par).random() for par in m.parameters if hasattr(getattr(m,par,None),'random')]
                 zeroprob=self.__lik_setup__()
+                ins.count('initialization retries',zeroprob)
             print "Found initial values, moving on."
+            ins.stop('initialization')
         else:
             zeroprob=self.__lik_setup__()
+            ins.stop('initialization')
             if zeroprob==1:
                 raise ZeroError("Initial values cause likelihood to be zero. Try other initial values or set bRandomIni to True.")
     
-    def calcPosterior(self,burnin=0,thinF=1,bOverWrite=False,figFormat='png'):
+    def pointwise_setup(self,name,nf,I,logprobdI,logprobdU,logprobsI,logprobsU,iTd,survivors):
+        """ Adds a traced node with the log-likelihood of one host of each dose and group, 
+        for each interval in which hosts died and for survival up to tmax (from the 
+        log-probabilities of death and survival). The number of hosts in each of these 
+        cells is saved in self.pointwise[name]."""
+        cells,counts=np.unique(np.asarray(iTd,int),return_counts=True)
+        if survivors>0:
+            counts=np.append(counts,survivors)
+        def ll(nf=nf,I=I,logprobdI=logprobdI,logprobdU=logprobdU,logprobsI=logprobsI,logprobsU=logprobsU):
+            f=I/float(nf)
+            res=ut.logMixture(f,logprobdI[cells],logprobdU[cells])
+            if survivors>0:
+                res=np.append(res,ut.logMixture(f,logprobsI,logprobsU))
+            return res.astype(np.float32)
+        setattr(self,name,py.Lambda(name,ll,trace=True))
+        self.pointwise[name]=counts
+    
+    def looWaic(self,burnin=None,thinF=None):
+        """Estimates the pointwise out-of-sample predictive accuracy (PSIS-LOO and WAIC, see 
+loo.py) from the log-likelihoods saved during sampling. The model should have been
+set up with bPointwise=True.
+
+Input:
+- burnin (int) - how many iterations from the begining should be discarded, from the run metadata if None (see calcPosterior).
+- thinF (int) - thining factor, from the run metadata if None.
+
+Returns a dictionnary with the results of loo.psisloo and loo.waic for each group of
+likelihoods (e.g. 'all', or 'hom1', 'het1'... for timeTestHom). Results are also 
+saved in the results folder, see -loo.csv.
+"""
+        import loo, traceStore
+        if not self.pointwiseGroups:
+            raise ZeroError("No pointwise log-likelihoods, set up the model with bPointwise=True before sampling.")
+        burnin,thinF=self._burninThin(burnin,thinF)
+        M2=traceStore.load(self.tracesFile())
+        res={}
+        for group,names in sorted(self.pointwiseGroups.items()):
+            ll=np.concatenate([np.concatenate([np.asarray(M2[n][c][burnin:None:thinF],float) for c in sorted(M2[n].keys())]) for n in names],1)
+            counts=np.concatenate([self.pointwise[n] for n in names])
+            res[group]=loo.psisloo(ll,counts)
+            res[group].update(loo.waic(ll,counts))
+        
+        f=open(self.saveTo+'-loo.csv','w')
+        cols=['elpd_loo','se_elpd_loo','p_loo','looic','elpd_waic','se_elpd_waic','p_waic','waic']
+        f.write('\t'.join(['Likelihoods']+cols+['max k','n(k>0.7)'])+'\n')
+        for group in sorted(res):
+            r=res[group]
+            f.write('\t'.join([group]+['%.2f'%r[c] for c in cols]+['%.2f'%r['k'].max(),'%i'%(r['k']>0.7).sum()])+'\n')
+        f.close()
+        print "Saved PSIS-LOO and WAIC, see "+self.name+'-loo.csv'
+        return res
+    
+    def calcPosterior(self,burnin=None,thinF=None,bOverWrite=False,figFormat='png',bPlot=True,nprocs=1):
         """Calculates posterior distributions needed for creating figures.
 
 Input:
 M2 (dict) - dictionnary from a MCMC loaded from a pickle
-burnin (int) - how many iterations from the begining should be discarded
-thinF (int) - thining factor.
+burnin (int) - how many iterations from the begining should be discarded. If None, uses the burn-in saved in the run metadata (see sampleUntilConverged), or 0. Ignored for a posterior evaluated over a grid (see gridPosterior).
+thinF (int) - thining factor. If None, uses the thinning factor saved in the run metadata, or 1.
 bOverWrite (bool) - if these calculations have already been done in the given results folder, with the same burn-in and thining factor, should they be calculated again (False) or not (True, default)?
 figFormat (str) - format in which figures should be saved. Examples: 'png' (default),'tiff','pdf','jpg'
+bPlot (bool) - render the figures (True, default)? If False, only the csv files and the posterior calculations (-postcalc.pickle) are saved, figures can be rendered later from the results folder (see render.py).
+nprocs (int) - number of worker processes rendering the figures. If 1 (default), figures are rendered in this process.
 """
         self.figFormat=figFormat
+        burnin,thinF=self._burninThin(burnin,thinF)
         # Determines if results can be loaded from previous calculations in a pickle
-        # (if the file is more recent than the MCMC pickle and the burnin and thinning factors were the same). 
+        # (if the file is more recent than the posterior samples, see posteriorFile, and the burnin and thinning factors were the same). 
         # In which case, only the plots are created again. 
         # Else, reload the traces and calculate posterior distributions.
         if bOverWrite:
             self.loadMCMC(burnin, thinF)
-            self.__calc__()
+            with ins.stage('posterior calculations'):
+                self.__calc__()
         else:
             try:
-                bMostRecent=os.path.getctime(self.saveTo+'-postcalc.pickle')>os.path.getctime(self.saveTo+'-MCMC.pickle')
+                bMostRecent=os.path.getctime(self.saveTo+'-postcalc.pickle')>os.path.getctime(self.posteriorFile())
                 saved=pickle.load(open(self.saveTo+'-postcalc.pickle'))
-                par=self.parameters[0]
-                # For multiple (independent) chains, uncomment the two following lines and comment the third (see also loadMCMC)
-                #nchains=len(M2[par].keys())
-                #bSameIter=(getattr(self,par+'s').shape[0]==(len(M2[par][0][burnin:None:thinF])*nchains))
-                bSameIter=1
-                if (bMostRecent&bSameIter&(saved['burnin']==burnin) & (saved['thinF']==thinF)):
+                if (bMostRecent&(saved['burnin']==burnin) & (saved['thinF']==thinF)):
                     print "Imported previous calculations"
                     for v in self.vals:
                         setattr(self,v,saved[v])
                     for v in self.parameters:
                         setattr(self,v+'s', saved[v+'s'])
-                    self.__plot__()
+                    self.weights=saved.get('weights')
                 else:
                     self.loadMCMC(burnin, thinF)
-                    self.__calc__()
+                    with ins.stage('posterior calculations'):
+                        self.__calc__()
             except (IOError, OSError):
                 self.loadMCMC(burnin, thinF)
-                self.__calc__()
+                with ins.stage('posterior calculations'):
+                    self.__calc__()
+        with ins.stage('outputs'):
+            self.__plot__(bPlot,nprocs)
+        ins.writeReport(self.saveTo+'-runReport.json',self.runStart)
+        self.indexRun()
+        print "Saved run report, see "+self.name+'-runReport.json'
+    
+    def savePostcalc(self,res):
+        """ Saves the posterior calculations (res, with the variables needed for plots) 
+        in -postcalc.pickle, with what is needed to render the figures without the 
+        model (see fromResults). """
+        res['vals']=self.vals
+        res['parameters']=self.parameters
+        res['weights']=self.weights
+        res['data']=self.d
+        pickle.dump(res,open(self.saveTo+'-postcalc.pickle','w'))
+        ins.fileWritten(self.saveTo+'-postcalc.pickle')
+    
+    @classmethod
+    def fromResults(Model,saveTo,figFormat='png'):
+        """Returns a model object with the posterior calculations saved in 
+saveTo+'-postcalc.pickle', enough to render figures and write posterior values but 
+not to sample (the likelihood is not set up, pymc is not needed).
+
+Input:
+- saveTo (str): path and name of the results, e.g. './results/wolb2012_timeEst/wolb2012_timeEst'.
+- figFormat (str): format of the figures.
+"""
+        m=Model.__new__(Model)
+        saved=pickle.load(open(saveTo+'-postcalc.pickle'))
+        m.saveTo=saveTo
+        m.path=os.path.dirname(saveTo)+os.path.sep
+        m.name=os.path.basename(saveTo)
+        m.figFormat=figFormat
+        m.d=saved['data']
+        m.vals=saved['vals']
+        m.parameters=saved['parameters']
+        m.weights=saved['weights']
+        m.burnin,m.thinF=saved['burnin'],saved['thinF']
+        for v in m.vals:
+            setattr(m,v,saved[v])
+        for v in m.parameters:
+            setattr(m,v+'s',saved[v+'s'])
+        return m
+    
+    def render(self,figures=None,nprocs=1):
+        """Renders figures from the posterior calculations.
+
+Input:
+- figures (list of str): names of the plotting methods, defaults to Model.__figures__.
+- nprocs (int): number of worker processes (see render.py). If 1 (default), figures 
+are rendered in this process.
+"""
+        if figures==None:
+            figures=self.__figures__
+        if nprocs==1:
+            for fig in figures:
+                with ins.stage('figure '+fig):
+                    getattr(self,fig)()
+        else:
+            import render
+            with ins.stage('figures'):
+                render.renderFigures(self.__module__,self.saveTo,figures,self.figFormat,nprocs)
+    
+    def posteriorFile(self):
+        """ File with the posterior samples, the most recent of '-grid.pickle' (posterior
+        evaluated over a grid, see gridPosterior), '-MCMC.npz' (compact traces, see
+        compactTraces) and '-MCMC.pickle'. """
+        files=[f for f in (self.saveTo+'-grid.pickle',self.saveTo+'-MCMC.npz') if os.path.exists(f)]
+        mcmc=self.saveTo+'-MCMC.pickle'
+        if os.path.exists(mcmc):
+            files.append(mcmc)
+        if not files:
+            return mcmc
+        return max(files,key=os.path.getmtime)
+    
+    def tracesFile(self):
+        """ File with the MCMC traces, '-MCMC.npz' if it is more recent than '-MCMC.pickle'. """
+        npz=self.saveTo+'-MCMC.npz'
+        mcmc=self.saveTo+'-MCMC.pickle'
+        if os.path.exists(npz) and (not os.path.exists(mcmc) or os.path.getmtime(npz)>=os.path.getmtime(mcmc)):
+            return npz
+        return mcmc
+    
+    def compactTraces(self,bFloat32=False,float32=(),bCompress=False,bRemove=False):
+        """Converts the traces of '-MCMC.pickle' to the compact archive '-MCMC.npz' (see
+traceStore.py), used instead from then on (until the next sampling). The numbers of
+infected hosts and other integer traces are stored in the smallest integer type 
+holding them, without loss.
+
+Input:
+- bFloat32 (bool): store the float traces that are not parameters of the model (the 
+deterministics only used in pymc's trace plots: pi_hom, pi_het, tau..., deviance and 
+the adaptive scale factors of the step methods) as float32.
+- float32 (list of str): regular expressions of the names of other float traces 
+stored as float32.
+- bCompress (bool): compress the archive.
+- bRemove (bool): remove '-MCMC.pickle' afterwards.
+
+Returns the file sizes and load times of both files (see traceStore.convert).
+"""
+        import traceStore
+        patterns=list(float32)
+        if bFloat32:
+            # Any name but those of the parameters
+            patterns.append('^(?!(%s)$)'%'|'.join([re.escape(p) for p in self.parameters]))
+        with ins.stage('compacting traces'):
+            res=traceStore.convert(self.saveTo+'-MCMC.pickle',self.saveTo+'-MCMC.npz',patterns,bCompress)
+        ins.fileWritten(self.saveTo+'-MCMC.npz')
+        if bRemove:
+            os.remove(self.saveTo+'-MCMC.pickle')
+        self.indexRun()
+        return res
     
     def loadMCMC(self, burnin, thinF):
-        M2=pickle.load(open(self.saveTo+'-MCMC.pickle'))
-        for p in self.parameters:
-            vals=M2[p][0][burnin:None:thinF].tolist()
-            
-            # For multiple (independent) chains, see also Model.resetParameters()
-            #nchains=len(M2[p].keys())
-            #if nchains>1:
-            #    for c in nchains[1:]:
-            #        vals.extend(M2[p][c][burnin:None:thinF])
-            
-            setattr(self,p+'s',np.array(vals))
+        import traceStore
+        ins.start('loading traces')
+        fname=self.posteriorFile()
+        if fname.endswith('-grid.pickle'):
+            M2=pickle.load(open(fname,'rb'))
+        else:
+            M2=traceStore.load(fname)
+        ins.fileRead(fname)
+        if fname.endswith('-grid.pickle'):
+            # Cell centres of the grid, weighted by their posterior mass
+            for p,vals in zip(M2['parameters'],M2['thetas'].T):
+                setattr(self,p+'s',vals)
+            self.weights=M2['weights']
+        else:
+            for p in self.parameters:
+                # Independent chains (e.g. from sampleUntilConverged) are concatenated,
+                # burnin and thinF apply to each chain
+                vals=np.concatenate([M2[p][c][burnin:None:thinF] for c in sorted(M2[p].keys())])
+                setattr(self,p+'s',vals)
+            self.weights=None
         self.burnin=burnin
         self.thinF=thinF
+        ins.stop('loading traces')
+    
+    def gridPosterior(self,n=10,nrefine=3,tol=1e-4,drop=15.,maxCells=200000,nprocs=1,bCalc=True,figFormat='png'):
+        """Evaluates the posterior over an adaptive grid (see gridPosterior.py) instead of 
+sampling it with MCMC, for models with few parameters and a vectorized likelihood: a
+module level function logLik(thetas,data) returning the log-likelihood of each row of
+thetas (e.g. timeControlEst and dayEst). The parameters in Model.__gridLog__ are 
+evaluated on a log scale.
+
+The centres of the cells and their posterior masses are saved in '-grid.pickle', and
+used as weighted samples by calcPosterior instead of the traces of '-MCMC.pickle' 
+(as long as the grid is more recent).
+
+Input:
+- n (int): number of cells per parameter of the initial grid.
+- nrefine (int): number of refinements of the cells holding most of the mass.
+- tol (float): fraction of the posterior mass allowed out of the refined cells, and 
+in the outer cells of the initial grid.
+- drop (float): the initial grid extends from the mode to where the log-posterior is 
+drop lower than at the mode.
+- maxCells (int): maximum number of cells.
+- nprocs (int): number of worker processes evaluating the likelihood.
+- bCalc (bool): also calculate the posterior distributions and figures (True, default)?
+- figFormat (str): format of the figures.
+
+Returns the dictionnary of gridPosterior.gridPosterior, with the cell centres (thetas,
+one column per parameter in priors.parameters) on the scale of the parameters, and 
+the effective sample size of the weights (ess).
+"""
+        import smc, gridPosterior as gp
+        logLik=getattr(sys.modules[self.__module__],'logLik',None)
+        names=list(self.priors.parameters)
+        if logLik==None or sorted(names)!=sorted(self.parameters):
+            raise ZeroError("%s has no vectorized likelihood (logLik) of its parameters, sample the posterior with MCMC."%self.__module__)
+        bLog=np.array([p in self.__gridLog__ for p in names])
+        logPrior=smc.priorFunctions(self.priors,names)[1]
+        evaluate=smc.Evaluator(logLik,self.logLikData(),nprocs)
+        def logPost(u):
+            thetas=u.copy()
+            thetas[:,bLog]=np.exp(u[:,bLog])
+            # Prior density of the parameters on the scale of the grid
+            res=logPrior(thetas)+u[:,bLog].sum(1)
+            ok=np.isfinite(res)
+            res[ok]+=evaluate(thetas[ok])
+            res[np.isnan(res)]=-np.inf
+            return res
+        u0=np.array([getattr(self,p).value for p in names],float)
+        u0[bLog]=np.log(u0[bLog])
+        with ins.stage('grid posterior'):
+            try:
+                mode,lower,upper,edges=gp.findBox(logPost,u0,drop)
+                res=gp.gridPosterior(logPost,lower,upper,edges,n,nrefine,tol,maxCells=maxCells)
+            finally:
+                evaluate.close()
+        # Cells holding together a negligible fraction of the mass are not saved
+        w=res['weights']
+        order=np.argsort(w)
+        keep=np.sort(order[np.cumsum(w[order])>=tol*1e-2])
+        thetas=res['thetas'][keep]
+        thetas[:,bLog]=np.exp(thetas[:,bLog])
+        res.update({'thetas':thetas,'half':res['half'][keep],'weights':w[keep]/w[keep].sum()})
+        res['ess']=1./(res['weights']**2).sum()
+        change=np.abs(res['means'][-1]-res['means'][-2]).max() if len(res['means'])>1 else np.nan
+        print "Grid posterior: %i cells saved (%i evaluations), effective sample size %.0f, change of the means at the last refinement %.1e"%(len(thetas),res['nevaluations'],res['ess'],change)
+        ins.count('logp evaluations',res['nevaluations'])
+        save={'parameters':names,'thetas':thetas,'weights':res['weights'],'half':res['half'],'logZ':res['logZ'],'bLog':bLog}
+        pickle.dump(save,open(self.saveTo+'-grid.pickle','wb'),pickle.HIGHEST_PROTOCOL)
+        ins.fileWritten(self.saveTo+'-grid.pickle')
+        self.indexRun(settings={'sampler':'grid','n':n,'nrefine':nrefine,'tol':tol,'drop':drop,'ncells':len(thetas)})
+        if bCalc:
+            self.calcPosterior(bOverWrite=True,figFormat=figFormat)
+        return res
+
+    def reweight(self,priorsFile,burnin=None,thinF=None,bCalc=True):
+        """Importance-reweights the posterior samples to the prior distributions in 
+another priors file, without sampling again. Each sample is weighted by the ratio 
+of the new to the old prior density of its parameters (Pareto smoothed, see 
+loo.psislw, except for the cells of a grid posterior). The weights are used by write_vals and by the credible intervals of 
+the posterior calculations until the traces are loaded again (see loadMCMC).
+
+Input:
+- priorsFile (str): name of python file in ./lib/priors with the new prior 
+distributions, for the same parameters as the priors used for sampling.
+- burnin (int) - how many iterations from the begining should be discarded, from the run metadata if None (see calcPosterior).
+- thinF (int) - thining factor, from the run metadata if None.
+- bCalc (bool) - also calculate the posterior distributions and figures with the 
+weights (True, default)?
 
+Returns a dictionnary with:
+- weights (float arr): normalized weight of each sample.
+- ess (float): effective sample size, 1/sum(weights**2). Reweighting is unreliable 
+if it is small compared to the number of samples.
+- k (float): Pareto shape of the weights, reweighting is unreliable when k>0.7 (nan
+for a grid posterior, whose weights are not smoothed).
+Results are saved with the suffix '-reweighted_'+priorsFile.
+"""
+        import smc, loo
+        newPriors=importlib.import_module('lib.priors.'+priorsFile)
+        missing=[p for p in self.priors.parameters if not hasattr(newPriors,p)]
+        if missing:
+            raise ZeroError("Priors file %s does not define %s."%(priorsFile,', '.join(missing)))
+        self.loadMCMC(*self._burninThin(burnin,thinF))
+        thetas=np.array([getattr(self,p+'s') for p in self.priors.parameters],float).T
+        oldLogPrior=smc.priorFunctions(self.priors,self.priors.parameters)[1]
+        newLogPrior=smc.priorFunctions(newPriors,self.priors.parameters)[1]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            logw=newLogPrior(thetas)-oldLogPrior(thetas)
+        if not np.isfinite(logw).any():
+            raise ZeroError("All samples have zero density under the priors in %s."%priorsFile)
+        logw[~np.isfinite(logw)]=-np.inf
+        if self.weights is None:
+            lw,k=loo.psislw(logw[:,None])
+            lw,k=lw[:,0],k[0]
+        else:
+            # Cells of a grid posterior (see gridPosterior): the weights of the grid are
+            # an exact quadrature, multiplied by the ratio of the priors without smoothing
+            with np.errstate(divide='ignore'):
+                lw=logw+np.log(self.weights)
+            k=np.nan
+        w=np.exp(lw-lw.max())
+        w/=w.sum()
+        self.weights=w
+        self.ess=1./(w**2).sum()
+        print "Reweighted %i samples to the priors in %s: effective sample size %.1f, Pareto k %.2f"%(len(w),priorsFile,self.ess,k)
+        if k>0.7:
+            print "Warning: Pareto k>0.7, the new priors are too different from the old ones for reweighting, sample again."
+        
+        suffix='-reweighted_'+priorsFile
+        if bCalc:
+            if not hasattr(self,'figFormat'):
+                self.figFormat='png'
+            saveTo,name=self.saveTo,self.name
+            self.saveTo,self.name=saveTo+suffix,name+suffix
+            try:
+                self.__calc__()
+                # Posterior values and figures
+                self.__plot__()
+            finally:
+                self.saveTo,self.name=saveTo,name
+        else:
+            self.write_vals(self.saveTo+suffix+'-posteriorValues.csv')
+        return {'weights':w,'ess':self.ess,'k':k}
+    
     def write_vals(self,saveTo=None):
         """ Saves estimated parameters to csv file. 
         
@@ -168,23 +675,28 @@ figFormat (str) - format in which figures should be saved. Examples: 'png' (defa
         f.write('\t'.join(['Parameter','mean','median','95% HPD','std'])+'\n')
         for v in m.parameters:
             trac=getattr(m,v+'s')
-            hpdi=ut.hpd(trac,0.95)
+            hpdi=ut.hpd(trac,0.95,m.weights)
             form='%.2f'
             if v.startswith('p') or v.startswith('k') or v.startswith('e'):
                 form='%.2e'
+            if m.weights is None:
+                mean,std=trac.mean(),trac.std()
+            else:
+                mean=np.average(trac,weights=m.weights)
+                std=np.average((trac-mean)**2,weights=m.weights)**0.5
             
-            f.write('\t'.join([v,form%trac.mean(),form%sap(trac,50),('['+form+', '+form+']')%hpdi,form%trac.std()])+'\n')
+            f.write('\t'.join([v,form%mean,form%ut.wpercentile(trac,50,m.weights),('['+form+', '+form+']')%hpdi,form%std])+'\n')
         
         f.close()
         if saveTo==None:
-            print "Saved posterior median and confidence intervals for each parameter, see "+ m.name+'-posterior_values.csv'
+            print "Saved posterior median and confidence intervals for each parameter, see "+ m.name+'-posteriorValues.csv'
         else:
             print "Saved posterior median and confidence intervals for each parameter, see "+ saveTo
 
 class DoseResponseModels(Models):
     """ Includes all functions common to dose-response models. """
-    def __init__(self, data, priors, name, path, bRandomIni):
-        super(DoseResponseModels,self).__init__(data, priors, name, path, bRandomIni)
+    def __init__(self, data, priors, name, path, bRandomIni, bPointwise=False):
+        super(DoseResponseModels,self).__init__(data, priors, name, path, bRandomIni, bPointwise)
     
     def plotDoseResponse(self,name=None,colors=None):
         """Plots the estimated dose-response function with confidence intervals. 
@@ -221,13 +733,17 @@ class DoseResponseModels(Models):
         print "Plotted dose-response curve, see "+m.name+"."+m.figFormat
         return f,ax
     
-    def plotPosterior(self,name=None, colors=None):
+    def plotPosterior(self,name=None, colors=None, nsamples=2000):
         """Plots the posterior intervals for the dose-response curve, the beta 
         distribution of the second group and the correlation between the 
         parameters a and b from the beta distribution.
 
         Equivalent figure in article: Figure 3.
 
+        Input:
+        - nsamples (int) - number of posterior samples (evenly spaced) used for the 
+        interval of the beta distribution, all if None.
+
         Returns:
         - f (Figure)
         - ax1, ax2, ax3 (Axes) - axes from each of the panels"""
@@ -240,10 +756,10 @@ class DoseResponseModels(Models):
         pi1_ci=m.pi1_ci
         pi2_ci=m.pi2_ci
         x2=m.x2
-        prevfsize=rcParams['font.size']
-        prevlsize=rcParams['axes.labelsize']
-        rcParams.update({'font.size': 8})
-        rcParams['axes.labelsize']='large'
+        prevfsize=mpl.rcParams['font.size']
+        prevlsize=mpl.rcParams['axes.labelsize']
+        mpl.rcParams.update({'font.size': 8})
+        mpl.rcParams['axes.labelsize']='large'
         f=pl.figure(figsize=(8,1.95))
         f.subplots_adjust(wspace=0.45)
         ax1=f.add_subplot(131)
@@ -269,9 +785,11 @@ class DoseResponseModels(Models):
         
         ax2=f.add_subplot(132)
         x=np.arange(0,1,0.005)
-        N=np.array([st.beta.pdf(x,a2s[i],b2s[i]) for i in range(len(a2s))])
-        ax2.plot(x,sap(N,50),colors[1]+'-',label='Heterogeneous')
-        ax2.fill_between(x,sap(N,2.5),sap(N,97.5),facecolor=colors[1], lw=0,alpha=0.2)
+        sub=slice(None) if (nsamples==None or nsamples>=len(a2s)) else np.linspace(0,len(a2s)-1,nsamples).astype(int)
+        N=st.beta.pdf(x[None,:],a2s[sub][:,None],b2s[sub][:,None])
+        N=ut.wpercentile(N,[2.5,50,97.5],None if m.weights is None else m.weights[sub])
+        ax2.plot(x,N[1],colors[1]+'-',label='Heterogeneous')
+        ax2.fill_between(x,N[0],N[2],facecolor=colors[1], lw=0,alpha=0.2)
         ax2.set_xlabel(r'susceptibility, $x$')
         ax2.set_ylabel(r'$q(x)$')    
         ax2.text(-0.25, 1.15, 'B', transform=ax2.transAxes,
@@ -286,23 +804,101 @@ class DoseResponseModels(Models):
         ax3.set_ylim([0.1,10])
         ax3.set_xscale('log')
         ax3.set_yscale('log')
-        ax3.plot(sap(a2s,50),sap(b2s,50),'ro',mec='r',ms=3)
+        ax3.plot(ut.wpercentile(a2s,50,m.weights),ut.wpercentile(b2s,50,m.weights),'ro',mec='r',ms=3)
         ax3.text(-0.25, 1.15, 'C', transform=ax3.transAxes,
                   fontsize=12, fontweight='bold', va='top', ha='right')
         
         if name==None:
             name='-plotPosterior'
         f.savefig(m.saveTo+name+'.'+m.figFormat, bbox_inches='tight',dpi=600)
-        rcParams.update({'font.size': prevfsize})
-        rcParams['axes.labelsize']=prevlsize
+        mpl.rcParams.update({'font.size': prevfsize})
+        mpl.rcParams['axes.labelsize']=prevlsize
         print "Plotted dose-response curve, beta distribution and a-b correlation, see "+ m.name+name+'.'+m.figFormat
         return f,ax1,ax2,ax3
     
 
+_scheduled={}
+def scheduledStepMethod(cls):
+    """Returns a subclass of the pymc step method cls (e.g. Metropolis) that updates its
+stochastic nrepeat times per iteration (see Models.schedule), optionally reflects its
+proposals at the bounds of a Binomial stochastic (bReflect), and counts the proposals
+and the causes of the rejected ones, and the evaluations of the log-probability (logp_plus_loglike, of the
+current value and of each proposal), in the counters of the run report (see 
+rejections). It is never assigned automatically by pymc."""
+    if cls not in _scheduled:
+        def __init__(self,stochastic,nrepeat=1,bReflect=False,**kwargs):
+            cls.__init__(self,stochastic,**kwargs)
+            self.nrepeat=nrepeat
+            self.bReflect=bReflect
+            self._zeroCause=None
+        def step(self):
+            for i in xrange(self.nrepeat):
+                self._zeroCause=None
+                ins.count('proposals')
+                cls.step(self)
+        def propose(self):
+            cls.propose(self)
+            if self.bReflect:
+                n=self.stochastic.parents['n']
+                n=getattr(n,'value',n)
+                v=self.stochastic.value
+                if v<0 or v>n:
+                    # Reflected about -1/2 and n+1/2 (repeatedly for steps larger than
+                    # n), so that the proposal stays symmetric, also from and to 0 and n
+                    while v<0 or v>n:
+                        v=-v-1 if v<0 else 2*n+1-v
+                    # Back to the current value first, which reject restores
+                    self.stochastic.revert()
+                    self.stochastic.value=v
+        def reject(self):
+            cls.reject(self)
+            ins.count('rejected: '+(self._zeroCause or 'Metropolis ratio'))
+        def logp_plus_loglike(self):
+            # Prior first: the likelihood of proposals out of its support is not computed
+            ins.count('logp evaluations')
+            try:
+                return sum([s.logp for s in self.stochastics])+self.loglike
+            except py.ZeroProbability:
+                self._zeroCause=_zeroCause(self)
+                raise
+        _scheduled[cls]=type('Scheduled'+cls.__name__,(cls,),{'__init__':__init__,'step':step,'propose':propose,'reject':reject,
+                                                            'logp_plus_loglike':property(logp_plus_loglike),
+                                                            'competence':staticmethod(lambda s: 0)})
+    return _scheduled[cls]
+
+def _zeroCause(sm):
+    """Cause of the zero probability of the proposal of step method sm: out of the 
+support of the prior, a potential (constraint), the likelihood of the data, or the 
+probability of a latent variable."""
+    for node in sm.markov_blanket:
+        try:
+            node.logp
+        except py.ZeroProbability:
+            if node in sm.stochastics:
+                return 'prior support '+re.sub(r'\d+','*',node.__name__)
+            if isinstance(node,py.Potential):
+                return 'potential '+node.__name__
+            if node.observed:
+                return 'likelihood zero'
+            return 'latent variable zero'
+    return 'zero probability'
+
+def rejections(since=None):
+    """Returns the proposals and the proposals rejected by cause (see Models.schedule)
+counted since the snapshot since (see instrument.snapshot), or since the last 
+instrument.reset if None, as a dictionnary."""
+    return dict([(k,v) for k,v in ins.report(since)['counters'].items() if k=='proposals' or k.startswith('rejected: ')])
+
+def printRejections(since=None):
+    res=rejections(since)
+    if res.get('proposals'):
+        n=float(res.pop('proposals'))
+        print "Rejected proposals: "+', '.join(['%s %.1f%%'%(k[len('rejected: '):],100*v/n) for k,v in sorted(res.items(),key=lambda kv:-kv[1])])
+
 class TimeModels(Models):
     """ Includes all methods that are common to all survival over time models. """
     
-    def __init__(self, data, priors, name, path, bRandomIni):
+    def __init__(self, data, priors, name, path, bRandomIni, bPointwise=False):
         # Reducing times to those where a change occurs at least once
         # (compute the probabilities only at the times there was change)
         self.d=data.copy()
@@ -312,25 +908,7 @@ class TimeModels(Models):
         m.chgT=chgT
         m.iTd1=iTd1
         m.iTd2=iTd2
-        super(TimeModels,self).__init__(data, priors, name, path, bRandomIni)
-    
-    @classmethod
-    def savedModel(Model,path):
-        """Initializes a model from saved results folder. """
-        path+=('' if path[-1]==os.path.sep else os.path.sep)
-        data=df.Data.fromPickle(path+'data.pickle')
-        # /!\ Only one model should be loaded per python session, or priors may get mixed up...
-        sys.path.append(path)
-        priors=importlib.import_module('prior')
-        model=pickle.load(open(path+'model.pickle'))
-        mod=Model(data,priors,model['name'], path)
-        try:
-            traces=pickle.load(open(path+mod.name+'.pickle'))
-            for v in mod.parameters:
-                setattr(self,v+'s', saved[v+'s'])
-        except IOError:
-            print "There was some error with the given path: %s"%path
-        return mod
+        super(TimeModels,self).__init__(data, priors, name, path, bRandomIni, bPointwise)
     
     def likelihood_setup(self,bRandomIni):
         m=self
@@ -380,11 +958,11 @@ class TimeModels(Models):
         ts=m.ts
         cdf1_ci=m.cdf1_ci
         cdf2_ci=m.cdf2_ci
-        rcParams.update({'font.size': 8})
-        rcParams['axes.labelsize'] = 'medium'
-        rcParams['font.sans-serif'] = 'Arial'
-        rcParams['axes.linewidth']=0.5
-        rcParams['mathtext.default']='regular'
+        mpl.rcParams.update({'font.size': 8})
+        mpl.rcParams['axes.labelsize'] = 'medium'
+        mpl.rcParams['font.sans-serif'] = 'Arial'
+        mpl.rcParams['axes.linewidth']=0.5
+        mpl.rcParams['mathtext.default']='regular'
         
         f=pl.figure(figsize=(8,3))
         letters=['A','B','C','D','E','F','G','H']
@@ -447,8 +1025,8 @@ class TimeModels(Models):
         def stdGamma(shape, scale):
             return (shape*(scale)**2)**0.5
         
-        stdnegs=ut.confint(stdGamma(m.sI1s,m.tauI1s))
-        stdposs=ut.confint(stdGamma(m.sI2s,m.tauI2s))
+        stdnegs=ut.confint(stdGamma(m.sI1s,m.tauI1s),m.weights)
+        stdposs=ut.confint(stdGamma(m.sI2s,m.tauI2s),m.weights)
         return stdnegs, stdposs
 
 
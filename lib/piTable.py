@@ -0,0 +1,144 @@
+""" Precomputed table of the probability of infection of the heterogeneous model, to
+replace the confluent hypergeometric function of utils.pi_het by an interpolation.
+
+The table holds 1F1(a;a+b;-dose*p) on a regular grid of log(dose*p), log(a) and
+log(b), and is interpolated multilinearly. It is built once with build, which also
+measures the maximum error of the interpolation, and saved as a .npy file (with the
+grid and the error in a .json file next to it). Loading it with use memory maps the
+file read-only: worker processes started afterwards (calcPosterior with nprocs>1,
+multiprocessing pools) share the same pages instead of reading their own copy.
+
+Once loaded, utils.pi_het uses the table for the values inside the grid, and the
+exact function outside of it (dose 0, dose*p, a or b out of range) or when the
+caller asks for a smaller error than that of the table:
+    piTable.build('./data/piTable.npy')     # once
+    piTable.use('./data/piTable.npy')       # in each run
+    ut.pi_het(doses,ps,a2s,b2s,epss)                # interpolated
+    ut.pi_het(doses,ps,a2s,b2s,epss,maxError=1e-8)  # exact
+The table speeds up the evaluation of many values at once (posterior calculations,
+simulations, about 3 times faster than the exact function); calls with fewer than
+minSize values (e.g. those of the likelihoods during sampling, one dose at a time)
+are still computed exactly, as the interpolation costs more for a few values.
+"""
+import json, os
+import numpy as np
+import scipy.special as sp
+import instrument as ins
+
+_table={'values':None,'grid':None,'maxError':None,'filename':None}
+minSize=64
+
+def build(filename,xRange=(-14.,14.),nx=561,abRange=(0.1,10.),nab=100,ncheck=100000):
+    """Computes the table and saves it.
+
+Input:
+- filename (str): path of the table (.npy), its description is saved in filename+'.json'.
+- xRange (float, float): range of log(dose*p), the default covers dose*p from 1e-6 to 1e6.
+- nx (int): number of values of log(dose*p).
+- abRange (float, float): range of a and b, the default is that of the priors
+(the hypergeometric function is not accurate outside of it).
+- nab (int): number of values of log(a) and log(b).
+- ncheck (int): number of random points (centres of grid cells, where the
+interpolation error is the largest) used to measure the maximum error.
+
+Returns the maximum error measured (absolute, on the probability of infection).
+"""
+    grid={'x':[float(xRange[0]),float(xRange[1]),int(nx)],
+          'la':[float(np.log(abRange[0])),float(np.log(abRange[1])),int(nab)],
+          'lb':[float(np.log(abRange[0])),float(np.log(abRange[1])),int(nab)]}
+    x,la,lb=[np.linspace(*grid[k]) for k in ('x','la','lb')]
+    a=np.exp(la)[None,:,None]
+    b=np.exp(lb)[None,None,:]
+    values=sp.hyp1f1(a,a+b,-np.exp(x)[:,None,None])
+    if not np.isfinite(values).all():
+        raise ValueError("The hypergeometric function is not finite over the whole grid, reduce abRange.")
+
+    # Error at the centres of random cells
+    i,j,k=[np.random.randint(n-1,size=ncheck) for n in (nx,nab,nab)]
+    xc=(x[i]+x[i+1])/2.
+    ac=np.exp((la[j]+la[j+1])/2.)
+    bc=np.exp((lb[k]+lb[k+1])/2.)
+    maxError=float(np.abs(_interpolate(values,grid,xc,np.log(ac),np.log(bc))-sp.hyp1f1(ac,ac+bc,-np.exp(xc))).max())
+
+    np.save(filename+'.tmp.npy',values)
+    os.rename(filename+'.tmp.npy',filename)
+    json.dump({'grid':grid,'maxError':maxError},open(filename+'.json','w'),sort_keys=True)
+    return maxError
+
+def use(filename):
+    """Loads the table saved in filename (memory mapped), utils.pi_het uses it until
+use(None) is called.
+
+Returns the maximum error of the table."""
+    if filename==None:
+        _table.update({'values':None,'grid':None,'maxError':None,'filename':None})
+        return None
+    desc=json.load(open(filename+'.json'))
+    values=np.load(filename,mmap_mode='r')
+    if values.shape!=tuple(desc['grid'][k][2] for k in ('x','la','lb')):
+        raise ValueError("%s does not match its description %s.json, build it again."%(filename,filename))
+    _table.update({'values':values,'grid':desc['grid'],'maxError':desc['maxError'],'filename':filename})
+    return desc['maxError']
+
+def exact(dose,p,a,b):
+    """Exact probability of infection of an effective challenge in the heterogeneous
+model, 1-1F1(a;a+b;-dose*p). For small dose*p, 1-1F1 cancels to 0 and is replaced by 
+the first terms of its series. Used by pi_het and utils.pi_het."""
+    z=np.multiply(dose,p)
+    c=np.add(a,b)
+    series=np.multiply(a,z)/c*(1-(np.add(a,1.)*z)/(2*(c+1)))
+    return np.where(z<1e-4,series,1-sp.hyp1f1(a,c,-z))
+
+def pi_het(dose,p,a,b,eps,maxError=None):
+    """Probability of infection from the heterogeneous model (see utils.pi_het),
+interpolated from the table in use, or exact outside of the table, if no table is
+used, or if maxError is smaller than the error of the table."""
+    dose,p,a,b,eps=np.broadcast_arrays(*[np.asarray(v,float) for v in (dose,p,a,b,eps)])
+    if _table['values'] is None or dose.size<minSize or (maxError!=None and maxError<_table['maxError']):
+        ins.count('pi_het exact')
+        res=exact(dose,p,a,b)*(1-eps)
+        return res if res.ndim else res[()]
+    grid=_table['grid']
+    with np.errstate(divide='ignore',invalid='ignore'):
+        x=np.log(dose*p)
+        la=np.log(a)
+        lb=np.log(b)
+    inside=np.isfinite(x)&np.isfinite(la)&np.isfinite(lb)
+    for v,k in ((x,'x'),(la,'la'),(lb,'lb')):
+        inside&=(v>=grid[k][0])&(v<=grid[k][1])
+    nin=int(inside.sum())
+    if nin==inside.size:
+        res=1-_interpolate(_table['values'],grid,x,la,lb)
+    else:
+        res=np.empty(dose.shape)
+        res[inside]=1-_interpolate(_table['values'],grid,x[inside],la[inside],lb[inside])
+        out=~inside
+        res[out]=exact(dose[out],p[out],a[out],b[out])
+    ins.count('pi_het interpolated',nin)
+    ins.count('pi_het exact',inside.size-nin)
+    res=res*(1-eps)
+    return res if res.ndim else res[()]
+
+def _interpolate(values,grid,x,la,lb):
+    """Multilinear interpolation of values at points inside the grid."""
+    # Plain array on the memory mapped buffer (indexing a memmap is slower)
+    flat=np.asarray(values).reshape(-1)
+    base=0
+    frac=[]
+    for v,k in ((x,'x'),(la,'la'),(lb,'lb')):
+        lo,hi,n=grid[k]
+        u=(v-lo)*((n-1)/(hi-lo))
+        i=np.minimum(u.astype(int),n-2)
+        base=base*n+i
+        frac.append(u-i)
+    nb=grid['lb'][2]
+    stride=grid['la'][2]*nb
+    fx,fa,fb=frac
+    def lerpB(off):
+        v0=flat.take(base+off)
+        return v0+(flat.take(base+off+1)-v0)*fb
+    def lerpA(off):
+        v0=lerpB(off)
+        return v0+(lerpB(off+nb)-v0)*fa
+    v0=lerpA(0)
+    return v0+(lerpA(stride)-v0)*fx
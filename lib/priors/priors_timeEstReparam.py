@@ -0,0 +1,54 @@
+import pymc as py
+import numpy as np
+
+# Same priors as priors_timeEst, sampled on scales where their constraints hold by
+# construction: the sampler proposes the log of p, a2, b2 and of the shapes of the time to
+# death of infected hosts, and the mean time to death of infected hosts as a fraction of
+# that of uninfected hosts (meanI<meanU). The parameters of timeEst are deterministic
+# functions of these, with the same names.
+# To use: timeEst.Model.setup(data,priorsFile='priors_timeEstReparam')
+
+def logUniform(name,lower,upper,value):
+    """Returns the stochastic log(X) for X ~ Uniform(lower,upper), with the log-density
+    of the log of a Uniform variable (X has the same prior as in priors_timeEst)."""
+    llower=np.log(lower) if lower>0 else -np.inf
+    lupper=np.log(upper)
+    def logp(value):
+        return value-np.log(upper-lower) if llower<=value<=lupper else -np.inf
+    def random():
+        return np.log(np.random.uniform(lower,upper))
+    return py.Stochastic(logp=logp,doc='log(%s)'%name[1:],name=name,parents={},random=random,
+                         dtype=float,value=np.log(value))
+
+# Infection parameters
+lp=logUniform('lp',0,1,10**-6)
+la2=logUniform('la2',0.1,10,0.2)
+lb2=logUniform('lb2',0.1,10,0.1)
+p=py.Lambda('p',lambda lp=lp: np.exp(lp))
+a2=py.Lambda('a2',lambda la2=la2: np.exp(la2))
+b2=py.Lambda('b2',lambda lb2=lb2: np.exp(lb2))
+eps=py.TruncatedNormal('eps',mu=0,tau=1/(0.00125**2),a=0,b=1/0.00125) # Truncated with values restricted between 0 and 1
+
+# Parameters for the time to death of controls (and uninfected)
+k=py.Normal('k',mu=0.0011715764701768433,tau=1/(0.0003659234910936011)**2)
+meanU=py.Normal('meanU',mu=117.25340837531996,tau=1/(1.2902129894769683)**2)
+sU=py.Normal('sU',mu=120.52152424700324,tau=1/(22.027083525382587)**2)
+
+# Parameters for the time to death of infected (meanI ~ Uniform(0,meanU))
+fI1=py.Uniform('fI1',0.,1.,value=23.3/117.25)
+lsI1=logUniform('lsI1',0.,100,12)
+fI2=py.Uniform('fI2',0.,1.,value=23.3/117.25)
+lsI2=logUniform('lsI2',0.,100,12)
+meanI1=py.Lambda('meanI1',lambda f=fI1,meanU=meanU: f*meanU)
+sI1=py.Lambda('sI1',lambda lsI1=lsI1: np.exp(lsI1))
+meanI2=py.Lambda('meanI2',lambda f=fI2,meanU=meanU: f*meanU)
+sI2=py.Lambda('sI2',lambda lsI2=lsI2: np.exp(lsI2))
+
+#Save the name of the parameters, in the order you prefer to see them in the saved results
+#(the sampled parameters before the parameters of timeEst that depend on them)
+parameters=['lp','p','la2','a2','lb2','b2','eps']
+parameters.extend(['meanU','sU','k'])
+parameters.extend(['fI1','meanI1','lsI1','sI1'])
+parameters.extend(['fI2','meanI2','lsI2','sI2'])
+#Sampled parameters of the mortality block of the sampling schedule (see Models.schedule)
+mortality=['meanU','sU','k','fI1','lsI1','fI2','lsI2']
@@ -0,0 +1,29 @@
+import pymc as py
+
+# Infection parameters of the reference group (group 1, homogeneous susceptibility)
+p=py.Uniform('p',0,1,10**-6)
+eps=py.TruncatedNormal('eps',mu=0,tau=1/(0.00125**2),a=0,b=1/0.00125) # Truncated with values restricted between 0 and 1
+
+# Parameters for the time to death of controls (and uninfected), shared by all groups
+k=py.Normal('k',mu=0.0011715764701768433,tau=1/(0.0003659234910936011)**2)
+meanU=py.Normal('meanU',mu=117.25340837531996,tau=1/(1.2902129894769683)**2)
+sU=py.Normal('sU',mu=120.52152424700324,tau=1/(22.027083525382587)**2)
+
+# Parameters for the time to death of infected hosts of the reference group
+meanI1=py.Uniform('meanI1',0.,meanU,value=23.3)
+sI1=py.Uniform('sI1',0.,100,value=12)
+
+def groupParameters(g):
+    """Returns the parameters of group g (from 2 to the number of groups): shape
+    parameters ag, bg of the distribution of susceptibility compared to the reference
+    group, and meanIg, sIg of the time to death of infected hosts."""
+    return [py.Uniform('a%i'%g,0.1,10,0.2),
+            py.Uniform('b%i'%g,0.1,10,0.1),
+            py.Uniform('meanI%i'%g,0.,meanU,value=23.3),
+            py.Uniform('sI%i'%g,0.,100,value=12)]
+
+#Save the name of the parameters, in the order you prefer to see them in the saved results
+#(those of groups 2, 3... are added by the model, after these)
+parameters=['p','eps']
+parameters.extend(['meanU','sU','k'])
+parameters.extend(['meanI1','sI1'])
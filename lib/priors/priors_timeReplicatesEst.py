@@ -0,0 +1,47 @@
+import pymc as py
+import numpy as np
+
+# Probability of ineffective challenge, shared by all replicates
+eps=py.TruncatedNormal('eps',mu=0,tau=1/(0.00125**2),a=0,b=1/0.00125) # Truncated with values restricted between 0 and 1
+
+# Parameters pooled across replicates: in each replicate, the parameter follows a
+# Lognormal distribution with mean mu_X and standard deviation sd_X on the log scale.
+# Priors of mu_X are those of timeEst for the parameters of natural mortality (set from
+# those estimated from control survival), and vague for the others.
+def hyper(name,mu,sd,value,sdMax=2.):
+    """Returns the hyperparameters mu_name and sd_name of pooled parameter name."""
+    return (py.Normal('mu_'+name,mu=mu,tau=1./sd**2,value=value),
+            py.Uniform('sd_'+name,0,sdMax,value=0.1))
+
+mu_p,sd_p=hyper('p',np.log(1e-6),5.,np.log(1e-6))
+mu_a2,sd_a2=hyper('a2',0.,2.,np.log(0.2))
+mu_b2,sd_b2=hyper('b2',0.,2.,np.log(0.1))
+mu_meanU,sd_meanU=hyper('meanU',np.log(117.25340837531996),0.011,np.log(117.25340837531996))
+mu_sU,sd_sU=hyper('sU',np.log(120.52152424700324),0.18,np.log(120.52152424700324))
+mu_k,sd_k=hyper('k',np.log(0.0011715764701768433),0.31,np.log(0.0011715764701768433))
+mu_meanI1,sd_meanI1=hyper('meanI1',np.log(23.3),1.,np.log(23.3))
+mu_sI1,sd_sI1=hyper('sI1',np.log(12.),1.,np.log(12.))
+mu_meanI2,sd_meanI2=hyper('meanI2',np.log(23.3),1.,np.log(23.3))
+mu_sI2,sd_sI2=hyper('sI2',np.log(12.),1.,np.log(12.))
+
+pooled=['p','a2','b2','meanU','sU','k','meanI1','sI1','meanI2','sI2']
+initial={'p':1e-6,'a2':0.2,'b2':0.1,'meanU':117.25,'sU':120.5,'k':0.00117,'meanI1':23.3,'sI1':12.,'meanI2':23.3,'sI2':12.}
+
+# Range of the parameters of each replicate (as for the Uniform priors of timeEst, the
+# probability of infection of the heterogeneous model is not accurate outside of it)
+bounds={'a2':(0.1,10),'b2':(0.1,10)}
+
+def replicateParameters(r):
+    """Returns the parameters of replicate r (X_rr for X in pooled)."""
+    res=[]
+    for name in pooled:
+        mu=globals()['mu_'+name]
+        sd=globals()['sd_'+name]
+        res.append(py.Lognormal('%s_r%i'%(name,r),mu=mu,tau=1./sd**2,value=initial[name]))
+    return res
+
+#Save the name of the parameters, in the order you prefer to see them in the saved results
+#(those of each replicate are added by the model, after these)
+parameters=['eps']
+parameters.extend(['mu_'+name for name in pooled])
+parameters.extend(['sd_'+name for name in pooled])
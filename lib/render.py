@@ -0,0 +1,47 @@
+""" Rendering of figures as a separate stage, from the posterior calculations saved in
+a results folder (-postcalc.pickle, see Models.calcPosterior).
+
+Each figure is rendered in its own worker process, with the non-interactive Agg
+backend, from a model object that only holds the saved calculations (see
+Models.fromResults): neither the traces nor pymc are loaded.
+
+Example, after mod.calcPosterior(bPlot=False) in a batch run:
+    import render
+    render.renderFigures('timeEst','./results/wolb2012_timeEst/wolb2012_timeEst')
+"""
+import importlib, multiprocessing
+
+def _render(args):
+    """Renders one figure. Runs in a worker process."""
+    modelName,saveTo,figure,figFormat=args
+    import matplotlib
+    matplotlib.use('Agg')
+    import pylab as pl
+    model=importlib.import_module(modelName)
+    mod=model.Model.fromResults(saveTo,figFormat)
+    getattr(mod,figure)()
+    pl.close('all')
+    return figure
+
+def renderFigures(modelName,saveTo,figures=None,figFormat='png',nprocs=None):
+    """Renders figures in parallel worker processes.
+
+Input:
+- modelName (str): name of the model module, e.g. 'timeEst'.
+- saveTo (str): path and name of the results, e.g. './results/wolb2012_timeEst/wolb2012_timeEst'.
+- figures (list of str): names of the plotting methods, defaults to Model.__figures__.
+- figFormat (str): format of the figures.
+- nprocs (int): number of worker processes, defaults to one per figure (at most the
+number of cpus).
+"""
+    if figures==None:
+        figures=importlib.import_module(modelName).Model.__figures__
+    if nprocs==None:
+        nprocs=min(len(figures),multiprocessing.cpu_count())
+    pool=multiprocessing.Pool(nprocs)
+    try:
+        done=pool.map(_render,[(modelName,saveTo,f,figFormat) for f in figures])
+    finally:
+        pool.close()
+        pool.join()
+    return done
@@ -0,0 +1,235 @@
+""" SQLite index of the runs saved in a results folder (savePath, ./results by
+default), in savePath/runs.sqlite.
+
+Each run (results folder) has a row with:
+- path: the results folder, relative to savePath (so that savePath can be moved);
+- name, runNumber: the name of the run and the number of its 'Run (X)' subfolder
+(1 for the folder called name itself), see allocate;
+- model: module of the model (e.g. 'timeEst'), dataName, dataHash: content hash of
+the data (see Data.contentHash, independent of the files it was read from),
+priorsFile and priorsHash (sha1 of the priors file copied in the results folder);
+- created, updated: times (seconds since the epoch);
+- settings: sampler settings and run metadata (niterations, burnin, thinF...);
+- timings: seconds spent in each stage of the run (see instrument.py);
+- artifacts: files of the run (traces, grid, posterior calculations...), relative
+to the results folder.
+settings, timings and artifacts are JSON dictionnaries, merged at each update.
+
+Folders are allocated by ut.initializeFolder with allocate, in a transaction, so that
+runs started at the same time from different processes get different folders. Runs
+are recorded by the models after sampling and after the posterior calculations (see
+Models.indexRun), and found with find:
+    runIndex.find(data=data,model='timeEst',priorsFile='priors_timeEst')
+Results folders created before the index (or copied from elsewhere) are added with
+scan.
+"""
+import os, time, json, hashlib, sqlite3
+
+indexName='runs.sqlite'
+_json=('settings','timings','artifacts')
+_columns=('path','name','runNumber','model','dataName','dataHash','priorsFile','priorsHash',
+          'created','updated')+_json
+# Files of a run, after its saveTo prefix
+artifactSuffixes={'traces':'-MCMC.pickle','compact traces':'-MCMC.npz','grid':'-grid.pickle',
+                  'postcalc':'-postcalc.pickle','posterior values':'-posteriorValues.csv',
+                  'report':'-runReport.json','convergence':'-convergence.csv','loo':'-loo.csv'}
+
+def defaultPath(savePath=None):
+    return os.path.join('.','results') if savePath==None else savePath
+
+def indexFile(savePath=None):
+    """Path of the index of the results folder savePath."""
+    return os.path.join(defaultPath(savePath),indexName)
+
+def connect(savePath=None):
+    """Opens the index of savePath (created if needed) and returns the connection."""
+    savePath=defaultPath(savePath)
+    if not os.path.exists(savePath):
+        os.makedirs(savePath)
+    conn=sqlite3.connect(indexFile(savePath),timeout=60,isolation_level=None)
+    conn.row_factory=sqlite3.Row
+    conn.execute("""CREATE TABLE IF NOT EXISTS runs (path TEXT PRIMARY KEY, name TEXT,
+        runNumber INTEGER, model TEXT, dataName TEXT, dataHash TEXT, priorsFile TEXT,
+        priorsHash TEXT, created REAL, updated REAL, settings TEXT, timings TEXT,
+        artifacts TEXT)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS runsName ON runs (name, runNumber)")
+    conn.execute("CREATE INDEX IF NOT EXISTS runsFit ON runs (dataHash, model, priorsHash)")
+    return conn
+
+def fileHash(filename):
+    """sha1 of the content of a file."""
+    return hashlib.sha1(open(filename,'rb').read()).hexdigest()
+
+def _relative(savePath,path):
+    return os.path.relpath(path,defaultPath(savePath))
+
+def allocate(savePath,name,bOverWrite):
+    """Allocates the results folder of a new run called name in savePath: savePath/name
+if it does not exist or bOverWrite, else the subfolder savePath/name/Run (X) with the
+next free number X. The folder is created and added to the index.
+
+Returns the folder and whether it existed."""
+    savePath=defaultPath(savePath)
+    base=os.path.join(savePath,name)
+    conn=connect(savePath)
+    try:
+        # Locks the index until the folder is created
+        conn.execute('BEGIN IMMEDIATE')
+        if bOverWrite or not os.path.exists(base):
+            path,number=base,1
+        else:
+            row=conn.execute('SELECT MAX(runNumber) FROM runs WHERE name=?',(name,)).fetchone()
+            number=max(row[0] or 1,1)+1
+            # Folders created outside of the index
+            while os.path.exists(os.path.join(base,'Run (%i)'%number)):
+                number+=1
+            path=os.path.join(base,'Run (%i)'%number)
+        bExisted=os.path.exists(path)
+        if not bExisted:
+            os.makedirs(path)
+        now=time.time()
+        conn.execute('INSERT OR REPLACE INTO runs (path,name,runNumber,created,updated,settings,timings,artifacts) VALUES (?,?,?,?,?,?,?,?)',
+                     (_relative(savePath,path),name,number,now,now,'{}','{}','{}'))
+        conn.execute('COMMIT')
+    except:
+        _rollback(conn)
+        raise
+    finally:
+        conn.close()
+    return path,bExisted
+
+def _rollback(conn):
+    try:
+        conn.execute('ROLLBACK')
+    except sqlite3.Error:
+        # No transaction in progress
+        pass
+
+def update(savePath,path,**fields):
+    """Updates the row of the run in folder path (added if it is not in the index).
+Fields settings, timings and artifacts (dict) are merged with those recorded."""
+    unknown=[k for k in fields if k not in _columns]
+    if unknown:
+        raise ValueError("Unknown fields of the run index: %s"%', '.join(unknown))
+    rel=_relative(savePath,path)
+    conn=connect(savePath)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row=conn.execute('SELECT * FROM runs WHERE path=?',(rel,)).fetchone()
+        now=time.time()
+        if row==None:
+            conn.execute('INSERT INTO runs (path,name,runNumber,created,settings,timings,artifacts) VALUES (?,?,?,?,?,?,?)',
+                         (rel,rel.split(os.path.sep)[0],1,now,'{}','{}','{}'))
+            row=conn.execute('SELECT * FROM runs WHERE path=?',(rel,)).fetchone()
+        for k in _json:
+            if k in fields:
+                merged=json.loads(row[k] or '{}')
+                merged.update(fields[k])
+                fields[k]=json.dumps(merged,sort_keys=True)
+        fields['updated']=now
+        keys=sorted(fields)
+        conn.execute('UPDATE runs SET %s WHERE path=?'%', '.join(['%s=?'%k for k in keys]),
+                     [fields[k] for k in keys]+[rel])
+        conn.execute('COMMIT')
+    except:
+        _rollback(conn)
+        raise
+    finally:
+        conn.close()
+
+def artifacts(saveTo):
+    """Files of the run with prefix saveTo that exist, relative to its folder."""
+    return dict([(k,os.path.basename(saveTo+s)) for k,s in artifactSuffixes.items() if os.path.exists(saveTo+s)])
+
+def find(savePath=None,data=None,model=None,priorsFile=None,**where):
+    """Finds runs in the index.
+
+Input:
+- savePath (str): results folder (./results if None).
+- data (df.Data): runs on the same data (same content hash).
+- model (str or Model class): module of the model, e.g. 'timeEst' or timeEst.Model.
+- priorsFile (str): runs with the priors of ./lib/priors/priorsFile.py (same content).
+- where: other columns and their values, e.g. name='wolb2012_timeEst',
+dataHash='...'.
+
+Returns a list of dictionnaries (one per run, most recent first) with the columns
+of the index, the folder of the run (path, including savePath) and the artifacts
+(paths including the folder).
+"""
+    if data!=None:
+        where['dataHash']=data.contentHash()
+    if model!=None:
+        where['model']=model if isinstance(model,basestring) else model.__module__
+    if priorsFile!=None:
+        where['priorsHash']=fileHash(os.path.join('.','lib','priors',priorsFile+'.py'))
+    unknown=[k for k in where if k not in _columns]
+    if unknown:
+        raise ValueError("Unknown fields of the run index: %s"%', '.join(unknown))
+    keys=sorted(where)
+    sql='SELECT * FROM runs'+(' WHERE '+' AND '.join(['%s=?'%k for k in keys]) if keys else '')+' ORDER BY created DESC'
+    conn=connect(savePath)
+    try:
+        rows=conn.execute(sql,[where[k] for k in keys]).fetchall()
+    finally:
+        conn.close()
+    res=[]
+    for row in rows:
+        run=dict([(k,row[k]) for k in row.keys()])
+        for k in _json:
+            run[k]=json.loads(run[k] or '{}')
+        run['path']=os.path.join(defaultPath(savePath),run['path'])+os.path.sep
+        run['artifacts']=dict([(k,run['path']+f) for k,f in run['artifacts'].items()])
+        res.append(run)
+    return res
+
+def scan(savePath=None):
+    """Adds the results folders of savePath that are not in the index (those with a
+model.pickle), e.g. created before the index. The model of runs saved before it was
+recorded in model.pickle is guessed from the name of the run.
+
+Returns the number of runs added."""
+    import pickle
+    import dataFunctions as df
+    savePath=defaultPath(savePath)
+    conn=connect(savePath)
+    try:
+        known=set([r[0] for r in conn.execute('SELECT path FROM runs')])
+    finally:
+        conn.close()
+    added=0
+    for folder,dirs,files in os.walk(savePath):
+        if 'model.pickle' not in files:
+            continue
+        rel=_relative(savePath,folder)
+        if rel in known:
+            continue
+        path=folder+os.path.sep
+        meta=pickle.load(open(path+'model.pickle'))
+        fields={'name':meta['name'],'settings':dict([(k,v) for k,v in meta.items() if k not in ('path','saveTo','name','runIndex')])}
+        parent,sub=os.path.split(rel)
+        if sub.startswith('Run (') and sub.endswith(')'):
+            fields['runNumber']=int(sub[5:-1])
+        fields['model']=meta.get('model',_guessModel(meta['name']))
+        fields['priorsFile']=meta.get('priorsFile')
+        if 'prior.py' in files:
+            fields['priorsHash']=fileHash(path+'prior.py')
+        if 'data.dat' in files:
+            data=df.Data.fromBinary(path+'data.dat',bVerify=False)
+            fields['dataHash']=data.contentHash()
+            fields['dataName']=getattr(data,'dataName',None)
+        fields['artifacts']=artifacts(path+meta['name'])
+        fields['created']=os.path.getmtime(path+'model.pickle')
+        update(savePath,folder,**fields)
+        added+=1
+    return added
+
+# Default names of the runs of each model (dataName+Model.__defaultName__)
+_defaultNames={'_timeEst':'timeEst','_control':'timeControlEst','_timeGroupsEst':'timeGroupsEst',
+               '_timeReplicatesEst':'timeReplicatesEst','_testHom':'timeTestHom','_dayEst':'dayEst'}
+
+def _guessModel(name):
+    """Module of the model from the default name of a run."""
+    for suffix,model in _defaultNames.items():
+        if name.endswith(suffix):
+            return model
+    return None
@@ -0,0 +1,169 @@
+""" Simulation-based calibration (SBC) of the MCMC estimation of timeEst and dayEst.
+
+Parameters are drawn from the prior distributions in ./lib/priors, a dataset is
+simulated from each draw with the same design (doses, number of hosts, times of
+observation) as a template dataset, and each simulated dataset is fitted in a pool
+of worker processes. For a calibrated sampler configuration (niterations, burnin,
+thinF), the rank of the true value of each parameter among its posterior samples
+is uniformly distributed.
+
+Example:
+    import timeEst, sbc
+    data=timeEst.TimeData.fromCSV('./data/Wneg.csv','./data/Wpos.csv','wolb2012')
+    res=sbc.runSBC('timeEst',data,nsims=200,niterations=20000,burnin=10000,thinF=100)
+"""
+import os, sys, importlib, multiprocessing, numpy as np
+import dataFunctions as df
+
+def drawPrior(priors):
+    """Draws one value for each parameter from the prior distributions.
+
+Input:
+- priors (module): module from ./lib/priors (parents, such as meanU for meanI1,
+should be listed before their children in priors.parameters; deterministic
+parameters, such as p in priors_timeEstReparam, take the value of their parents).
+
+Returns a dictionnary with the value of each parameter.
+"""
+    values={}
+    for key in priors.parameters:
+        s=getattr(priors,key)
+        if hasattr(s,'random'):
+            s.random()
+        values[key]=float(s.value)
+    return values
+
+def simulate(data,params,dataName):
+    """Simulates a dataset with the same design as data (see df.TimeData.fromSimulation
+and df.DayData.fromSimulation)."""
+    if isinstance(data,df.TimeData):
+        return df.TimeData.fromSimulation(params,data.doses,data.nhosts1,data.nhosts2,data.times,dataName)
+    else:
+        return df.DayData.fromSimulation(params,data.doses,data.nhosts1,data.nhosts2,dataName)
+
+def _fit(args):
+    """Fits one simulated dataset and returns the rank of the true values among the
+posterior samples. Runs in a worker process."""
+    (modelName,si,params,data,priorsFile,niterations,burnin,thinF,seed,savePath)=args
+    import pymc as py
+    # A worker runs several fits: the priors modules, which hold the stochastics of
+    # the model, are imported again so that a fit does not share them with the model
+    # (and the likelihood of the simulated data) of a previous fit
+    for name in [n for n in sys.modules if n.startswith('lib.priors.')]:
+        del sys.modules[name]
+    np.random.seed(seed)
+    model=importlib.import_module(modelName)
+    mod=model.Model.setup(data,resultsName='sbc%05i'%si,savePath=savePath,bOverWrite=True,priorsFile=priorsFile,bRandomIni=True)
+    # Traces are kept in memory, only the ranks are needed
+    M=py.MCMC(mod,db='ram')
+    M.sample(niterations,burnin,thinF,progress_bar=False)
+    ranks={}
+    for p in params:
+        trace=M.trace(p)[:]
+        ranks[p]=int((trace<params[p]).sum())
+    return si,ranks,len(trace)
+
+def runSBC(modelName,data,nsims=100,niterations=10000,burnin=5000,thinF=50,nbins=10,priorsFile=None,savePath=None,nprocs=None,seed=0,bPlot=True):
+    """Runs simulation-based calibration.
+
+Input:
+- modelName (str): name of the model module, 'timeEst' or 'dayEst'.
+- data (df.TimeData or df.DayData): template dataset, its doses, number of hosts and
+times of observation are used to simulate new datasets.
+- nsims (int): number of simulated datasets.
+- niterations, burnin, thinF (int): sampler configuration to check. The number of
+retained samples per fit is L=(niterations-burnin)/thinF.
+- nbins (int): number of bins of the rank histograms. Ranks take the L+1 integer
+values 0..L and rank r falls in bin r*nbins/(L+1) (integer division): bins hold the
+same number of rank values when L+1 is a multiple of nbins, otherwise the chi-square
+test uses the exact number of rank values of each bin.
+- priorsFile (str): name of prior file in ./lib/priors, defaults to the model's default.
+- savePath (str): folder where fits are saved, defaults to ./results/sbc_modelName.
+- nprocs (int): number of worker processes, defaults to the number of cpus.
+- seed (int): seed for the random draws, each fit uses seed+1+simulation index.
+- bPlot (bool): plot rank histograms (True, default).
+
+Returns a dictionnary with:
+- ranks (dict of int arr): rank of the true value for each parameter and simulation.
+- hist (dict of int arr): rank histograms for each parameter.
+- pvalues (dict): chi-square p-value of uniformity of the ranks for each parameter.
+- L (int): number of posterior samples per fit.
+"""
+    import scipy.stats as st
+    model=importlib.import_module(modelName)
+    if priorsFile==None:
+        priorsFile=model.Model.__defaultPrior__
+    if savePath==None:
+        savePath=os.path.join('.','results','sbc_'+modelName)
+    priors=importlib.import_module('lib.priors.'+priorsFile)
+
+    # Parameters and datasets are simulated in the main process so that results
+    # only depend on the seed
+    np.random.seed(seed)
+    jobs=[]
+    truths=[]
+    for si in xrange(nsims):
+        params=drawPrior(priors)
+        truths.append(params)
+        sim=simulate(data,params,'%s_sbc%05i'%(data.dataName,si))
+        jobs.append((modelName,si,params,sim,priorsFile,niterations,burnin,thinF,seed+1+si,savePath))
+
+    pool=multiprocessing.Pool(nprocs)
+    ranks=dict([(p,np.zeros(nsims,int)) for p in priors.parameters])
+    L=0
+    try:
+        for ji,(si,r,L) in enumerate(pool.imap_unordered(_fit,jobs)):
+            for p in r:
+                ranks[p][si]=r[p]
+            print "Finished fit %i of %i"%(ji+1,nsims)
+    finally:
+        pool.close()
+        pool.join()
+
+    # Probability of each bin under uniform ranks, from the number of rank values it holds
+    probs=np.bincount(np.arange(L+1)*nbins//(L+1),minlength=nbins)/float(L+1)
+    hist={}
+    pvalues={}
+    for p in priors.parameters:
+        hist[p]=np.bincount(ranks[p]*nbins//(L+1),minlength=nbins)
+        pvalues[p]=st.chisquare(hist[p],probs*nsims)[1]
+
+    f=open(os.path.join(savePath,'sbc-ranks.csv'),'w')
+    f.write('\t'.join(['simulation']+priors.parameters)+'\n')
+    for si in xrange(nsims):
+        f.write('\t'.join(['%i'%si]+['%i'%ranks[p][si] for p in priors.parameters])+'\n')
+    f.close()
+    f=open(os.path.join(savePath,'sbc-histograms.csv'),'w')
+    f.write('\t'.join(['Parameter','p-value']+['bin%i'%bi for bi in range(nbins)])+'\n')
+    for p in priors.parameters:
+        f.write('\t'.join([p,'%.3f'%pvalues[p]]+['%i'%h for h in hist[p]])+'\n')
+    f.close()
+    print "Saved ranks and rank histograms in %s"%savePath
+
+    if bPlot:
+        plotRanks(hist,os.path.join(savePath,'sbc-histograms.png'),nsims,probs)
+    return {'ranks':ranks,'hist':hist,'pvalues':pvalues,'L':L,'truths':truths}
+
+def plotRanks(hist,filename,nsims,probs=None):
+    """Plots the rank histogram of each parameter, with the 99% band expected for
+uniform ranks. probs (float arr) gives the probability of each bin under uniform
+ranks, defaults to equal probabilities."""
+    import pylab as pl, scipy.stats as st
+    names=sorted(hist.keys())
+    ncols=4
+    nrows=int(np.ceil(len(names)/float(ncols)))
+    f=pl.figure(figsize=(2*ncols,1.6*nrows))
+    f.subplots_adjust(hspace=0.6,wspace=0.4)
+    for pi,p in enumerate(names):
+        nbins=len(hist[p])
+        ax=f.add_subplot(nrows,ncols,pi+1)
+        pb=np.ones(nbins)/nbins if probs is None else np.asarray(probs)
+        band=st.binom.ppf([[0.005],[0.5],[0.995]],nsims,pb)
+        ax.bar(np.arange(nbins),band[2]-band[0],bottom=band[0],width=1,color='0.5',lw=0,alpha=0.3)
+        ax.hlines(band[1],np.arange(nbins),np.arange(nbins)+1,color='0.5')
+        ax.bar(np.arange(nbins),hist[p],width=1,color='b',lw=0,alpha=0.7)
+        ax.set_title(p,fontsize=8)
+        ax.set_xticks([])
+    f.savefig(filename,bbox_inches='tight')
+    print "Plotted rank histograms, see "+filename
+    return f
@@ -0,0 +1,284 @@
+""" Tempered sequential Monte Carlo (SMC) estimation of the marginal likelihood (evidence).
+
+Particles are drawn from the prior and moved through a sequence of tempered
+posteriors prior*likelihood**beta, with beta going from 0 to 1. Each next beta is
+chosen so that the effective sample size of the incremental weights is a fixed
+fraction of the number of particles. The particles are then resampled and moved with
+random-walk Metropolis steps. The product of the average incremental weights
+estimates the marginal likelihood.
+
+The log-likelihood is evaluated for a whole batch of particles at once (a function
+of an array of particles, one per row), optionally split across worker processes.
+"""
+import multiprocessing, numpy as np
+try:
+    from scipy.special import logsumexp
+except ImportError:
+    from scipy.misc import logsumexp
+
+def _evaluate(args):
+    """Evaluates the log-likelihood of a batch of particles. Runs in a worker process."""
+    logLik,thetas,data=args
+    return logLik(thetas,data)
+
+class Evaluator(object):
+    """ Evaluates a log-likelihood over batches of particles, in nprocs worker processes.
+
+Input:
+- logLik (function): module level function logLik(thetas,data) returning the
+log-likelihood of each row of thetas (float arr, nparticles x nparameters).
+- data: extra argument of logLik (should be picklable if nprocs>1).
+- nprocs (int): number of worker processes. If 1 (default), evaluates in this process.
+"""
+    def __init__(self,logLik,data,nprocs=1):
+        self.logLik=logLik
+        self.data=data
+        self.nprocs=nprocs
+        self.pool=multiprocessing.Pool(nprocs) if nprocs>1 else None
+
+    def __call__(self,thetas):
+        if len(thetas)==0:
+            return np.zeros(0)
+        if self.pool==None:
+            return self.logLik(thetas,self.data)
+        chunks=np.array_split(thetas,self.nprocs)
+        res=self.pool.map(_evaluate,[(self.logLik,c,self.data) for c in chunks if len(c)])
+        return np.concatenate(res)
+
+    def close(self):
+        if self.pool!=None:
+            self.pool.close()
+            self.pool.join()
+
+def systematicResample(logw):
+    """Returns the indexes of particles resampled (systematic resampling) according
+to the log-weights logw."""
+    w=np.exp(logw-logw.max())
+    cw=np.cumsum(w/w.sum())
+    cw[-1]=1.
+    n=len(logw)
+    u=(np.random.uniform()+np.arange(n))/n
+    return np.searchsorted(cw,u)
+
+def _ess(logw):
+    w=np.exp(logw-logw.max())
+    return w.sum()**2/(w**2).sum()
+
+def _incrementalWeights(dbeta,ll):
+    with np.errstate(invalid='ignore'):
+        return np.where(np.isfinite(ll),dbeta*ll,-np.inf)
+
+def temperedSMC(evaluate,drawPrior,logPrior,nparticles=1000,essFraction=0.5,nmoves=5,maxMoves=50,bLog=True,verbose=True):
+    """Runs tempered SMC and estimates the log marginal likelihood.
+
+Input:
+- evaluate (function): returns the log-likelihood of each particle (row) of an array
+(see Evaluator). -inf is allowed (e.g. for constraints on the parameters).
+- drawPrior (function): drawPrior(n) returns n particles drawn from the prior (n x
+nparameters).
+- logPrior (function): returns the log prior density of each particle of an array,
+-inf outside of the support of the prior.
+- nparticles (int): number of particles.
+- essFraction (float): effective sample size, as a fraction of nparticles, targeted
+when choosing the next temperature.
+- nmoves (int): minimum number of Metropolis moves per temperature. More moves are
+made when the acceptance rate is low, so that each particle is likely to have moved
+(up to maxMoves).
+- bLog (bool or bool arr): move parameters on a log scale (True, default), or only the
+parameters (columns) for which bLog is True (e.g. from positiveSupport). Parameters
+moved on a log scale should be positive, a ValueError is raised if a particle drawn
+from the prior is not.
+- verbose (bool): print each temperature.
+
+Returns a dictionnary with:
+- logZ (float): estimated log marginal likelihood.
+- thetas (float arr): particles approximating the posterior.
+- logLiks (float arr): log-likelihood of each particle.
+- betas (list): sequence of temperatures.
+- acceptance (list): acceptance rate of the moves at each temperature.
+"""
+    thetas=np.asarray(drawPrior(nparticles),float)
+    ndim=thetas.shape[1]
+    logMask=np.zeros(ndim,bool)
+    logMask[:]=bLog
+    notPositive=np.nonzero(logMask&(thetas<=0).any(0))[0]
+    if len(notPositive):
+        raise ValueError("Parameters (columns) %s are moved on a log scale but some particles drawn from the prior are not positive, set bLog to False for them."%', '.join(['%i'%i for i in notPositive]))
+    lp=logPrior(thetas)
+    ll=evaluate(thetas)
+    beta=0.
+    logZ=0.
+    betas=[beta]
+    acceptance=[]
+    scale=2.38/ndim**0.5
+    target=essFraction*nparticles
+    def trans(x):
+        u=x.copy()
+        u[:,logMask]=np.log(x[:,logMask])
+        return u
+    def itrans(u):
+        x=u.copy()
+        x[:,logMask]=np.exp(u[:,logMask])
+        return x
+    while beta<1:
+        # Next temperature, by bisection on the effective sample size
+        if _ess(_incrementalWeights(1-beta,ll))>=target:
+            dbeta=1-beta
+        else:
+            lo,hi=0.,1-beta
+            for it in xrange(50):
+                mid=(lo+hi)/2.
+                if _ess(_incrementalWeights(mid,ll))>=target:
+                    lo=mid
+                else:
+                    hi=mid
+            dbeta=max(lo,1e-12)
+        logw=_incrementalWeights(dbeta,ll)
+        logZ+=logsumexp(logw)-np.log(nparticles)
+        beta=min(beta+dbeta,1.)
+        betas.append(beta)
+
+        idx=systematicResample(logw)
+        thetas,lp,ll=thetas[idx],lp[idx],ll[idx]
+
+        # Random-walk Metropolis moves, proposals scaled to the particles covariance
+        u=trans(thetas)
+        cov=np.atleast_2d(np.cov(u.T))
+        L=np.linalg.cholesky(cov+1e-10*np.diag(np.diag(cov))+1e-300*np.eye(ndim))
+        naccepted=0
+        mi=0
+        nrequired=nmoves
+        while mi<nrequired:
+            uprop=u+scale*np.dot(np.random.normal(size=u.shape),L.T)
+            prop=itrans(uprop)
+            lpp=logPrior(prop)
+            llp=np.empty(nparticles)
+            llp.fill(-np.inf)
+            ok=np.isfinite(lpp)
+            llp[ok]=evaluate(prop[ok])
+            with np.errstate(invalid='ignore'):
+                logr=beta*(llp-ll)+lpp-lp
+                # Jacobian of the log transformation
+                logr+=(uprop-u)[:,logMask].sum(1)
+            accept=np.log(np.random.uniform(size=nparticles))<np.where(np.isfinite(llp),logr,-np.inf)
+            u[accept]=uprop[accept]
+            thetas[accept]=prop[accept]
+            lp[accept]=lpp[accept]
+            ll[accept]=llp[accept]
+            naccepted+=accept.sum()
+            mi+=1
+            if mi==nmoves:
+                # Number of moves so that each particle has moved with probability 0.99
+                rate=naccepted/float(mi*nparticles)
+                if 0<rate<1:
+                    nrequired=int(min(maxMoves,max(nmoves,np.ceil(np.log(0.01)/np.log(1-rate)))))
+                elif rate==0:
+                    nrequired=maxMoves
+        rate=naccepted/float(mi*nparticles)
+        acceptance.append(rate)
+        # Keep the acceptance rate of the moves reasonable
+        scale*=np.exp(rate-0.25)
+        if verbose:
+            print "beta=%.4g, log evidence so far=%.3f, acceptance=%.2f (%i moves)"%(beta,logZ,rate,mi)
+
+    return {'logZ':logZ,'thetas':thetas,'logLiks':ll,'betas':betas,'acceptance':acceptance}
+
+def priorFunctions(priors,names):
+    """Returns the functions drawing from, and evaluating the log-density of, the prior
+distributions defined as PyMC stochastics in a module from ./lib/priors.
+
+Input:
+- priors (module): priors module.
+- names (list of str): names of the parameters, parents (e.g. meanU for meanI1)
+should be listed before their children.
+
+Returns (drawPrior, logPrior), see temperedSMC. The values of the stochastics are
+restored after each call. The log-density is evaluated for all particles at once if 
+all the priors are distributions with fixed parents (see _vectorizedLogp), else one 
+particle at a time by PyMC.
+"""
+    import pymc as py
+    stochs=[getattr(priors,n) for n in names]
+    vectorized=[_vectorizedLogp(s) for s in stochs]
+
+    def drawPrior(n):
+        saved=[s.value for s in stochs]
+        res=np.zeros((n,len(stochs)))
+        for i in xrange(n):
+            for si,s in enumerate(stochs):
+                s.random()
+                res[i,si]=s.value
+        for s,v in zip(stochs,saved):
+            s.value=v
+        return res
+
+    def logPrior(thetas):
+        if all(vectorized):
+            thetas=np.asarray(thetas,float)
+            return sum([logp(thetas[:,si]) for si,logp in enumerate(vectorized)])
+        saved=[s.value for s in stochs]
+        res=np.zeros(len(thetas))
+        for i in xrange(len(thetas)):
+            for si,s in enumerate(stochs):
+                s.value=thetas[i,si]
+            try:
+                res[i]=sum([s.logp for s in stochs])
+            except py.ZeroProbability:
+                res[i]=-np.inf
+        for s,v in zip(stochs,saved):
+            s.value=v
+        return res
+
+    return drawPrior,logPrior
+
+def positiveSupport(priors,names):
+    """Returns which parameters have prior distributions with positive support
+(Lognormal, and Uniform or TruncatedNormal with a fixed lower bound of at least 0), 
+as a bool arr that can be passed as bLog to temperedSMC.
+
+Input:
+- priors (module): priors module from ./lib/priors.
+- names (list of str): names of the parameters.
+"""
+    import pymc as py
+    res=np.zeros(len(names),bool)
+    for ni,n in enumerate(names):
+        s=getattr(priors,n)
+        dist=s.__class__.__name__
+        lower={'Uniform':'lower','TruncatedNormal':'a'}.get(dist)
+        if dist=='Lognormal':
+            res[ni]=True
+        elif lower!=None:
+            v=s.parents.get(lower)
+            res[ni]=(v is not None) and not isinstance(v,py.Node) and float(v)>=0
+    return res
+
+def _vectorizedLogp(s):
+    """Returns a function evaluating the log-density of stochastic s for an array of
+values, for the distributions of ./lib/priors (Uniform, Normal, TruncatedNormal, 
+Lognormal) with fixed parents, None otherwise."""
+    import pymc as py
+    p=s.parents
+    if any([isinstance(v,py.Node) for v in p.values()]):
+        return None
+    dist=s.__class__.__name__
+    if dist=='Uniform':
+        lower,upper=float(p['lower']),float(p['upper'])
+        return lambda x: np.where((x>=lower)&(x<=upper),-np.log(upper-lower),-np.inf)
+    if dist in ('Normal','TruncatedNormal','Lognormal'):
+        mu,tau=float(p['mu']),float(p['tau'])
+        c=0.5*np.log(0.5*tau/np.pi)
+        if dist=='Normal':
+            return lambda x: c-0.5*tau*(x-mu)**2
+        if dist=='Lognormal':
+            def logp(x):
+                with np.errstate(divide='ignore',invalid='ignore'):
+                    lx=np.log(x)
+                    return np.where(x>0,c-lx-0.5*tau*(lx-mu)**2,-np.inf)
+            return logp
+        from scipy.stats import norm
+        a=-np.inf if p.get('a') is None else float(p['a'])
+        b=np.inf if p.get('b') is None else float(p['b'])
+        logZ=np.log(norm.cdf((b-mu)*tau**0.5)-norm.cdf((a-mu)*tau**0.5))
+        return lambda x: np.where((x>=a)&(x<=b),c-0.5*tau*(x-mu)**2-logZ,-np.inf)
+    return None
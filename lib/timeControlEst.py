@@ -8,11 +8,12 @@ Parameters estimated:
 
 # Import libraries
 from copy import deepcopy
-import pickle, pymc as py, numpy as np, scipy as sc, scipy.special as sp, scipy.stats as st, pylab as pl, sys, os, importlib, shutil
-from matplotlib import rcParams
+import pickle, numpy as np, scipy as sc, scipy.special as sp, sys, os, importlib, shutil
 import dataFunctions as df
 import modelFunctions as mf
 import utils as ut
+# Slow to import, loaded when first used (see utils.lazyImport)
+py,st,pl,mpl=ut.py,ut.st,ut.pl,ut.mpl
 
 class Model(mf.TimeModels):
     """ Estimation of mortality parameters from control survival over time. 
@@ -29,8 +30,12 @@ Possible plots:
 """
     __defaultPrior__='priors_timeControlEst'
     __defaultName__='_control'
+    # Figures rendered after the posterior calculations (see render)
+    __figures__=['plotSurvival']
+    # Parameters evaluated on a log scale by gridPosterior
+    __gridLog__=('meanU','sU','k')
      
-    def __init__(self,data, priors, name, path,bRandomIni):
+    def __init__(self,data, priors, name, path,bRandomIni, bPointwise=False):
 #        """Returns a Model object, used to launch MCMC and process posterior distributions.
 #
 #        Input:
@@ -39,12 +44,13 @@ Possible plots:
 #        - name (str) - descriptor for the MCMC results
 #        - path (str) - path to folder where results should be saved
 #        """
-        #Reduce data to control data only
+        #Reduce data to control data only (in a copy, which shares the arrays of data)
+        data=data.copy()
         data.reduce(data.doses==0)
         
         # The following are the variables needed for plots
         self.vals=('ts','cdf1_ci','cdf2_ci')
-        super(Model,self).__init__(data,priors,name,path,bRandomIni)
+        super(Model,self).__init__(data,priors,name,path,bRandomIni,bPointwise)
     
     def __lik_setup__(self):
         m=self
@@ -54,37 +60,29 @@ Possible plots:
         iTd2=m.iTd2
         zeroprob=0
         try:
-            # Calculate the probabilities of deaths at each of the changing times
-            m.probdU=py.Lambda('probdU',lambda s=m.sU, tau=m.tauU, k=m.k,t1=d.times[chgT-1],t2=d.times[chgT]: ut.kpdfInt(t1,t2,s,tau,k), trace=False)
+            # Calculate the log-probabilities of deaths at each of the changing times
+            m.logprobdU=py.Lambda('logprobdU',lambda s=m.sU, tau=m.tauU, k=m.k,t1=d.times[chgT-1],t2=d.times[chgT]: ut.kernels.get(ut.logKpdfInt,(t1,t2),s,tau,k), trace=False)
             
-            # Calculate the probabilities of survival at each of the changing times
-            m.probsU=py.Lambda('probsU',lambda s=m.sU, tau=m.tauU, k=m.k: 1-(ut.kpdfInt(0,d.tmax,s,tau,k)), trace=False)
+            # Calculate the log-probabilities of survival up to tmax
+            m.logprobsU=py.Lambda('logprobsU',lambda s=m.sU, tau=m.tauU, k=m.k: ut.kernels.get(ut.logKsf,(d.tmax,),s,tau,k), trace=False)
             
-            def likelihood_deaths(value,probdU):
-                res=probdU[value]
-                inf0=res<0
-                if any(inf0): 
-                    res[res<0]=0
-                return np.log(res).sum()
+            def likelihood_deaths(value,logprobdU):
+                return logprobdU[value].sum()
             
-            def likelihood_survivors(value,probsU):
-                res=(probsU)**value
-                inf0=res<0
-                if inf0: 
-                    res=0
-                return np.log(res)
+            def likelihood_survivors(value,logprobsU):
+                return np.sum(value*logprobsU)
             
             # Calculate the likelihoods
             m.liks=[]
-            m.LD1=py.Stochastic(logp=likelihood_deaths,doc='',name='LD1',parents={'probdU':m.probdU}, trace=False, observed=True, dtype=int, value=iTd1)
+            m.LD1=py.Stochastic(logp=likelihood_deaths,doc='',name='LD1',parents={'logprobdU':m.logprobdU}, trace=False, observed=True, dtype=int, value=iTd1)
             m.liks+=['LD1']
-            m.LD2=py.Stochastic(logp=likelihood_deaths,doc='',name='LD2',parents={'probdU':m.probdU}, trace=False, observed=True, dtype=int, value=iTd2)
+            m.LD2=py.Stochastic(logp=likelihood_deaths,doc='',name='LD2',parents={'logprobdU':m.logprobdU}, trace=False, observed=True, dtype=int, value=iTd2)
             m.liks+=['LD2']
             if bool(d.survivors1)>0:
-                m.LS1=py.Stochastic(logp=likelihood_survivors,doc='',name='LS1',parents={'probsU':m.probsU}, trace=False, observed=True, dtype=int, value=d.survivors1)
+                m.LS1=py.Stochastic(logp=likelihood_survivors,doc='',name='LS1',parents={'logprobsU':m.logprobsU}, trace=False, observed=True, dtype=int, value=d.survivors1)
                 m.liks+=['LS1']
             if bool(d.survivors2)>0:
-                m.LS2=py.Stochastic(logp=likelihood_survivors,doc='',name='LS2',parents={'probsU':m.probsU}, trace=False, observed=True, dtype=int, value=d.survivors2)
+                m.LS2=py.Stochastic(logp=likelihood_survivors,doc='',name='LS2',parents={'logprobsU':m.logprobsU}, trace=False, observed=True, dtype=int, value=d.survivors2)
                 m.liks+=['LS2']
         
             sum([getattr(m,l).logp for l in m.liks])
@@ -104,21 +102,14 @@ Possible plots:
         d=self.d
         
         ts=np.arange(0,d.times[-1]+1)
-        cdf1_ci=np.zeros([3,len(ts)]) # Interval for the probability of death per dose at each day
-        cdf2_ci=np.zeros([3,len(ts)])
-        
-        kprobcdf=np.zeros((len(ts),len(sUs)))
-        kprobcdf[0,:]=0.   
-        for ti in range(1,len(ts)):
-            kprobcdf[ti,:]=kprobcdf[ti-1,:]+ut.kpdfInt(ts[ti-1],ts[ti],sUs,tauUs,ks)
-        
-        for ti in range(len(ts)):
-            md_negi=1-kprobcdf[ti,:]
-            md_posi=1-kprobcdf[ti,:]
-            cdf1_ci[:,ti]=ut.confint(md_negi)
-            cdf2_ci[:,ti]=ut.confint(md_posi)
-            progBar.iter(1./len(ts))
+        # Probability of survival up to each day (samples x days), from the cdf of the
+        # time to death at all days at once
+        survival=1-ut.kernels.columns(ut.kpdfInt,(0,ts),sUs,tauUs,ks)
+        progBar.iter(0.5)
         
+        # Interval for the probability of survival at each day, the same for both groups
+        cdf1_ci=ut.confint(survival,self.weights)
+        cdf2_ci=cdf1_ci.copy()
         progBar.finish()
         
         res={'burnin':self.burnin,'thinF':self.thinF}
@@ -127,15 +118,14 @@ Possible plots:
             res[v]=eval(v)
         for v in self.parameters:
             res[v+'s']=eval(v+'s')
-        pickle.dump(res,open(self.saveTo+'-postcalc.pickle','w'))
-        
-        self.__plot__()
+        self.savePostcalc(res)
     
     # Plot figures.
-    def __plot__(self):
+    def __plot__(self,bPlot=True,nprocs=1):
         print "Results will be saved in "+self.path
         self.write_vals()
-        self.plotSurvival()
+        if bPlot:
+            self.render(nprocs=nprocs)
         print "\nPosterior samples fitted to normal distributions (also saved in posteriors.py, can be used as priors for timeEst):"
         post=self.normalPosterior()
         print post
@@ -165,10 +155,10 @@ ax3 (Axes) - Axes that only has the legend
             cdf1_ci=m.cdf1_ci
             cdf2_ci=m.cdf2_ci
             d=m.d.alldata
-            prevfsize=rcParams['font.size']
-            prevlsize=rcParams['axes.labelsize']
-            rcParams.update({'font.size': 10})
-            rcParams['axes.labelsize']='large'
+            prevfsize=mpl.rcParams['font.size']
+            prevlsize=mpl.rcParams['axes.labelsize']
+            mpl.rcParams.update({'font.size': 10})
+            mpl.rcParams['axes.labelsize']='large'
             f=pl.figure(figsize=(6,1.875))
             f.subplots_adjust(wspace=0.75,left=0.05, right=1.1)
             ax1=pl.subplot2grid((1,5),(0,0),colspan=2)
@@ -220,16 +210,39 @@ ax3 (Axes) - Axes that only has the legend
                 ax.get_yaxis().tick_left()
                 l=ax.text(139,1.05,s=grouplabels[axi],ha='right',va='top',fontsize=12)
             f.savefig(m.saveTo+'-posteriorSurvival.'+m.figFormat, bbox_inches='tight',dpi=600)
-            rcParams.update({'font.size': prevfsize})
-            rcParams['axes.labelsize']=prevlsize    
+            mpl.rcParams.update({'font.size': prevfsize})
+            mpl.rcParams['axes.labelsize']=prevlsize    
             print "Plotted posterior survival, see "+m.name+'-posteriorSurvival.'+m.figFormat
             return f,ax1,ax2,ax3
     
     def normalPosterior(self):
+        def meanStd(x):
+            mean=np.average(x,weights=self.weights)
+            return mean,np.average((x-mean)**2,weights=self.weights)**0.5
         return """k=py.Normal('k',mu=%e,tau=1/(%e)**2)
 meanU=py.Normal('meanU',mu=%e,tau=1/(%e)**2)
 sU=py.Normal('sU',mu=%e,tau=1/(%e)**2)
-"""%(np.mean(self.ks),np.std(self.ks),np.mean(self.meanUs),np.std(self.meanUs),np.mean(self.sUs),np.std(self.sUs))
-        
+"""%(meanStd(self.ks)+meanStd(self.meanUs)+meanStd(self.sUs))
+    
+    def logLikData(self):
+        """ Data of the vectorized likelihood (see logLik and gridPosterior). """
+        d=self.d
+        deaths=np.hstack(list(self.iTd1)+list(self.iTd2)).astype(int)
+        return {'t1':d.times[self.chgT-1],'t2':d.times[self.chgT],'tmax':d.tmax,
+                'deaths':np.bincount(deaths,minlength=len(self.chgT)),
+                'survivors':np.sum(d.survivors1)+np.sum(d.survivors2)}
+
+def logLik(thetas,data):
+    """Log-likelihood of the times to death and survival of both groups (the likelihoods
+LD1, LD2, LS1 and LS2 of the model) for each row of thetas (meanU, sU, k), see 
+Model.gridPosterior."""
+    meanU,sU,k=[v[:,None] for v in np.asarray(thetas,float).T]
+    j=data['deaths']>0
+    with np.errstate(all='ignore'):
+        res=(ut.logKpdfInt(data['t1'][j],data['t2'][j],sU,meanU/sU,k)*data['deaths'][j]).sum(1)
+        if data['survivors']>0:
+            res+=data['survivors']*ut.logKsf(data['tmax'],sU,meanU/sU,k)[:,0]
+    res[np.isnan(res)]=-np.inf
+    return res
 
 TimeData=df.TimeData
@@ -21,10 +21,12 @@ Assumptions:
 
 # Import libraries
 from copy import deepcopy
-import pickle, pymc as py, numpy as np, scipy as sc, scipy.special as sp, scipy.stats as st, pylab as pl, sys, os, importlib, shutil
+import pickle, numpy as np, scipy as sc, scipy.special as sp, sys, os, importlib, shutil
 import dataFunctions as df
 import modelFunctions as mf
 import utils as ut
+# Slow to import, loaded when first used (see utils.lazyImport)
+py,st,pl=ut.py,ut.st,ut.pl
 
 class Model(mf.TimeModels,mf.DoseResponseModels):
     """ Estimation of infection and mortality parameters from survival over time. 
@@ -58,15 +60,17 @@ Possible plots (only after MCMC has been run):
 """
     __defaultPrior__='priors_timeEst'
     __defaultName__='_timeEst'
+    # Figures rendered after the posterior calculations (see render)
+    __figures__=['plotSurvival','plotPosterior']
     #~~~~~~~~~~~~~~~~~~~~~~~~~#
     #~~ Setting up the MCMC ~~#
     #~~~~~~~~~~~~~~~~~~~~~~~~~#
     @ut.doc_inherit
-    def __init__(self,data, priors, name, path, bRandomIni):
+    def __init__(self,data, priors, name, path, bRandomIni, bPointwise=False):
         m=self
         # The following are the variables needed for plots
         m.vals=('ts','cdf1_ci','cdf2_ci','x2','pi1_ci','pi2_ci','pdfU','cdfU','pdfI1','pdfI2')
-        super(Model,self).__init__(data,priors,name,path,bRandomIni)
+        super(Model,self).__init__(data,priors,name,path,bRandomIni,bPointwise)
         
     @ut.doc_inherit
     def likelihood_setup(self,bRandomIni):
@@ -100,55 +104,55 @@ Possible plots (only after MCMC has been run):
             
             #~~ Likelihood ~~
             
-            # Calculate the probabilities of deaths at each of the changing times
-            m.probdU=py.Lambda('probdU',lambda s=m.sU, tau=m.tauU, k=m.k,t1=d.times[chgT-1],t2=d.times[chgT]: ut.kpdfInt(t1,t2,s,tau,k), trace=False)
-            m.probdI1=py.Lambda('probdI1',lambda s=m.sI1, tau=m.tauI1, k=m.k,t1=d.times[chgT-1],t2=d.times[chgT]: ut.kpdfInt(t1,t2,s,tau,k), trace=False)
-            m.probdI2=py.Lambda('probdI2',lambda s=m.sI2, tau=m.tauI2, k=m.k,t1=d.times[chgT-1],t2=d.times[chgT]: ut.kpdfInt(t1,t2,s,tau,k), trace=False)
+            # Calculate the log-probabilities of deaths at each of the changing times
+            m.logprobdU=py.Lambda('logprobdU',lambda s=m.sU, tau=m.tauU, k=m.k,t1=d.times[chgT-1],t2=d.times[chgT]: ut.kernels.get(ut.logKpdfInt,(t1,t2),s,tau,k), trace=False)
+            m.logprobdI1=py.Lambda('logprobdI1',lambda s=m.sI1, tau=m.tauI1, k=m.k,t1=d.times[chgT-1],t2=d.times[chgT]: ut.kernels.get(ut.logKpdfInt,(t1,t2),s,tau,k), trace=False)
+            m.logprobdI2=py.Lambda('logprobdI2',lambda s=m.sI2, tau=m.tauI2, k=m.k,t1=d.times[chgT-1],t2=d.times[chgT]: ut.kernels.get(ut.logKpdfInt,(t1,t2),s,tau,k), trace=False)
             
-            # Calculate the probabilities of survival at each of the changing times
-            m.probsU=py.Lambda('probsU',lambda s=m.sU, tau=m.tauU, k=m.k: 1-(ut.kpdfInt(0,d.tmax,s,tau,k)), trace=False)
-            m.probsI1=py.Lambda('probsI1',lambda s=m.sI1, tau=m.tauI1, k=m.k: 1-(ut.kpdfInt(0,d.tmax,s,tau,k)), trace=False)
-            m.probsI2=py.Lambda('probsI2',lambda s=m.sI2, tau=m.tauI2, k=m.k: 1-(ut.kpdfInt(0,d.tmax,s,tau,k)), trace=False)
+            # Calculate the log-probabilities of survival up to tmax
+            m.logprobsU=py.Lambda('logprobsU',lambda s=m.sU, tau=m.tauU, k=m.k: ut.kernels.get(ut.logKsf,(d.tmax,),s,tau,k), trace=False)
+            m.logprobsI1=py.Lambda('logprobsI1',lambda s=m.sI1, tau=m.tauI1, k=m.k: ut.kernels.get(ut.logKsf,(d.tmax,),s,tau,k), trace=False)
+            m.logprobsI2=py.Lambda('logprobsI2',lambda s=m.sI2, tau=m.tauI2, k=m.k: ut.kernels.get(ut.logKsf,(d.tmax,),s,tau,k), trace=False)
             
-            def likelihood_deaths(value,nf,I,probdI,probdU):
-                res=(I/nf)*probdI[value]+(1-(I/nf))*probdU[value]
-                inf0=res<0
-                if any(inf0): 
-                    res[res<0]=0
-                return np.log(res).sum()
+            def likelihood_deaths(value,nf,I,logprobdI,logprobdU):
+                return ut.logMixture(float(I)/nf,logprobdI[value],logprobdU[value]).sum()
             
-            def likelihood_survivors(value,nf,I,probsI,probsU):
-                res=((I/nf)*probsI+(1-(I/nf))*probsU)**value
-                inf0=res<0
-                if inf0: 
-                    res=0
-                return np.log(res)
+            def likelihood_survivors(value,nf,I,logprobsI,logprobsU):
+                return value*ut.logMixture(float(I)/nf,logprobsI,logprobsU)
             
             # Calculate the likelihoods
             m.liks=[]
             for i in range(0+sum(d.doses==0),len(d.doses)):
-                setattr(m,'LD1_d%i'%i,py.Stochastic(logp=likelihood_deaths,doc='',name='LD1_d%i'%i,parents={'nf':d.nhosts1[i], 'I':getattr(m,'Ig1d%i'%i), 'probdI':m.probdI1,'probdU':m.probdU}, trace=False, observed=True, dtype=int, value=iTd1[i]))
+                setattr(m,'LD1_d%i'%i,py.Stochastic(logp=likelihood_deaths,doc='',name='LD1_d%i'%i,parents={'nf':d.nhosts1[i], 'I':getattr(m,'Ig1d%i'%i), 'logprobdI':m.logprobdI1,'logprobdU':m.logprobdU}, trace=False, observed=True, dtype=int, value=iTd1[i]))
                 m.liks+=['LD1_d%i'%i]
                 
                 if d.survivors1[i]>0:
-                    setattr(m,'LS1_d%i'%i,py.Stochastic(logp=likelihood_survivors,doc='',name='LS1_d%i'%i,parents={'nf':d.nhosts1[i], 'I':getattr(m,'Ig1d%i'%i), 'probsI':m.probsI1,'probsU':m.probsU}, trace=False, observed=True, dtype=int, value=d.survivors1[i]))
+                    setattr(m,'LS1_d%i'%i,py.Stochastic(logp=likelihood_survivors,doc='',name='LS1_d%i'%i,parents={'nf':d.nhosts1[i], 'I':getattr(m,'Ig1d%i'%i), 'logprobsI':m.logprobsI1,'logprobsU':m.logprobsU}, trace=False, observed=True, dtype=int, value=d.survivors1[i]))
                     m.liks+=['LS1_d%i'%i]
                 
-                setattr(m,'LD2_d%i'%i,py.Stochastic(logp=likelihood_deaths,doc='',name='LD2_d%i'%i,parents={'nf':d.nhosts2[i], 'I':getattr(m,'Ig2d%i'%i), 'probdI':m.probdI2,'probdU':m.probdU}, trace=False, observed=True, dtype=int, value=iTd2[i]))
+                setattr(m,'LD2_d%i'%i,py.Stochastic(logp=likelihood_deaths,doc='',name='LD2_d%i'%i,parents={'nf':d.nhosts2[i], 'I':getattr(m,'Ig2d%i'%i), 'logprobdI':m.logprobdI2,'logprobdU':m.logprobdU}, trace=False, observed=True, dtype=int, value=iTd2[i]))
                 m.liks+=['LD2_d%i'%i]
                 
                 if d.survivors2[i]>0:
-                    setattr(m,'LS2_d%i'%i,py.Stochastic(logp=likelihood_survivors,doc='',name='LS2_d%i'%i,parents={'nf':d.nhosts2[i], 'I':getattr(m,'Ig2d%i'%i), 'probsI':m.probsI2,'probsU':m.probsU}, trace=False, observed=True, dtype=int, value=d.survivors2[i]))
+                    setattr(m,'LS2_d%i'%i,py.Stochastic(logp=likelihood_survivors,doc='',name='LS2_d%i'%i,parents={'nf':d.nhosts2[i], 'I':getattr(m,'Ig2d%i'%i), 'logprobsI':m.logprobsI2,'logprobsU':m.logprobsU}, trace=False, observed=True, dtype=int, value=d.survivors2[i]))
                     m.liks+=['LS2_d%i'%i]
             
+            # Log-likelihood of each observation, for model comparison (see looWaic)
+            if m.bPointwise:
+                m.pointwiseGroups={'all':[]}
+                for i in range(0+sum(d.doses==0),len(d.doses)):
+                    m.pointwise_setup('ll1_d%i'%i,d.nhosts1[i],getattr(m,'Ig1d%i'%i),m.logprobdI1,m.logprobdU,m.logprobsI1,m.logprobsU,iTd1[i],d.survivors1[i])
+                    m.pointwise_setup('ll2_d%i'%i,d.nhosts2[i],getattr(m,'Ig2d%i'%i),m.logprobdI2,m.logprobdU,m.logprobsI2,m.logprobsU,iTd2[i],d.survivors2[i])
+                    m.pointwiseGroups['all']+=['ll1_d%i'%i,'ll2_d%i'%i]
+            
             # Set likelihood to 0 if, for the first group, there is higher chance of infected surviving to the end of the study compared to non-infected.
             @py.potential
             def potIdeaths1(sI=m.sI1,tauI=m.tauI1, sU=m.sU,tauU=m.tauU): 
-                return 0.0 if st.gamma.cdf(max(d.times),sI,loc=0,scale=tauI)>=st.gamma.cdf(max(d.times),sU,loc=0,scale=tauU) else -np.Inf
+                return 0.0 if ut.kernels.get(ut.gcdf,(max(d.times),),sI,tauI)>=ut.kernels.get(ut.gcdf,(max(d.times),),sU,tauU) else -np.Inf
             
             @py.potential
             def potIdeaths2(sI=m.sI2,tauI=m.tauI2, sU=m.sU,tauU=m.tauU): 
-                return 0.0 if st.gamma.cdf(max(d.times),sI,loc=0,scale=tauI)>=st.gamma.cdf(max(d.times),sU,loc=0,scale=tauU) else -np.Inf        
+                return 0.0 if ut.kernels.get(ut.gcdf,(max(d.times),),sI,tauI)>=ut.kernels.get(ut.gcdf,(max(d.times),),sU,tauU) else -np.Inf        
             
             setattr(m,'potIdeaths1',potIdeaths1)
             setattr(m,'potIdeaths2',potIdeaths2)
@@ -181,35 +185,35 @@ Possible plots (only after MCMC has been run):
         cdf2_ci=np.zeros([3,d.ndoses,len(ts)])
         
         #PDFs
-        pdfI1=eval(ut.callArray('ut.kpdf(',['ts','sI1s','tauI1s','ks'],(len(ts),len(sUs))))
+        pdfI1=ut.kernels.columns(ut.kpdf,(ts,),sI1s,tauI1s,ks)
         progBar.iter(0.25)
         
-        pdfI2=eval(ut.callArray('ut.kpdf(',['ts','sI2s','tauI2s','ks'],(len(ts),len(sUs))))
+        pdfI2=ut.kernels.columns(ut.kpdf,(ts,),sI2s,tauI2s,ks)
         progBar.iter(0.25)        
         
         #CDFs
-        cdfU=eval(ut.callArray('ut.kpdfInt(0,',['ts','sUs','tauUs','ks'],(len(ts),len(sUs))))
+        cdfU=ut.kernels.columns(ut.kpdfInt,(0,ts),sUs,tauUs,ks)
         
-        cdfI1=eval(ut.callArray('ut.kpdfInt(0,',['ts','sI1s','tauI1s','ks'],(len(ts),len(sUs))))
+        cdfI1=ut.kernels.columns(ut.kpdfInt,(0,ts),sI1s,tauI1s,ks)
         progBar.iter(0.25)
         
-        cdfI2=eval(ut.callArray('ut.kpdfInt(0,',['ts','sI2s','tauI2s','ks'],(len(ts),len(sUs))))
+        cdfI2=ut.kernels.columns(ut.kpdfInt,(0,ts),sI2s,tauI2s,ks)
         progBar.iter(0.25)
         progBar.finish()
         
         progBar.start("Calculating mortalities")
         di=0
         
-        cdf1_ci[:,0,:]=ut.confint(1-cdfU)
-        cdf2_ci[:,0,:]=ut.confint(1-cdfU)
+        cdf1_ci[:,0,:]=ut.confint(1-cdfU,self.weights)
+        cdf2_ci[:,0,:]=ut.confint(1-cdfU,self.weights)
         progBar.iter(1./d.ndoses)
         
         for di in range(1,d.ndoses):
             pi1s=ut.pi_hom(d.doses[di],ps,epss)
             pi2s=ut.pi_het(d.doses[di],ps,a2s,b2s,epss)
             
-            cdf1_ci[:,di,:]=ut.confint(1-((np.array([pi1s.tolist()]*len(ts)).T)*cdfI1)-((1-np.array([pi1s.tolist()]*len(ts)).T)*cdfU))
-            cdf2_ci[:,di,:]=ut.confint(1-((np.array([pi2s.tolist()]*len(ts)).T)*cdfI2)-((1-np.array([pi2s.tolist()]*len(ts)).T)*cdfU))
+            cdf1_ci[:,di,:]=ut.confint(1-((np.array([pi1s.tolist()]*len(ts)).T)*cdfI1)-((1-np.array([pi1s.tolist()]*len(ts)).T)*cdfU),self.weights)
+            cdf2_ci[:,di,:]=ut.confint(1-((np.array([pi2s.tolist()]*len(ts)).T)*cdfI2)-((1-np.array([pi2s.tolist()]*len(ts)).T)*cdfU),self.weights)
             
             progBar.iter(1./d.ndoses)
             
@@ -222,16 +226,16 @@ Possible plots (only after MCMC has been run):
         pi2_ci=np.zeros([3,len(x2)])
         nx=0
         for i in range(len(x2)):
-            pi1_ci[:,i]=ut.confint(ut.pi_hom(x2[i],ps,epss))
-            pi2_ci[:,i]=ut.confint(ut.pi_het(x2[i],ps ,a2s,b2s,epss))
+            pi1_ci[:,i]=ut.confint(ut.pi_hom(x2[i],ps,epss),self.weights)
+            pi2_ci[:,i]=ut.confint(ut.pi_het(x2[i],ps ,a2s,b2s,epss),self.weights)
             progBar.iter(1./len(x2))
         
         progBar.finish()
         
-        pdfU=ut.confint(cdfU[:,1:]-cdfU[:,:-1]) # Calculate pdf from cdf to avoid nan from high sU, len= len(ts)-1
-        cdfU=ut.confint(cdfU)
-        pdfI1=ut.confint(pdfI1)
-        pdfI2=ut.confint(pdfI2)
+        pdfU=ut.confint(cdfU[:,1:]-cdfU[:,:-1],self.weights) # Calculate pdf from cdf to avoid nan from high sU, len= len(ts)-1
+        cdfU=ut.confint(cdfU,self.weights)
+        pdfI1=ut.confint(pdfI1,self.weights)
+        pdfI2=ut.confint(pdfI2,self.weights)
         
         res={'burnin':self.burnin,'thinF':self.thinF}
         for v in self.vals:
@@ -239,17 +243,13 @@ Possible plots (only after MCMC has been run):
             res[v]=eval(v)
         for v in self.parameters:
             res[v+'s']=eval(v+'s')
-        pickle.dump(res,open(self.saveTo+'-postcalc.pickle','w'))
-        
-        self.__plot__()
+        self.savePostcalc(res)
     
-    def __plot__(self):
+    def __plot__(self,bPlot=True,nprocs=1):
         print "Results saved in "+self.path
         self.write_vals()
-        self.plotSurvival()
-        #self.plotBeta()
-        #self.plotDoseResponse()
-        self.plotPosterior()
+        if bPlot:
+            self.render(nprocs=nprocs)
     
     def calcBestDays(m):
         """Square distance between observed daily mortality and estimated infected numbers. FIGURE 4 in the manuscript (26/01/2014)"""
@@ -312,6 +312,7 @@ Possible plots (only after MCMC has been run):
         print "Best day for first group: %i" %d.times[np.argmax(distneg[1,:])] 
         print "Best day for second group: %i" %d.times[np.argmax(distpos[1,:])] 
         
+        from mpl_toolkits.axes_grid1 import host_subplot
         f=pl.figure(figsize=(3.27,2.25))
         host1=host_subplot(111)
         f.subplots_adjust(hspace=0.3)
@@ -0,0 +1,331 @@
+""" Estimation of infection and mortality parameters from survival over time of any
+number of groups challenged with the same doses, compared to a reference group.
+
+Parameters estimated:
+(infection-related)
+- p: probability that a single virion will cause infection in a host of the reference group (group 1)
+- ag,bg: shape parameters for the distribution of susceptibility of group g (g>1) compared to the reference group
+- eps: probability of ineffective challenge
+(mortality-related)
+- meanIg: mean time to death of infected hosts of group g
+- sIg: shape parameter of the distribution of time to death of infected hosts of group g
+- meanU: mean time to death from old-age (i.e. from uninfected hosts), shared by all groups
+- sU: shape parameter of the distribution of time to death of old-age, shared by all groups
+- k: background probability of death, independent of infection or old-age, shared by all groups
+(extra)
+- IggdX: estimated number of infected hosts from group g when challenged with dose number X
+
+With two groups, the model is the same as timeEst. All groups are fitted together,
+with a single likelihood over groups x doses x days of observation, instead of one
+run per pair of groups (each estimating the shared mortality parameters again).
+
+Assumptions:
+- infected flies cannot outlive natural mortality (meanIg<meanU)
+- prior distributions for parameters governing natural mortality set from those estimated from control survival
+"""
+
+# Import libraries
+import numpy as np, scipy.special as sp
+import dataFunctions as df
+import modelFunctions as mf
+import utils as ut
+# Slow to import, loaded when first used (see utils.lazyImport)
+py,st,pl,mpl=ut.py,ut.st,ut.pl,ut.mpl
+
+class Model(mf.Models):
+    """ Estimation of infection and mortality parameters from survival over time of
+several groups compared to a reference group.
+
+Initialize from scratch with Model.setup() (with a GroupsTimeData object), and from
+saved model with Model.savedModel().
+
+Parameters estimated:
+(infection-related)
+- p: probability that a single virion will cause infection in a host of the reference group (group 1)
+- ag,bg: shape parameters for the distribution of susceptibility of group g (g>1) compared to the reference group
+- eps: probability of ineffective challenge
+(mortality-related)
+- meanIg, sIg: mean and shape parameter of the time to death of infected hosts of group g
+- meanU, sU: mean and shape parameter of the time to death of old-age, shared by all groups
+- k: background probability of death, independent of infection or old-age, shared by all groups
+(extra)
+- IggdX: estimated number of infected hosts from group g when challenged with dose number X
+
+The priors of the parameters of groups 2, 3... are given by the function
+groupParameters(g) of the priors file (see priors_timeGroupsEst).
+
+Possible plots (only after MCMC has been run):
+- plotSurvival
+- plotPosterior
+"""
+    __defaultPrior__='priors_timeGroupsEst'
+    __defaultName__='_timeGroupsEst'
+    # Figures rendered after the posterior calculations (see render)
+    __figures__=['plotSurvival','plotPosterior']
+    colors=['k','b','r','g','m','c','y']
+    #~~~~~~~~~~~~~~~~~~~~~~~~~#
+    #~~ Setting up the MCMC ~~#
+    #~~~~~~~~~~~~~~~~~~~~~~~~~#
+    @ut.doc_inherit
+    def __init__(self,data, priors, name, path, bRandomIni, bPointwise=False):
+        m=self
+        # The following are the variables needed for plots
+        m.vals=('ts','cdf_ci','x2','pi_ci','pdfU','cdfU','pdfI')
+        self.d=data.copy()
+        d=self.d
+        # Stacked observations (groups x challenged doses x intervals), only for the
+        # intervals between days of observation in which at least one host died
+        m.idoses=np.arange(sum(d.doses==0),d.ndoses)
+        counts=d.deathCounts()[:,m.idoses,:]
+        m.iT=np.nonzero(counts.sum((0,1)))[0]
+        m.counts=counts[:,:,m.iT]
+        m.survivors=np.asarray(d.survivors)[:,m.idoses]
+        m.nhosts=np.asarray(d.nhosts,float)[:,m.idoses]
+        super(Model,self).__init__(data,priors,name,path,bRandomIni,bPointwise)
+
+    @ut.doc_inherit
+    def likelihood_setup(self,bRandomIni):
+        """ Sets up likelihoods. If bRandomIni, will reset all variables to random values."""
+        #~~ Saving variable names ~~
+        m=self
+        d=self.d
+        # Only once (likelihood_setup is called again by resetParameters)
+        if len(m.parameters)==len(m.priors.parameters):
+            for g in range(2,d.ngroups+1):
+                for par in m.priors.groupParameters(g):
+                    setattr(m,par.__name__,par)
+                    m.parameters.append(par.__name__)
+            m.parameters.extend(['Ig%id%i'%(g,i) for g in range(1,d.ngroups+1) for i in m.idoses])
+        super(Model,self).likelihood_setup(bRandomIni)
+
+    def __lik_setup__(self):
+        m=self
+        d=m.d
+        groups=range(1,d.ngroups+1)
+        zeroprob=0
+        try:
+            #~~ Other stochastic variables needed to calculate the likelihood ~~
+            for di in m.idoses:
+                setattr(m,'pi1d%i'%di, py.Lambda('pi1d%i'%di,lambda p=m.p,eps=m.eps,idose=di: ut.pi_hom(d.doses[idose],p,eps)))
+                for g in groups[1:]:
+                    setattr(m,'pi%id%i'%(g,di), py.Lambda('pi%id%i'%(g,di),lambda p=m.p,a=getattr(m,'a%i'%g),b=getattr(m,'b%i'%g),eps=m.eps,idose=di: ut.pi_het(d.doses[idose],p,a,b,eps)))
+                for g in groups:
+                    setattr(m,'Ig%id%i'%(g,di),py.Binomial('Ig%id%i'%(g,di),n=d.nhosts[g-1][di],p=getattr(m,'pi%id%i'%(g,di))))
+            m.Ig=[[getattr(m,'Ig%id%i'%(g,di)) for di in m.idoses] for g in groups]
+
+            m.tauU=py.Lambda('tauU',lambda mean=m.meanU, s=m.sU: mean/s)
+            m.sI=[getattr(m,'sI%i'%g) for g in groups]
+            m.tauI=py.Lambda('tauI',lambda mean=[getattr(m,'meanI%i'%g) for g in groups], s=m.sI: np.array(mean,float)/np.array(s,float))
+
+            #~~ Likelihood ~~
+
+            # Calculate the log-probabilities of deaths in each of the intervals (groups x intervals for infected)
+            t1=d.times[m.iT-1]
+            t2=d.times[m.iT]
+            m.logprobdU=py.Lambda('logprobdU',lambda s=m.sU, tau=m.tauU, k=m.k: ut.logKpdfInt(t1,t2,s,tau,k), trace=False)
+            m.logprobdI=py.Lambda('logprobdI',lambda s=m.sI, tau=m.tauI, k=m.k: ut.logKpdfInt(t1[None,:],t2[None,:],np.array(s,float)[:,None],tau[:,None],k), trace=False)
+
+            # Calculate the log-probabilities of survival up to tmax
+            m.logprobsU=py.Lambda('logprobsU',lambda s=m.sU, tau=m.tauU, k=m.k: ut.logKsf(d.tmax,s,tau,k), trace=False)
+            m.logprobsI=py.Lambda('logprobsI',lambda s=m.sI, tau=m.tauI, k=m.k: ut.logKsf(d.tmax,np.array(s,float),tau,k), trace=False)
+
+            deaths=m.counts>0
+            survived=m.survivors>0
+            def likelihood(value,nf,I,logprobdI,logprobdU,logprobsI,logprobsU,survivors):
+                f=np.array(I,float)/nf
+                res=ut.logMixture(f[:,:,None],logprobdI[:,None,:],logprobdU[None,None,:])[deaths]
+                ress=ut.logMixture(f,logprobsI[:,None],logprobsU)[survived]
+                return (value[deaths]*res).sum()+(survivors[survived]*ress).sum()
+
+            # A single likelihood for all groups, doses and intervals
+            m.L=py.Stochastic(logp=likelihood,doc='',name='L',parents={'nf':m.nhosts, 'I':m.Ig, 'logprobdI':m.logprobdI,'logprobdU':m.logprobdU,'logprobsI':m.logprobsI,'logprobsU':m.logprobsU,'survivors':m.survivors}, trace=False, observed=True, dtype=int, value=m.counts)
+            m.liks=['L']
+
+            # Log-likelihood of each observation, for model comparison (see looWaic)
+            if m.bPointwise:
+                m.pointwiseGroups={'all':[]}
+                for gi,g in enumerate(groups):
+                    logprobdIg=py.Lambda('logprobdI%i'%g,lambda logprobdI=m.logprobdI,gi=gi: logprobdI[gi], trace=False)
+                    logprobsIg=py.Lambda('logprobsI%i'%g,lambda logprobsI=m.logprobsI,gi=gi: logprobsI[gi], trace=False)
+                    for i,di in enumerate(m.idoses):
+                        iTd=np.repeat(np.arange(len(m.iT)),m.counts[gi,i])
+                        m.pointwise_setup('ll%i_d%i'%(g,di),d.nhosts[gi][di],m.Ig[gi][i],logprobdIg,m.logprobdU,logprobsIg,m.logprobsU,iTd,m.survivors[gi,i])
+                        m.pointwiseGroups['all']+=['ll%i_d%i'%(g,di)]
+
+            # Set likelihood to 0 if, for any group, there is higher chance of infected surviving to the end of the study compared to non-infected.
+            @py.potential
+            def potIdeaths(sI=m.sI,tauI=m.tauI, sU=m.sU,tauU=m.tauU):
+                return 0.0 if np.all(st.gamma.cdf(max(d.times),np.array(sI,float),loc=0,scale=tauI)>=st.gamma.cdf(max(d.times),sU,loc=0,scale=tauU)) else -np.Inf
+
+            setattr(m,'potIdeaths',potIdeaths)
+
+            m.L.logp+potIdeaths.logp
+
+        except py.ZeroProbability:
+            zeroprob=1
+        return zeroprob
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+    #~~ Calculating posterior predictive distributions ~~#
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+    def __calc__(self):
+        progBar=ut.ProgressBar("Preparing calculations of posterior probabilities")
+
+        m=self
+        d=self.d
+        groups=range(1,d.ngroups+1)
+        ps,epss,ks=m.ps,m.epss,m.ks
+        tauUs=m.meanUs/m.sUs
+        setattr(self,'tauUs',tauUs)
+        sIs=np.array([getattr(m,'sI%is'%g) for g in groups])
+        tauIs=np.array([getattr(m,'meanI%is'%g) for g in groups])/sIs
+        for gi,g in enumerate(groups):
+            setattr(self,'tauI%is'%g,tauIs[gi])
+
+        ts=np.arange(0,d.times[-1]+1,0.2)
+
+        # Samples x times, and groups x samples x times
+        cdfU=ut.kpdfInt(0,ts[None,:],m.sUs[:,None],tauUs[:,None],ks[:,None])
+        cdfI=ut.kpdfInt(0,ts[None,None,:],sIs[:,:,None],tauIs[:,:,None],ks[None,:,None])
+        progBar.iter(0.5)
+        pdfI=ks[None,:,None]*sp.gammaincc(sIs[:,:,None],ts/tauIs[:,:,None])+(1-ks[None,:,None]*ts)*st.gamma.pdf(ts,sIs[:,:,None],loc=0,scale=tauIs[:,:,None])
+        progBar.iter(0.5)
+        progBar.finish()
+
+        def pis(doses):
+            "Probabilities of infection of each group (groups x samples x doses)."
+            res=[ut.pi_hom(doses[None,:],ps[:,None],epss[:,None])]
+            for g in groups[1:]:
+                res.append(ut.pi_het(doses[None,:],ps[:,None],getattr(m,'a%is'%g)[:,None],getattr(m,'b%is'%g)[:,None],epss[:,None]))
+            return np.array(res)
+
+        progBar.start("Calculating mortalities")
+        cdf_ci=np.zeros([3,d.ngroups,d.ndoses,len(ts)]) # Interval for the probability of survival per group and dose at each day
+        pi=pis(d.doses)
+        for di in range(d.ndoses):
+            surv=1-pi[:,:,di,None]*cdfI-(1-pi[:,:,di,None])*cdfU[None,:,:]
+            cdf_ci[:,:,di,:]=ut.confint(surv.transpose(1,0,2),self.weights)
+            progBar.iter(1./d.ndoses)
+        progBar.finish()
+
+        progBar.start("Calculating probabilities of infection")
+        x2=10**np.arange(np.log10(d.doses[d.doses>0][0])-1,np.log10(d.doses[-1])+1,0.1)
+        pi_ci=ut.confint(pis(x2).transpose(1,0,2),self.weights)
+        progBar.iter(1.)
+        progBar.finish()
+
+        pdfU=ut.confint(cdfU[:,1:]-cdfU[:,:-1],self.weights) # Calculate pdf from cdf to avoid nan from high sU, len= len(ts)-1
+        cdfU=ut.confint(cdfU,self.weights)
+        pdfI=ut.confint(pdfI.transpose(1,0,2),self.weights)
+
+        res={'burnin':self.burnin,'thinF':self.thinF}
+        for v in self.vals:
+            setattr(self,v,eval(v))
+            res[v]=eval(v)
+        for v in self.parameters:
+            res[v+'s']=getattr(self,v+'s')
+        self.savePostcalc(res)
+
+    def __plot__(self,bPlot=True,nprocs=1):
+        print "Results saved in "+self.path
+        self.write_vals()
+        if bPlot:
+            self.render(nprocs=nprocs)
+
+    def plotSurvival(self, name=None, colors=None):
+        """Plots survival over time for each of the doses. One dose per panel,
+        including survival from all groups (one color per group, see Model.colors).
+
+        Returns:
+        - f (Figure)
+        - ax (Axes)"""
+        if colors==None:
+            colors=self.colors
+        m=self
+        d=m.d
+        ts=m.ts
+        cdf_ci=m.cdf_ci
+        mpl.rcParams.update({'font.size': 8})
+        mpl.rcParams['axes.labelsize'] = 'medium'
+
+        ncols=4
+        nrows=int(np.ceil(d.ndoses/float(ncols)))
+        f=pl.figure(figsize=(8,1.5*nrows))
+        for di,dose in enumerate(d.doses):
+            ax=f.add_subplot(nrows,ncols,di+1)
+            for gi in range(d.ngroups):
+                c=colors[gi%len(colors)]
+                surv=np.array([(d.timesDeath[gi][di]>t).sum()+d.survivors[gi][di] for t in d.times])/float(d.nhosts[gi][di])
+                l=ax.plot(d.times,surv,c+'o',mec=c,mew=1,ms=1,label=d.groupNames[gi])
+                l=ax.plot(ts,cdf_ci[1,gi,di,:],c+'-',lw=0.7)
+                l=ax.fill_between(ts,cdf_ci[0,gi,di,:],cdf_ci[2,gi,di,:],facecolor=c,lw=0,alpha=0.12)
+            l=ax.set_ylim([-0.03,1.05])
+            tt='control' if dose==0 else r'10$^{%i}$ TCID$_{50}$'%int(np.log10(dose))
+            l=ax.text(0.97,0.97,s=tt,ha='right',va='top',fontsize=8,transform=ax.transAxes)
+            if di%ncols==0:
+                l=ax.set_ylabel('survival')
+            if di>=d.ndoses-ncols:
+                l=ax.set_xlabel('days post challenge')
+            if di==0:
+                ax.legend(loc='lower left',fontsize=6,frameon=False)
+
+        if name==None:
+            name='-posteriorSurvival'
+        f.savefig(m.saveTo+name+'.'+m.figFormat, bbox_inches='tight',dpi=600)
+        print "Plotted survival, see "+m.name+name+"."+m.figFormat
+        return f,ax
+
+    def plotPosterior(self,name=None, colors=None, nsamples=2000):
+        """Plots the posterior intervals for the dose-response curve of each group
+        and the beta distributions of susceptibility of groups 2, 3... compared to
+        the reference group.
+
+        Input:
+        - nsamples (int) - number of posterior samples (evenly spaced) used for the
+        interval of the beta distributions, all if None.
+
+        Returns:
+        - f (Figure)
+        - ax1, ax2 (Axes) - axes from each of the panels"""
+        if colors==None:
+            colors=self.colors
+        m=self
+        d=m.d
+        x2=m.x2
+        pi_ci=m.pi_ci
+        f=pl.figure(figsize=(6,2.2))
+        f.subplots_adjust(wspace=0.35)
+        ax1=f.add_subplot(121)
+        ax1.set_xlabel(r'dose')
+        ax1.set_ylabel(r'infection probability, $\pi$')
+        for gi in range(d.ngroups):
+            c=colors[gi%len(colors)]
+            ax1.fill_between(x2,pi_ci[0,gi,:],pi_ci[2,gi,:],facecolor=c,lw=0,alpha=0.12)
+            ax1.plot(x2,pi_ci[1,gi,:],c+'-',label=d.groupNames[gi])
+        ax1.set_xscale('log')
+        ax1.set_xlim([0.15*(d.doses[d.doses>0][0]),0.85*(d.doses[-1]*10)])
+        ax1.set_ylim([-0.09,1.09])
+        ax1.legend(loc='upper left',fontsize=6,frameon=False)
+
+        ax2=f.add_subplot(122)
+        x=np.arange(0,1,0.005)
+        for g in range(2,d.ngroups+1):
+            c=colors[(g-1)%len(colors)]
+            a2s=getattr(m,'a%is'%g)
+            b2s=getattr(m,'b%is'%g)
+            sub=slice(None) if (nsamples==None or nsamples>=len(a2s)) else np.linspace(0,len(a2s)-1,nsamples).astype(int)
+            N=st.beta.pdf(x[None,:],a2s[sub][:,None],b2s[sub][:,None])
+            N=ut.wpercentile(N,[2.5,50,97.5],None if m.weights is None else m.weights[sub])
+            ax2.plot(x,N[1],c+'-',label=d.groupNames[g-1])
+            ax2.fill_between(x,N[0],N[2],facecolor=c, lw=0,alpha=0.2)
+        ax2.set_xlabel(r'susceptibility, $x$')
+        ax2.set_ylabel(r'$q(x)$')
+
+        if name==None:
+            name='-plotPosterior'
+        f.savefig(m.saveTo+name+'.'+m.figFormat, bbox_inches='tight',dpi=600)
+        print "Plotted dose-response curves and beta distributions, see "+ m.name+name+'.'+m.figFormat
+        return f,ax1,ax2
+
+
+GroupsTimeData=df.GroupsTimeData
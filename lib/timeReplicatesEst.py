@@ -0,0 +1,348 @@
+""" Joint estimation of infection and mortality parameters from replicate experiments of
+survival over time, with partial pooling of the parameters across replicates.
+
+Parameters estimated:
+- X_rR: parameter X of replicate R, for X in p, a2, b2 (infection), meanU, sU, k,
+meanI1, sI1, meanI2, sI2 (mortality), as in timeEst.
+- mu_X, sd_X: mean and standard deviation (on the log scale) of parameter X across
+replicates, X_rR following a Lognormal distribution. The population value of X is
+exp(mu_X).
+- eps: probability of ineffective challenge, shared by all replicates.
+(extra)
+- IggdX_rR: estimated number of infected hosts from group g (1 or 2) of replicate R
+when challenged with dose number X
+
+The likelihood of all replicates is evaluated at once, over the cells (replicate,
+group, dose, interval between days of observation in which hosts died), so that
+replicates can have different doses and days of observation.
+
+Assumptions:
+- infected flies cannot outlive natural mortality (meanI<meanU), in each replicate
+"""
+
+# Import libraries
+import numpy as np
+import dataFunctions as df
+import modelFunctions as mf
+import utils as ut
+# Slow to import, loaded when first used (see utils.lazyImport)
+py,st,pl,mpl=ut.py,ut.st,ut.pl,ut.mpl
+
+class Model(mf.Models):
+    """ Joint estimation of infection and mortality parameters from replicate
+experiments of survival over time, with partial pooling across replicates.
+
+Initialize from scratch with Model.setup() (with a ReplicatesTimeData object), and
+from saved model with Model.savedModel().
+
+Parameters estimated:
+- X_rR: parameter X of replicate R, for X in priors.pooled (p, a2, b2, meanU, sU, k,
+meanI1, sI1, meanI2, sI2, see timeEst).
+- mu_X, sd_X: mean and standard deviation of log(X) across replicates.
+- eps: probability of ineffective challenge, shared by all replicates.
+(extra)
+- IggdX_rR: estimated number of infected hosts from group g of replicate R when
+challenged with dose number X
+
+The priors of the parameters of each replicate are given by the function
+replicateParameters(r) of the priors file (see priors_timeReplicatesEst).
+
+Possible plots (only after MCMC has been run):
+- plotSurvival (one figure per replicate)
+- plotReplicates
+- plotPosterior
+"""
+    __defaultPrior__='priors_timeReplicatesEst'
+    __defaultName__='_timeReplicatesEst'
+    # Figures rendered after the posterior calculations (see render)
+    __figures__=['plotSurvival','plotReplicates','plotPosterior']
+    #~~~~~~~~~~~~~~~~~~~~~~~~~#
+    #~~ Setting up the MCMC ~~#
+    #~~~~~~~~~~~~~~~~~~~~~~~~~#
+    @ut.doc_inherit
+    def __init__(self,data, priors, name, path, bRandomIni, bPointwise=False):
+        m=self
+        # The following are the variables needed for plots
+        m.vals=('ts','cdf_ci','x2','pi_ci','piPooled_ci')
+        self.d=data.copy()
+        d=self.d
+        # Observations of all replicates, as flat arrays of cells. Index rg=2*ri+gi
+        # for the parameters of infected hosts, ri for the others, li for the latent
+        # number of infected hosts of each replicate, group and challenged dose.
+        cells={'t1':[],'t2':[],'count':[],'rg':[],'r':[],'l':[]}
+        surv={'tmax':[],'count':[],'rg':[],'r':[],'l':[]}
+        m.latent=[]
+        nhosts=[]
+        for ri,dr in enumerate(d.replicates):
+            counts=df.GroupsTimeData.fromTimeData(dr).deathCounts()
+            for gi,(nh,sv) in enumerate([(dr.nhosts1,dr.survivors1),(dr.nhosts2,dr.survivors2)]):
+                for di in range(sum(dr.doses==0),dr.ndoses):
+                    li=len(m.latent)
+                    m.latent.append('Ig%id%i_r%i'%(gi+1,di,ri+1))
+                    nhosts.append(nh[di])
+                    iT=np.nonzero(counts[gi,di])[0]
+                    cells['t1'].extend(dr.times[iT-1])
+                    cells['t2'].extend(dr.times[iT])
+                    cells['count'].extend(counts[gi,di,iT])
+                    cells['rg']+=[2*ri+gi]*len(iT)
+                    cells['r']+=[ri]*len(iT)
+                    cells['l']+=[li]*len(iT)
+                    if sv[di]>0:
+                        for key,v in zip(['tmax','count','rg','r','l'],[dr.tmax,sv[di],2*ri+gi,ri,li]):
+                            surv[key].append(v)
+        m.cells=dict([(key,np.array(v)) for key,v in cells.items()])
+        m.surv=dict([(key,np.array(v)) for key,v in surv.items()])
+        m.nhosts=np.array(nhosts,float)
+        super(Model,self).__init__(data,priors,name,path,bRandomIni,bPointwise)
+
+    @ut.doc_inherit
+    def likelihood_setup(self,bRandomIni):
+        """ Sets up likelihoods. If bRandomIni, will reset all variables to random values."""
+        #~~ Saving variable names ~~
+        m=self
+        d=self.d
+        # Only once (likelihood_setup is called again by resetParameters)
+        if len(m.parameters)==len(m.priors.parameters):
+            for r in range(1,d.nreplicates+1):
+                for par in m.priors.replicateParameters(r):
+                    setattr(m,par.__name__,par)
+                    m.parameters.append(par.__name__)
+            m.parameters.extend(m.latent)
+        super(Model,self).likelihood_setup(bRandomIni)
+
+    def __lik_setup__(self):
+        m=self
+        d=m.d
+        c=m.cells
+        s=m.surv
+        zeroprob=0
+        try:
+            #~~ Other stochastic variables needed to calculate the likelihood ~~
+            m.Ig=[]
+            for ri,dr in enumerate(d.replicates):
+                r=ri+1
+                par=lambda name: getattr(m,'%s_r%i'%(name,r))
+                for di in range(sum(dr.doses==0),dr.ndoses):
+                    setattr(m,'pi_hom%i_r%i'%(di,r), py.Lambda('pi_hom%i_r%i'%(di,r),lambda p=par('p'),eps=m.eps,dose=dr.doses[di]: ut.pi_hom(dose,p,eps)))
+                    # Clipped, out of bounds values of a2 and b2 are rejected by potBounds
+                    setattr(m,'pi_het%i_r%i'%(di,r), py.Lambda('pi_het%i_r%i'%(di,r),lambda p=par('p'),a=par('a2'),b=par('b2'),eps=m.eps,dose=dr.doses[di]: np.clip(np.nan_to_num(ut.pi_het(dose,p,a,b,eps)),0,1)))
+                for gi,(nh,pi) in enumerate([(dr.nhosts1,'pi_hom'),(dr.nhosts2,'pi_het')]):
+                    for di in range(sum(dr.doses==0),dr.ndoses):
+                        name='Ig%id%i_r%i'%(gi+1,di,r)
+                        setattr(m,name,py.Binomial(name,n=nh[di],p=getattr(m,'%s%i_r%i'%(pi,di,r))))
+                        m.Ig.append(getattr(m,name))
+
+            R=range(1,d.nreplicates+1)
+            m.sU=[getattr(m,'sU_r%i'%r) for r in R]
+            m.k=[getattr(m,'k_r%i'%r) for r in R]
+            m.tauU=py.Lambda('tauU',lambda mean=[getattr(m,'meanU_r%i'%r) for r in R], s=m.sU: np.array(mean,float)/np.array(s,float))
+            m.sI=sum([[getattr(m,'sI1_r%i'%r),getattr(m,'sI2_r%i'%r)] for r in R],[])
+            m.tauI=py.Lambda('tauI',lambda mean=sum([[getattr(m,'meanI1_r%i'%r),getattr(m,'meanI2_r%i'%r)] for r in R],[]), s=m.sI: np.array(mean,float)/np.array(s,float))
+
+            #~~ Likelihood ~~
+
+            # Log-probabilities of deaths in each cell, and of survival up to tmax
+            m.logprobdU=py.Lambda('logprobdU',lambda s=m.sU, tau=m.tauU, k=m.k: ut.logKpdfInt(c['t1'],c['t2'],np.array(s,float)[c['r']],tau[c['r']],np.array(k,float)[c['r']]), trace=False)
+            m.logprobdI=py.Lambda('logprobdI',lambda s=m.sI, tau=m.tauI, k=m.k: ut.logKpdfInt(c['t1'],c['t2'],np.array(s,float)[c['rg']],tau[c['rg']],np.array(k,float)[c['r']]), trace=False)
+            s_tmax,s_r,s_rg=s['tmax'],s['r'],s['rg']
+            m.logprobsU=py.Lambda('logprobsU',lambda s=m.sU, tau=m.tauU, k=m.k: ut.logKsf(s_tmax,np.array(s,float)[s_r],tau[s_r],np.array(k,float)[s_r]), trace=False)
+            m.logprobsI=py.Lambda('logprobsI',lambda s=m.sI, tau=m.tauI, k=m.k: ut.logKsf(s_tmax,np.array(s,float)[s_rg],tau[s_rg],np.array(k,float)[s_r]), trace=False)
+
+            def likelihood(value,nf,I,logprobdI,logprobdU,logprobsI,logprobsU,survivors):
+                f=np.array(I,float)/nf
+                res=ut.logMixture(f[c['l']],logprobdI,logprobdU)
+                ress=ut.logMixture(f[s['l']],logprobsI,logprobsU)
+                return (value*res).sum()+(survivors*ress).sum()
+
+            # A single likelihood for all replicates, groups, doses and intervals
+            m.L=py.Stochastic(logp=likelihood,doc='',name='L',parents={'nf':m.nhosts, 'I':m.Ig, 'logprobdI':m.logprobdI,'logprobdU':m.logprobdU,'logprobsI':m.logprobsI,'logprobsU':m.logprobsU,'survivors':s['count']}, trace=False, observed=True, dtype=int, value=c['count'])
+            m.liks=['L']
+
+            # Set likelihood to 0 if, in any replicate and group, there is higher chance of infected surviving to the end of the study compared to non-infected.
+            tmax=np.array([dr.tmax for dr in d.replicates],float)
+            @py.potential
+            def potIdeaths(sI=m.sI,tauI=m.tauI, sU=m.sU,tauU=m.tauU):
+                cdfI=st.gamma.cdf(np.repeat(tmax,2),np.array(sI,float),loc=0,scale=tauI)
+                cdfU=st.gamma.cdf(tmax,np.array(sU,float),loc=0,scale=tauU)
+                return 0.0 if np.all(cdfI>=np.repeat(cdfU,2)) else -np.Inf
+
+            setattr(m,'potIdeaths',potIdeaths)
+
+            # Set likelihood to 0 if the parameters of any replicate are out of the bounds set in the priors file
+            bounded=[(getattr(m,'%s_r%i'%(name,r)),lo,hi) for name,(lo,hi) in sorted(getattr(m.priors,'bounds',{}).items()) for r in R]
+            @py.potential
+            def potBounds(values=[b[0] for b in bounded]):
+                return 0.0 if all([lo<=v<=hi for v,(x,lo,hi) in zip(values,bounded)]) else -np.Inf
+
+            setattr(m,'potBounds',potBounds)
+
+            m.L.logp+potIdeaths.logp+potBounds.logp
+
+        except py.ZeroProbability:
+            zeroprob=1
+        return zeroprob
+
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+    #~~ Calculating posterior predictive distributions ~~#
+    #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~#
+    def __calc__(self):
+        progBar=ut.ProgressBar("Calculating mortalities")
+
+        m=self
+        d=self.d
+        R=d.nreplicates
+        ts=np.arange(0,max([dr.times[-1] for dr in d.replicates])+1,0.2)
+        alldoses=np.concatenate([dr.doses for dr in d.replicates])
+        x2=10**np.arange(np.log10(alldoses[alldoses>0].min())-1,np.log10(alldoses.max())+1,0.1)
+
+        def pis(doses,p,a2,b2,eps):
+            "Probabilities of infection of both groups (groups x samples x doses)."
+            return np.array([ut.pi_hom(doses[None,:],p[:,None],eps[:,None]),
+                             ut.pi_het(doses[None,:],p[:,None],a2[:,None],b2[:,None],eps[:,None])])
+
+        cdf_ci=[] # Interval for the probability of survival per group and dose at each day, for each replicate
+        pi_ci=np.zeros([3,2,R,len(x2)])
+        for ri,dr in enumerate(d.replicates):
+            par=lambda name: getattr(m,'%s_r%is'%(name,ri+1))
+            ks=par('k')
+            cdfU=ut.kpdfInt(0,ts[None,:],par('sU')[:,None],(par('meanU')/par('sU'))[:,None],ks[:,None])
+            cdfI=np.array([ut.kpdfInt(0,ts[None,:],par('sI%i'%g)[:,None],(par('meanI%i'%g)/par('sI%i'%g))[:,None],ks[:,None]) for g in (1,2)])
+            pi=pis(dr.doses,par('p'),par('a2'),par('b2'),m.epss)
+            ci=np.zeros([3,2,dr.ndoses,len(ts)])
+            for di in range(dr.ndoses):
+                survival=1-pi[:,:,di,None]*cdfI-(1-pi[:,:,di,None])*cdfU[None,:,:]
+                ci[:,:,di,:]=ut.confint(survival.transpose(1,0,2),self.weights)
+            cdf_ci.append(ci)
+            pi_ci[:,:,ri,:]=ut.confint(pis(x2,par('p'),par('a2'),par('b2'),m.epss).transpose(1,0,2),self.weights)
+            progBar.iter(1./(R+1))
+
+        # Population (pooled) dose-response, from exp(mu_X)
+        piPooled_ci=ut.confint(pis(x2,np.exp(m.mu_ps),np.exp(m.mu_a2s),np.exp(m.mu_b2s),m.epss).transpose(1,0,2),self.weights)
+        progBar.iter(1./(R+1))
+        progBar.finish()
+
+        res={'burnin':self.burnin,'thinF':self.thinF}
+        for v in self.vals:
+            setattr(self,v,eval(v))
+            res[v]=eval(v)
+        for v in self.parameters:
+            res[v+'s']=getattr(self,v+'s')
+        self.savePostcalc(res)
+
+    def __plot__(self,bPlot=True,nprocs=1):
+        print "Results saved in "+self.path
+        self.write_vals()
+        if bPlot:
+            self.render(nprocs=nprocs)
+
+    def plotSurvival(self, name=None, colors=None):
+        """Plots survival over time for each of the doses of each replicate (one
+        figure per replicate, saved with suffix '_rR'). Group 1 in black, group 2 in
+        blue.
+
+        Returns:
+        - f (list of Figure)"""
+        if colors==None:
+            colors=self.colors
+        m=self
+        ts=m.ts
+        if name==None:
+            name='-posteriorSurvival'
+        mpl.rcParams.update({'font.size': 8})
+        mpl.rcParams['axes.labelsize'] = 'medium'
+        figs=[]
+        for ri,dr in enumerate(m.d.replicates):
+            ncols=4
+            nrows=int(np.ceil(dr.ndoses/float(ncols)))
+            f=pl.figure(figsize=(8,1.5*nrows))
+            for di,dose in enumerate(dr.doses):
+                ax=f.add_subplot(nrows,ncols,di+1)
+                for gi,(td,sv,nh) in enumerate([(dr.timesDeath1,dr.survivors1,dr.nhosts1),(dr.timesDeath2,dr.survivors2,dr.nhosts2)]):
+                    col=colors[gi]
+                    l=ax.plot(dr.times,np.array([(td[di]>t).sum()+sv[di] for t in dr.times])/float(nh[di]),col+'o',mec=col,mew=1,ms=1)
+                    l=ax.plot(ts,m.cdf_ci[ri][1,gi,di,:],col+'-',lw=0.7)
+                    l=ax.fill_between(ts,m.cdf_ci[ri][0,gi,di,:],m.cdf_ci[ri][2,gi,di,:],facecolor=col,lw=0,alpha=0.12)
+                l=ax.set_ylim([-0.03,1.05])
+                tt='control' if dose==0 else r'10$^{%i}$ TCID$_{50}$'%int(np.log10(dose))
+                l=ax.text(0.97,0.97,s=tt,ha='right',va='top',fontsize=8,transform=ax.transAxes)
+                if di%ncols==0:
+                    l=ax.set_ylabel('survival')
+                if di>=dr.ndoses-ncols:
+                    l=ax.set_xlabel('days post challenge')
+            f.suptitle(dr.dataName)
+            f.savefig(m.saveTo+name+'_r%i.'%(ri+1)+m.figFormat, bbox_inches='tight',dpi=600)
+            figs.append(f)
+        print "Plotted survival of each replicate, see "+m.name+name+"_rR."+m.figFormat
+        return figs
+
+    def plotReplicates(self, name=None, parameters=None):
+        """Plots the posterior median and 95% interval of the parameters of each
+        replicate, with the population value exp(mu_X) (in red).
+
+        Input:
+        - parameters (list of str): pooled parameters to plot, defaults to all.
+
+        Returns:
+        - f (Figure)"""
+        m=self
+        R=m.d.nreplicates
+        if parameters==None:
+            parameters=[p[3:] for p in m.parameters if p.startswith('mu_')]
+        ncols=5
+        nrows=int(np.ceil(len(parameters)/float(ncols)))
+        f=pl.figure(figsize=(10,1.8*nrows))
+        f.subplots_adjust(wspace=0.5,hspace=0.6)
+        for pi,par in enumerate(parameters):
+            ax=f.add_subplot(nrows,ncols,pi+1)
+            for ri in range(R):
+                ci=ut.wpercentile(getattr(m,'%s_r%is'%(par,ri+1)),[2.5,50,97.5],m.weights)
+                ax.plot([ci[0],ci[2]],[ri+1]*2,'k-',lw=0.7)
+                ax.plot(ci[1],ri+1,'ko',ms=2)
+            ci=ut.wpercentile(np.exp(getattr(m,'mu_%ss'%par)),[2.5,50,97.5],m.weights)
+            ax.axvspan(ci[0],ci[2],facecolor='r',lw=0,alpha=0.15)
+            ax.axvline(ci[1],color='r',lw=0.7)
+            ax.set_ylim([0.5,R+0.5])
+            ax.set_yticks(range(1,R+1))
+            ax.set_title(par,fontsize=8)
+            if par in ('p','k'):
+                ax.set_xscale('log')
+
+        if name==None:
+            name='-plotReplicates'
+        f.savefig(m.saveTo+name+'.'+m.figFormat, bbox_inches='tight',dpi=600)
+        print "Plotted parameters of each replicate, see "+m.name+name+"."+m.figFormat
+        return f
+
+    def plotPosterior(self, name=None, colors=None):
+        """Plots the dose-response curves of both groups, of each replicate (thin
+        lines) and of the population (from exp(mu_X), with 95% intervals).
+
+        Returns:
+        - f (Figure)
+        - ax (Axes)"""
+        if colors==None:
+            colors=self.colors
+        m=self
+        x2=m.x2
+        f=pl.figure(figsize=(3.5,2.5))
+        ax=f.add_subplot(111)
+        for gi,label in enumerate(['Homogeneous','Heterogeneous']):
+            col=colors[gi]
+            for ri in range(m.d.nreplicates):
+                ax.plot(x2,m.pi_ci[1,gi,ri,:],col+'-',lw=0.4,alpha=0.5)
+            ax.fill_between(x2,m.piPooled_ci[0,gi,:],m.piPooled_ci[2,gi,:],facecolor=col,lw=0,alpha=0.12)
+            ax.plot(x2,m.piPooled_ci[1,gi,:],col+'-',label=label)
+        ax.set_xscale('log')
+        ax.set_ylim([-0.09,1.09])
+        ax.set_xlabel(r'dose')
+        ax.set_ylabel(r'infection probability, $\pi$')
+        ax.legend(loc='upper left',fontsize=6,frameon=False)
+
+        if name==None:
+            name='-plotPosterior'
+        f.savefig(m.saveTo+name+'.'+m.figFormat, bbox_inches='tight',dpi=600)
+        print "Plotted dose-response curves, see "+m.name+name+"."+m.figFormat
+        return f,ax
+
+
+ReplicatesTimeData=df.ReplicatesTimeData
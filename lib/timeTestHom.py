@@ -21,8 +21,10 @@ Assumptions:
 
 # Import libraries
 from copy import deepcopy
-import pickle, pymc as py, numpy as np, scipy as sc, scipy.special as sp, scipy.stats as st, pylab as pl, sys, importlib, shutil
+import pickle, numpy as np, scipy as sc, scipy.special as sp, sys, importlib, shutil
 import utils as ut
+# Slow to import, loaded when first used (see utils.lazyImport)
+py,st,pl=ut.py,ut.st,ut.pl
 import modelFunctions as mf
 import dataFunctions as df
 
@@ -59,10 +61,12 @@ Possible plots (only after MCMC has been run):
 """
     __defaultPrior__='priors_testHom'
     __defaultName__='_testHom'
+    # Figures rendered after the posterior calculations (see render)
+    __figures__=['plotSurvival','plotPosterior']
     #~~~~~~~~~~~~~~~~~~~~~~~~~#
     #~~ Setting up the MCMC ~~#
     #~~~~~~~~~~~~~~~~~~~~~~~~~#    
-    def __init__(self,data, priors, name, path, bRandomIni):
+    def __init__(self,data, priors, name, path, bRandomIni, bPointwise=False):
         """Returns a Model object, used to launch MCMC and process posterior distributions.
 
 Input:
@@ -74,7 +78,7 @@ Input:
         m=self
         # The following are the variables needed for plots
         m.vals=('ts','cdf1hom_ci','cdf2hom_ci','cdf1het_ci','cdf2het_ci','x2','pi1hom_ci','pi2hom_ci','pi1het_ci','pi2het_ci','pdfU','cdfU','pdfI1','pdfI2')
-        super(Model,self).__init__(data,priors,name,path,bRandomIni)
+        super(Model,self).__init__(data,priors,name,path,bRandomIni,bPointwise)
     
     @ut.doc_inherit
     def likelihood_setup(self, bRandomIni):
@@ -116,29 +120,21 @@ Input:
             
             #~~ Likelihood ~~
             
-            # Calculate the probabilities of deaths at each of the changing times
-            m.probdU=py.Lambda('probdU',lambda s=m.sU, tau=m.tauU, k=m.k,t1=d.times[chgT-1],t2=d.times[chgT]: ut.kpdfInt(t1,t2,s,tau,k), trace=False)
-            m.probdI1=py.Lambda('probdI1',lambda s=m.sI1, tau=m.tauI1, k=m.k,t1=d.times[chgT-1],t2=d.times[chgT]: ut.kpdfInt(t1,t2,s,tau,k), trace=False)
-            m.probdI2=py.Lambda('probdI2',lambda s=m.sI2, tau=m.tauI2, k=m.k,t1=d.times[chgT-1],t2=d.times[chgT]: ut.kpdfInt(t1,t2,s,tau,k), trace=False)
+            # Calculate the log-probabilities of deaths at each of the changing times
+            m.logprobdU=py.Lambda('logprobdU',lambda s=m.sU, tau=m.tauU, k=m.k,t1=d.times[chgT-1],t2=d.times[chgT]: ut.kernels.get(ut.logKpdfInt,(t1,t2),s,tau,k), trace=False)
+            m.logprobdI1=py.Lambda('logprobdI1',lambda s=m.sI1, tau=m.tauI1, k=m.k,t1=d.times[chgT-1],t2=d.times[chgT]: ut.kernels.get(ut.logKpdfInt,(t1,t2),s,tau,k), trace=False)
+            m.logprobdI2=py.Lambda('logprobdI2',lambda s=m.sI2, tau=m.tauI2, k=m.k,t1=d.times[chgT-1],t2=d.times[chgT]: ut.kernels.get(ut.logKpdfInt,(t1,t2),s,tau,k), trace=False)
             
-            # Calculate the probabilities of survival at each of the changing times
-            m.probsU=py.Lambda('probsU',lambda s=m.sU, tau=m.tauU, k=m.k: 1-(ut.kpdfInt(0,d.tmax,s,tau,k)), trace=False)
-            m.probsI1=py.Lambda('probsI1',lambda s=m.sI1, tau=m.tauI1, k=m.k: 1-(ut.kpdfInt(0,d.tmax,s,tau,k)), trace=False)
-            m.probsI2=py.Lambda('probsI2',lambda s=m.sI2, tau=m.tauI2, k=m.k: 1-(ut.kpdfInt(0,d.tmax,s,tau,k)), trace=False)
+            # Calculate the log-probabilities of survival up to tmax
+            m.logprobsU=py.Lambda('logprobsU',lambda s=m.sU, tau=m.tauU, k=m.k: ut.kernels.get(ut.logKsf,(d.tmax,),s,tau,k), trace=False)
+            m.logprobsI1=py.Lambda('logprobsI1',lambda s=m.sI1, tau=m.tauI1, k=m.k: ut.kernels.get(ut.logKsf,(d.tmax,),s,tau,k), trace=False)
+            m.logprobsI2=py.Lambda('logprobsI2',lambda s=m.sI2, tau=m.tauI2, k=m.k: ut.kernels.get(ut.logKsf,(d.tmax,),s,tau,k), trace=False)
             
-            def likelihood_deaths(value,nf,I,probdI,probdU):
-                res=(I/nf)*probdI[value]+(1-(I/nf))*probdU[value]
-                inf0=res<0
-                if any(inf0): 
-                    res[res<0]=0
-                return np.log(res).sum()
+            def likelihood_deaths(value,nf,I,logprobdI,logprobdU):
+                return ut.logMixture(float(I)/nf,logprobdI[value],logprobdU[value]).sum()
             
-            def likelihood_survivors(value,nf,I,probsI,probsU):
-                res=((I/nf)*probsI+(1-(I/nf))*probsU)**value
-                inf0=res<0
-                if inf0: 
-                    res=0
-                return np.log(res)
+            def likelihood_survivors(value,nf,I,logprobsI,logprobsU):
+                return value*ut.logMixture(float(I)/nf,logprobsI,logprobsU)
             
           
             # Calculate the likelihoods
@@ -147,38 +143,48 @@ Input:
             m.het1liks=[]
             m.het2liks=[]  
             for i in range(0+sum(d.doses==0),len(d.doses)):
-                setattr(m,'LD1hom_d%i'%i,py.Stochastic(logp=likelihood_deaths,doc='',name='LD1hom_d%i'%i,parents={'nf':d.nhosts1[i], 'I':getattr(m,'I1hom%i'%i), 'probdI':m.probdI1,'probdU':m.probdU}, trace=False, observed=True, dtype=int, value=iTd1[i]))
+                setattr(m,'LD1hom_d%i'%i,py.Stochastic(logp=likelihood_deaths,doc='',name='LD1hom_d%i'%i,parents={'nf':d.nhosts1[i], 'I':getattr(m,'I1hom%i'%i), 'logprobdI':m.logprobdI1,'logprobdU':m.logprobdU}, trace=False, observed=True, dtype=int, value=iTd1[i]))
                 m.hom1liks+=['LD1hom_d%i'%i]
                 
-                setattr(m,'LD1het_d%i'%i,py.Stochastic(logp=likelihood_deaths,doc='',name='LD1het_d%i'%i,parents={'nf':d.nhosts1[i], 'I':getattr(m,'I1het%i'%i), 'probdI':m.probdI1,'probdU':m.probdU}, trace=False, observed=True, dtype=int, value=iTd1[i]))
+                setattr(m,'LD1het_d%i'%i,py.Stochastic(logp=likelihood_deaths,doc='',name='LD1het_d%i'%i,parents={'nf':d.nhosts1[i], 'I':getattr(m,'I1het%i'%i), 'logprobdI':m.logprobdI1,'logprobdU':m.logprobdU}, trace=False, observed=True, dtype=int, value=iTd1[i]))
                 m.het1liks+=['LD1het_d%i'%i]
                 
                 if d.survivors1[i]>0:
-                    setattr(m,'LS1hom_d%i'%i,py.Stochastic(logp=likelihood_survivors,doc='',name='LS1hom_d%i'%i,parents={'nf':d.nhosts1[i], 'I':getattr(m,'I1hom%i'%i), 'probsI':m.probsI1,'probsU':m.probsU}, trace=False, observed=True, dtype=int, value=d.survivors1[i]))
+                    setattr(m,'LS1hom_d%i'%i,py.Stochastic(logp=likelihood_survivors,doc='',name='LS1hom_d%i'%i,parents={'nf':d.nhosts1[i], 'I':getattr(m,'I1hom%i'%i), 'logprobsI':m.logprobsI1,'logprobsU':m.logprobsU}, trace=False, observed=True, dtype=int, value=d.survivors1[i]))
                     m.hom1liks+=['LS1hom_d%i'%i]
-                    setattr(m,'LS1het_d%i'%i,py.Stochastic(logp=likelihood_survivors,doc='',name='LS1het_d%i'%i,parents={'nf':d.nhosts1[i], 'I':getattr(m,'I1het%i'%i), 'probsI':m.probsI1,'probsU':m.probsU}, trace=False, observed=True, dtype=int, value=d.survivors1[i]))
+                    setattr(m,'LS1het_d%i'%i,py.Stochastic(logp=likelihood_survivors,doc='',name='LS1het_d%i'%i,parents={'nf':d.nhosts1[i], 'I':getattr(m,'I1het%i'%i), 'logprobsI':m.logprobsI1,'logprobsU':m.logprobsU}, trace=False, observed=True, dtype=int, value=d.survivors1[i]))
                     m.het1liks+=['LS1het_d%i'%i]
                 
-                setattr(m,'LD2hom_d%i'%i,py.Stochastic(logp=likelihood_deaths,doc='',name='LD2hom_d%i'%i,parents={'nf':d.nhosts2[i], 'I':getattr(m,'I2hom%i'%i), 'probdI':m.probdI2,'probdU':m.probdU}, trace=False, observed=True, dtype=int, value=iTd2[i]))
+                setattr(m,'LD2hom_d%i'%i,py.Stochastic(logp=likelihood_deaths,doc='',name='LD2hom_d%i'%i,parents={'nf':d.nhosts2[i], 'I':getattr(m,'I2hom%i'%i), 'logprobdI':m.logprobdI2,'logprobdU':m.logprobdU}, trace=False, observed=True, dtype=int, value=iTd2[i]))
                 m.hom2liks+=['LD2hom_d%i'%i]
                 
-                setattr(m,'LD2het_d%i'%i,py.Stochastic(logp=likelihood_deaths,doc='',name='LD2het_d%i'%i,parents={'nf':d.nhosts2[i], 'I':getattr(m,'I2het%i'%i), 'probdI':m.probdI2,'probdU':m.probdU}, trace=False, observed=True, dtype=int, value=iTd2[i]))
+                setattr(m,'LD2het_d%i'%i,py.Stochastic(logp=likelihood_deaths,doc='',name='LD2het_d%i'%i,parents={'nf':d.nhosts2[i], 'I':getattr(m,'I2het%i'%i), 'logprobdI':m.logprobdI2,'logprobdU':m.logprobdU}, trace=False, observed=True, dtype=int, value=iTd2[i]))
                 m.het2liks+=['LD2het_d%i'%i] 
                 
                 if d.survivors2[i]>0:
-                    setattr(m,'LS2hom_d%i'%i,py.Stochastic(logp=likelihood_survivors,doc='',name='LS2hom_d%i'%i,parents={'nf':d.nhosts2[i], 'I':getattr(m,'I2hom%i'%i), 'probsI':m.probsI2,'probsU':m.probsU}, trace=False, observed=True, dtype=int, value=d.survivors2[i]))
+                    setattr(m,'LS2hom_d%i'%i,py.Stochastic(logp=likelihood_survivors,doc='',name='LS2hom_d%i'%i,parents={'nf':d.nhosts2[i], 'I':getattr(m,'I2hom%i'%i), 'logprobsI':m.logprobsI2,'logprobsU':m.logprobsU}, trace=False, observed=True, dtype=int, value=d.survivors2[i]))
                     m.hom2liks+=['LS2hom_d%i'%i]
-                    setattr(m,'LS2het_d%i'%i,py.Stochastic(logp=likelihood_survivors,doc='',name='LS2het_d%i'%i,parents={'nf':d.nhosts2[i], 'I':getattr(m,'I2het%i'%i), 'probsI':m.probsI2,'probsU':m.probsU}, trace=False, observed=True, dtype=int, value=d.survivors2[i]))
+                    setattr(m,'LS2het_d%i'%i,py.Stochastic(logp=likelihood_survivors,doc='',name='LS2het_d%i'%i,parents={'nf':d.nhosts2[i], 'I':getattr(m,'I2het%i'%i), 'logprobsI':m.logprobsI2,'logprobsU':m.logprobsU}, trace=False, observed=True, dtype=int, value=d.survivors2[i]))
                     m.het2liks+=['LS2het_d%i'%i]
             
+            # Log-likelihood of each observation, for model comparison (see looWaic)
+            if m.bPointwise:
+                m.pointwiseGroups={'hom1':[],'het1':[],'hom2':[],'het2':[]}
+                for i in range(0+sum(d.doses==0),len(d.doses)):
+                    for g,iTd in ((1,iTd1),(2,iTd2)):
+                        for mod in ('hom','het'):
+                            name='ll%i%s_d%i'%(g,mod,i)
+                            m.pointwise_setup(name,getattr(d,'nhosts%i'%g)[i],getattr(m,'I%i%s%i'%(g,mod,i)),getattr(m,'logprobdI%i'%g),m.logprobdU,getattr(m,'logprobsI%i'%g),m.logprobsU,iTd[i],getattr(d,'survivors%i'%g)[i])
+                            m.pointwiseGroups['%s%i'%(mod,g)]+=[name]
+            
             # Set likelihood to 0 if, for the first group, there is higher chance of infected surviving to the end of the study compared to non-infected.
             @py.potential
             def potIdeaths1(sI=m.sI1,tauI=m.tauI1, sU=m.sU,tauU=m.tauU): 
-                return 0.0 if st.gamma.cdf(max(d.times),sI,loc=0,scale=tauI)>=st.gamma.cdf(max(d.times),sU,loc=0,scale=tauU) else -np.Inf
+                return 0.0 if ut.kernels.get(ut.gcdf,(max(d.times),),sI,tauI)>=ut.kernels.get(ut.gcdf,(max(d.times),),sU,tauU) else -np.Inf
             
             @py.potential
             def potIdeaths2(sI=m.sI2,tauI=m.tauI2, sU=m.sU,tauU=m.tauU): 
-                return 0.0 if st.gamma.cdf(max(d.times),sI,loc=0,scale=tauI)>=st.gamma.cdf(max(d.times),sU,loc=0,scale=tauU) else -np.Inf        
+                return 0.0 if ut.kernels.get(ut.gcdf,(max(d.times),),sI,tauI)>=ut.kernels.get(ut.gcdf,(max(d.times),),sU,tauU) else -np.Inf        
         
             setattr(m,'potIdeaths1',potIdeaths1)
             setattr(m,'potIdeaths2',potIdeaths2)
@@ -214,43 +220,43 @@ Input:
         cdf2het_ci=np.zeros([3,d.ndoses,len(ts)])        
         
         #PDFs
-        pdfI1=eval(ut.callArray('ut.kpdf(',['ts','sI1s','tauI1s','ks'],(len(ts),len(sUs))))
+        pdfI1=ut.kernels.columns(ut.kpdf,(ts,),sI1s,tauI1s,ks)
         progBar.iter(0.25)
         
-        pdfI2=eval(ut.callArray('ut.kpdf(',['ts','sI2s','tauI2s','ks'],(len(ts),len(sUs))))
+        pdfI2=ut.kernels.columns(ut.kpdf,(ts,),sI2s,tauI2s,ks)
         progBar.iter(0.25)        
         
         #CDFs
-        cdfU=eval(ut.callArray('ut.kpdfInt(0,',['ts','sUs','tauUs','ks'],(len(ts),len(sUs))))
+        cdfU=ut.kernels.columns(ut.kpdfInt,(0,ts),sUs,tauUs,ks)
         
-        cdfI1=eval(ut.callArray('ut.kpdfInt(0,',['ts','sI1s','tauI1s','ks'],(len(ts),len(sUs))))
+        cdfI1=ut.kernels.columns(ut.kpdfInt,(0,ts),sI1s,tauI1s,ks)
         progBar.iter(0.25)
         
-        cdfI2=eval(ut.callArray('ut.kpdfInt(0,',['ts','sI2s','tauI2s','ks'],(len(ts),len(sUs))))
+        cdfI2=ut.kernels.columns(ut.kpdfInt,(0,ts),sI2s,tauI2s,ks)
         progBar.iter(0.25)
         progBar.finish()
         
         progBar.start("Calculating mortalities")
         di=0
         
-        cdf1hom_ci[:,0,:]=ut.confint(1-cdfU)
-        cdf1het_ci[:,0,:]=ut.confint(1-cdfU)
-        cdf2hom_ci[:,0,:]=ut.confint(1-cdfU)
-        cdf2het_ci[:,0,:]=ut.confint(1-cdfU)        
+        cdf1hom_ci[:,0,:]=ut.confint(1-cdfU,self.weights)
+        cdf1het_ci[:,0,:]=ut.confint(1-cdfU,self.weights)
+        cdf2hom_ci[:,0,:]=ut.confint(1-cdfU,self.weights)
+        cdf2het_ci[:,0,:]=ut.confint(1-cdfU,self.weights)        
         progBar.iter(1./d.ndoses)
         
         for di in range(1,d.ndoses):
             pi1homs=ut.pi_hom(d.doses[di],p1homs,epss)
             pi1hets=ut.pi_het(d.doses[di],p1hets,a1s,b1s,epss)
             
-            cdf1hom_ci[:,di,:]=ut.confint(1-((np.array([pi1homs.tolist()]*len(ts)).T)*cdfI1)-((1-np.array([pi1homs.tolist()]*len(ts)).T)*cdfU))
-            cdf1het_ci[:,di,:]=ut.confint(1-((np.array([pi1hets.tolist()]*len(ts)).T)*cdfI1)-((1-np.array([pi1hets.tolist()]*len(ts)).T)*cdfU))
+            cdf1hom_ci[:,di,:]=ut.confint(1-((np.array([pi1homs.tolist()]*len(ts)).T)*cdfI1)-((1-np.array([pi1homs.tolist()]*len(ts)).T)*cdfU),self.weights)
+            cdf1het_ci[:,di,:]=ut.confint(1-((np.array([pi1hets.tolist()]*len(ts)).T)*cdfI1)-((1-np.array([pi1hets.tolist()]*len(ts)).T)*cdfU),self.weights)
             
             pi2homs=ut.pi_hom(d.doses[di],p2homs,epss)
             pi2hets=ut.pi_het(d.doses[di],p2hets,a1s,b1s,epss)
             
-            cdf2hom_ci[:,di,:]=ut.confint(1-((np.array([pi2homs.tolist()]*len(ts)).T)*cdfI1)-((1-np.array([pi2homs.tolist()]*len(ts)).T)*cdfU))
-            cdf2het_ci[:,di,:]=ut.confint(1-((np.array([pi2hets.tolist()]*len(ts)).T)*cdfI1)-((1-np.array([pi2hets.tolist()]*len(ts)).T)*cdfU))
+            cdf2hom_ci[:,di,:]=ut.confint(1-((np.array([pi2homs.tolist()]*len(ts)).T)*cdfI1)-((1-np.array([pi2homs.tolist()]*len(ts)).T)*cdfU),self.weights)
+            cdf2het_ci[:,di,:]=ut.confint(1-((np.array([pi2hets.tolist()]*len(ts)).T)*cdfI1)-((1-np.array([pi2hets.tolist()]*len(ts)).T)*cdfU),self.weights)
             
             progBar.iter(1./d.ndoses)
             
@@ -264,18 +270,18 @@ Input:
         pi2hom_ci=np.zeros([3,len(x2)])
         pi2het_ci=np.zeros([3,len(x2)])
         for i in range(len(x2)):
-            pi1hom_ci[:,i]=ut.confint(ut.pi_hom(x2[i],p1homs,epss))
-            pi1het_ci[:,i]=ut.confint(ut.pi_het(x2[i],p1hets ,a1s,b1s,epss))
-            pi2hom_ci[:,i]=ut.confint(ut.pi_hom(x2[i],p2homs,epss))
-            pi2het_ci[:,i]=ut.confint(ut.pi_het(x2[i],p2hets ,a2s,b2s,epss))
+            pi1hom_ci[:,i]=ut.confint(ut.pi_hom(x2[i],p1homs,epss),self.weights)
+            pi1het_ci[:,i]=ut.confint(ut.pi_het(x2[i],p1hets ,a1s,b1s,epss),self.weights)
+            pi2hom_ci[:,i]=ut.confint(ut.pi_hom(x2[i],p2homs,epss),self.weights)
+            pi2het_ci[:,i]=ut.confint(ut.pi_het(x2[i],p2hets ,a2s,b2s,epss),self.weights)
             progBar.iter(1./len(x2))
         
         progBar.finish()
         
-        pdfU=ut.confint(cdfU[:,1:]-cdfU[:,:-1]) # Calculate pdf from cdf to avoid nan from high sU, len= len(ts)-1
-        cdfU=ut.confint(cdfU)
-        pdfI1=ut.confint(pdfI1)
-        pdfI2=ut.confint(pdfI2)
+        pdfU=ut.confint(cdfU[:,1:]-cdfU[:,:-1],self.weights) # Calculate pdf from cdf to avoid nan from high sU, len= len(ts)-1
+        cdfU=ut.confint(cdfU,self.weights)
+        pdfI1=ut.confint(pdfI1,self.weights)
+        pdfI2=ut.confint(pdfI2,self.weights)
         
         res={'burnin':self.burnin,'thinF':self.thinF}
         for v in self.vals:
@@ -283,15 +289,75 @@ Input:
             res[v]=eval(v)
         for v in self.parameters:
             res[v+'s']=eval(v+'s')
-        pickle.dump(res,open(self.saveTo+'-postcalc.pickle','w'))
-        
-        self.__plot__()
+        self.savePostcalc(res)
     
-    def __plot__(self):
+    def __plot__(self,bPlot=True,nprocs=1):
         print "Results saved in "+self.path
         self.write_vals()
-        self.plotSurvival()
-        self.plotPosterior()
+        if bPlot:
+            self.render(nprocs=nprocs)
+    
+    def evidence(self,nparticles=1000,nmoves=5,essFraction=0.5,nprocs=None,subModels=('hom1','het1','hom2','het2')):
+        """Estimates the marginal likelihood (evidence) of the homogeneous and heterogeneous
+models of each group with tempered sequential Monte Carlo (see smc.temperedSMC), 
+and the Bayes factors of the heterogeneous against the homogeneous model.
+
+The number of infected hosts per dose is summed out of the likelihood. The constraint 
+that infected hosts do not outlive uninfected ones (potIdeaths) is the same for both 
+models of a group, so it does not change the Bayes factors.
+
+Input:
+- nparticles (int): number of particles.
+- nmoves (int): number of Metropolis moves at each temperature.
+- essFraction (float): fraction of nparticles targeted as effective sample size when
+choosing the next temperature.
+- nprocs (int): number of worker processes evaluating the likelihood of particles,
+defaults to the number of cpus.
+- subModels (tuple of str): sub-models for which to estimate the evidence.
+
+Returns a dictionnary with the log evidence of each sub-model and the log Bayes 
+factors logBF1, logBF2 (het against hom, for groups for which both were estimated).
+Results are also saved in the results folder, see -evidence.csv.
+"""
+        import multiprocessing, smc
+        if nprocs==None:
+            nprocs=multiprocessing.cpu_count()
+        d=self.d
+        chgT=self.chgT
+        res={}
+        for sm in subModels:
+            g=int(sm[-1])
+            het=sm.startswith('het')
+            names=['p%ihet'%g,'a%i'%g,'b%i'%g] if het else ['p%ihom'%g]
+            names+=['eps','meanU','sU','k','meanI%i'%g,'sI%i'%g]
+            iTd=getattr(self,'iTd%i'%g)
+            idoses=range(sum(d.doses==0),len(d.doses))
+            sub={'het':het,'t1':d.times[chgT-1],'t2':d.times[chgT],'tmax':d.tmax,
+                 'doses':d.doses,'idoses':idoses,'nhosts':getattr(d,'nhosts%i'%g),
+                 'survivors':getattr(d,'survivors%i'%g),
+                 'deaths':dict([(di,np.bincount(np.asarray(iTd[di],int),minlength=len(chgT))) for di in idoses])}
+            print "Estimating evidence of sub-model %s"%sm
+            evaluate=smc.Evaluator(subModelLogLik,sub,nprocs)
+            drawPrior,logPrior=smc.priorFunctions(self.priors,names)
+            try:
+                # Parameters with priors on the real line (e.g. k) are not moved on a log scale
+                out=smc.temperedSMC(evaluate,drawPrior,logPrior,nparticles=nparticles,essFraction=essFraction,nmoves=nmoves,bLog=smc.positiveSupport(self.priors,names))
+            finally:
+                evaluate.close()
+            res[sm]=out['logZ']
+        
+        f=open(self.saveTo+'-evidence.csv','w')
+        f.write('\t'.join(['Model','log evidence'])+'\n')
+        for sm in subModels:
+            f.write('\t'.join([sm,'%.3f'%res[sm]])+'\n')
+        for g in (1,2):
+            if ('hom%i'%g in res) and ('het%i'%g in res):
+                res['logBF%i'%g]=res['het%i'%g]-res['hom%i'%g]
+                f.write('\t'.join(['log Bayes factor het%i/hom%i'%(g,g),'%.3f'%res['logBF%i'%g]])+'\n')
+        f.close()
+        print "Saved log evidences and Bayes factors, see "+self.name+'-evidence.csv'
+        self.evidences=res
+        return res
     
     def setgroup(self,i):
         """ Set variables for plotting group 1 (i=1) or group 2 (i=2).
@@ -368,4 +434,52 @@ Returns:
         self.setgroup(0)
         return res1,res2
 
+def subModelLogLik(thetas,sub):
+    """Log-likelihood of the survival of one group under the homogeneous or 
+heterogeneous model, for a batch of parameter values, summing over the number of 
+infected hosts per dose (see Model.evidence).
+
+Input:
+- thetas (float arr): one row per set of parameters, columns (p, eps, meanU, sU, k, 
+meanI, sI) for the homogeneous model and (p, a, b, eps, meanU, sU, k, meanI, sI) for 
+the heterogeneous model.
+- sub (dict): data of the group, see Model.evidence.
+
+Returns the log-likelihood of each row (float arr)."""
+    import smc
+    if sub['het']:
+        p,a,b,eps,meanU,sU,k,meanI,sI=thetas.T
+    else:
+        p,eps,meanU,sU,k,meanI,sI=thetas.T
+    tauU=meanU/sU
+    tauI=meanI/sI
+    res=np.zeros(len(thetas))
+    with np.errstate(all='ignore'):
+        # Log-probabilities of death in each interval (particles x changing times) and of survival
+        lpdU=ut.logKpdfInt(sub['t1'],sub['t2'],sU[:,None],tauU[:,None],k[:,None])
+        lpdI=ut.logKpdfInt(sub['t1'],sub['t2'],sI[:,None],tauI[:,None],k[:,None])
+        lpsU=ut.logKsf(sub['tmax'],sU,tauU,k)
+        lpsI=ut.logKsf(sub['tmax'],sI,tauI,k)
+        for di in sub['idoses']:
+            nf=sub['nhosts'][di]
+            I=np.arange(nf+1)
+            f=I/float(nf)
+            if sub['het']:
+                pi=ut.pi_het(sub['doses'][di],p,a,b,eps)
+            else:
+                pi=ut.pi_hom(sub['doses'][di],p,eps)
+            # particles x number of infected
+            lik=sp.gammaln(nf+1)-sp.gammaln(I+1)-sp.gammaln(nf-I+1)+sp.xlogy(I,pi[:,None])+sp.xlog1py(nf-I,-pi[:,None])
+            D=sub['deaths'][di]
+            j=D>0
+            lik+=(ut.logMixture(f[None,:,None],lpdI[:,None,j],lpdU[:,None,j])*D[j]).sum(2)
+            if sub['survivors'][di]>0:
+                lik+=sub['survivors'][di]*ut.logMixture(f,lpsI[:,None],lpsU[:,None])
+            lik[np.isnan(lik)]=-np.inf
+            res+=smc.logsumexp(lik,axis=1)
+        # Infected hosts cannot be more likely to survive to the end of the study than uninfected ones
+        res[sp.gammainc(sI,sub['tmax']/tauI)<sp.gammainc(sU,sub['tmax']/tauU)]=-np.inf
+    res[np.isnan(res)]=-np.inf
+    return res
+
 TimeData=df.TimeData
@@ -0,0 +1,152 @@
+""" Compact storage of MCMC traces, as a numpy .npz archive instead of pymc's pickle
+database.
+
+pymc's pickle database stores every trace as int64 or float64, pickled as text. Most of
+the traces of long runs are the numbers of infected hosts (Ig1dX, Ig2dX, I1homX...),
+which never exceed the number of hosts of a dose and fit in one or two bytes. The
+traces are saved here with a dtype chosen for each of them (see dtypePolicy):
+- integer (or object arrays of integers) traces: the smallest integer type holding
+their minimum and maximum (e.g. uint8 for counts up to 255), without loss;
+- float traces: float64, or float32 for the names matching one of the patterns of
+float32 (e.g. the quantities that are only plotted, see Models.compactTraces) and
+those already saved as float32 (pointwise log-likelihoods);
+- others (bool...) as they are.
+The state of the sampler pymc saves with the traces ('_state_') is kept, pickled.
+With bCompress, the archive is compressed (zlib, slower to write, a little slower to
+load).
+
+The traces are loaded in the same dictionnary as pymc's pickle database, {name:
+{chain: array}}, with integers as int64 and floats as float64 (unless bUpcast is
+False), so that code reading either is the same:
+    traceStore.convert(saveTo+'-MCMC.pickle',saveTo+'-MCMC.npz',float32=['^pi_','^tau'])
+    M2=traceStore.load(saveTo+'-MCMC.npz')
+"""
+import os, re, time, pickle, numpy as np
+
+_sep=':'
+_state='_state_'
+
+def dtypePolicy(traces,float32=()):
+    """Returns the dtype used to store each trace.
+
+Input:
+- traces (dict): {name: {chain: array}}, as in pymc's pickle database.
+- float32 (list of str): regular expressions, float traces with a name matching one of
+them are stored as float32.
+
+Returns a dictionnary {name: dtype}.
+"""
+    patterns=[re.compile(p) for p in float32]
+    res={}
+    for name,chains in traces.items():
+        if name==_state or not isinstance(chains,dict):
+            continue
+        arrs=[_asArray(a) for a in chains.values()]
+        kind=np.result_type(*arrs).kind if arrs else 'f'
+        if kind in 'iu':
+            nonEmpty=[a for a in arrs if a.size]
+            lo=min([a.min() for a in nonEmpty]) if nonEmpty else 0
+            hi=max([a.max() for a in nonEmpty]) if nonEmpty else 0
+            res[name]=_smallestInt(lo,hi)
+        elif kind=='f':
+            bSingle=np.result_type(*arrs).itemsize<=4 or any([p.search(name) for p in patterns])
+            res[name]=np.dtype(np.float32 if bSingle else np.float64)
+        else:
+            res[name]=np.result_type(*arrs)
+    return res
+
+def _asArray(a):
+    """Array of a trace, object arrays of integers (or floats) converted to numbers."""
+    a=np.asarray(a)
+    if a.dtype.kind=='O':
+        a=np.array(a.tolist())
+    return a
+
+def _smallestInt(lo,hi):
+    """Smallest integer dtype holding values from lo to hi."""
+    for t in ((np.uint8,np.uint16,np.uint32,np.uint64) if lo>=0 else (np.int8,np.int16,np.int32,np.int64)):
+        info=np.iinfo(t)
+        if info.min<=lo and hi<=info.max:
+            return np.dtype(t)
+    return np.dtype(np.int64)
+
+def save(traces,filename,float32=(),bCompress=False):
+    """Saves traces ({name: {chain: array}}) in filename (.npz), with the dtypes of
+dtypePolicy (see above). The file is written to a temporary file and renamed.
+
+Returns the dtypes used."""
+    dtypes=dtypePolicy(traces,float32)
+    arrays={}
+    for name,dtype in dtypes.items():
+        if _sep in name:
+            raise ValueError("Trace names cannot contain '%s': %s"%(_sep,name))
+        for c,a in traces[name].items():
+            arrays['%s%s%i'%(name,_sep,c)]=_asArray(a).astype(dtype)
+    if _state in traces:
+        arrays[_state]=np.frombuffer(pickle.dumps(traces[_state],pickle.HIGHEST_PROTOCOL),np.uint8)
+    tmp=filename+'.tmp.npz'
+    (np.savez_compressed if bCompress else np.savez)(tmp,**arrays)
+    os.rename(tmp,filename)
+    return dtypes
+
+def load(filename,bUpcast=True):
+    """Loads traces saved with save (.npz) or by pymc (pickle database).
+
+Input:
+- filename (str): .npz archive or pickle database.
+- bUpcast (bool): convert the integer traces to int64 and the float traces to float64,
+as in pymc's database (True, default), or keep the dtypes they were stored with.
+
+Returns a dictionnary {name: {chain: array}}.
+"""
+    if not filename.endswith('.npz'):
+        return pickle.load(open(filename,'rb'))
+    traces={}
+    f=np.load(filename)
+    try:
+        for key in f.files:
+            if key==_state:
+                traces[_state]=pickle.loads(f[key].tobytes())
+                continue
+            name,c=key.rsplit(_sep,1)
+            a=f[key]
+            if bUpcast and a.dtype.kind in 'iu':
+                a=a.astype(np.int64)
+            elif bUpcast and a.dtype.kind=='f':
+                a=a.astype(np.float64)
+            traces.setdefault(name,{})[int(c)]=a
+    finally:
+        f.close()
+    return traces
+
+def convert(source,dest,float32=(),bCompress=False,verbose=True):
+    """Converts the pickle database source to the compact archive dest, and measures
+the savings.
+
+Input:
+- source, dest (str): pickle database and .npz archive.
+- float32, bCompress: see save.
+- verbose (bool): print the file sizes and the load times.
+
+Returns a dictionnary with the sizes (bytes) and the load times (s) of both files
+('size pickle', 'size npz', 'load pickle', 'load npz') and the dtypes used.
+"""
+    t0=time.time()
+    traces=load(source)
+    tPickle=time.time()-t0
+    dtypes=save(traces,dest,float32,bCompress)
+    t0=time.time()
+    load(dest)
+    tNpz=time.time()-t0
+    res={'size pickle':os.path.getsize(source),'size npz':os.path.getsize(dest),
+         'load pickle':tPickle,'load npz':tNpz,'dtypes':dtypes}
+    if verbose:
+        print "Traces: %.1f MB -> %.1f MB, loaded in %.2fs -> %.2fs (%s)"%(res['size pickle']/1e6,res['size npz']/1e6,
+            tPickle,tNpz,', '.join(['%i %s'%(n,t) for t,n in sorted(_countDtypes(dtypes).items())]))
+    return res
+
+def _countDtypes(dtypes):
+    res={}
+    for t in dtypes.values():
+        res[str(t)]=res.get(str(t),0)+1
+    return res
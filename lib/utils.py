@@ -1,46 +1,92 @@
 """ Functions used in model files. """
-import numpy as np, random, os, sys, csv
-import modelFunctions as mf
-import dataFunctions as df
-from scipy.integrate import quad
-import scipy.stats as st
+import numpy as np, random, os, sys, types, importlib
 import scipy.special as sp
-from copy import deepcopy
 from functools import wraps
-from scipy.stats import scoreatpercentile as sap
-from matplotlib import rcParams
-rcParams.update({'font.size': 10})
-rcParams['axes.labelsize'] = 'large'
-rcParams['font.serif'] = 'Times New Roman'
-rcParams['font.family']='serif'
+from collections import OrderedDict
+import instrument as ins
+import piTable
+
+# Lazy imports
+class _LazyModule(types.ModuleType):
+    """ Stands for a module until one of its attributes is used, the module is then 
+    imported (and onLoad called with it, once). """
+    def __init__(self,name,onLoad=None):
+        super(_LazyModule,self).__init__(name)
+        self.__dict__['_onLoad']=onLoad
+    
+    def __getattr__(self,attr):
+        # Only called for attributes not found yet, i.e. before the first import
+        mod=importlib.import_module(self.__name__)
+        self.__dict__.update(mod.__dict__)
+        if self._onLoad!=None:
+            self._onLoad(mod)
+        return getattr(mod,attr)
+
+_lazyModules={}
+def lazyImport(name,onLoad=None):
+    """Returns a module that is only imported when first used. Used for modules that 
+are slow to import and only needed on some code paths (pymc, pylab, scipy.stats...), 
+so that batch jobs and worker processes start fast.
+
+Input:
+- name (str): full name of the module, e.g. 'scipy.stats'.
+- onLoad (function): called with the module when it is imported."""
+    if name not in _lazyModules:
+        _lazyModules[name]=_LazyModule(name,onLoad)
+    return _lazyModules[name]
+
+_bPlotStyle=[False]
+def plotStyle(mod=None):
+    """Sets the default matplotlib style of the figures (once, when matplotlib is
+first used through mpl or pl)."""
+    if not _bPlotStyle[0]:
+        _bPlotStyle[0]=True
+        from matplotlib import rcParams
+        rcParams.update({'font.size': 10})
+        rcParams['axes.labelsize'] = 'large'
+        rcParams['font.serif'] = 'Times New Roman'
+        rcParams['font.family']='serif'
+
+st=lazyImport('scipy.stats')
+py=lazyImport('pymc')
+mpl=lazyImport('matplotlib',plotStyle)
+pl=lazyImport('pylab',plotStyle)
 
 # Dose-Response models
-@np.vectorize
 def pi_hom(dose,p,eps):
-    """Returns the probability of infection from the homogeneous model. 
+    """Returns the probability of infection from the homogeneous model. Broadcasts over all arguments.
 
 Input:
 - dose (float): amount of virus the hosts are challenged with.
 - p (float): probability of infection for each viral particle
 - eps (float): probability of ineffective challenge."""
-    return((1-np.exp(-dose*p))*(1-eps))
+    # -expm1(-x) is 1-exp(-x) without rounding to 0 for small dose*p
+    return -np.expm1(-np.multiply(dose,p))*(1-np.asarray(eps))
 
 @np.vectorize
 def f_beta(s,dose,p,a,b):
     return(np.exp(-dose*p*s)*(s**(a-1))*((1-s)**(b-1))/sp.beta(a,b))
 
-@np.vectorize
-def pi_het(dose,p,a,b,eps):
-    """Returns the probability of infection from the homogeneous model. 
+def pi_het(dose,p,a,b,eps,maxError=None):
+    """Returns the probability of infection from the heterogeneous model. 
 
 Input:
 - dose (float): amount of virus the hosts are challenged with.
 - p (float): probability of infection for each viral particle
 - a,b (float): shape parameters for the Beta distribution of susceptibilities
-- eps (float): probability of ineffective challenge."""
-    
-    small=0.001
-    return((1-(quad(f_beta,0,0+small,args=(dose,p,a,b),full_output=1)[0]+quad(f_beta,0+small,1-small,args=(dose,p,a,b),full_output=1)[0]+quad(f_beta,1-small,1,args=(dose,p,a,b),full_output=1)[0]))*(1-eps))
+- eps (float): probability of ineffective challenge.
+- maxError (float): largest error accepted if a precomputed table is used (see 
+piTable), the exact value is computed if the table is less accurate. 
+
+The average probability of escaping infection over the Beta distribution of 
+susceptibilities (the integral of f_beta between 0 and 1) is the confluent 
+hypergeometric function 1F1(a;a+b;-dose*p). For small dose*p, 1-1F1 cancels to 0
+and is replaced by the first terms of its series (see piTable.exact)."""
+    ins.count('pi_het calls')
+    if piTable._table['values'] is not None and any([isinstance(v,np.ndarray) and v.size>=piTable.minSize for v in (dose,p,a,b,eps)]):
+        return piTable.pi_het(dose,p,a,b,eps,maxError)
+    res=piTable.exact(dose,p,a,b)*(1-np.asarray(eps))
+    return res if res.ndim else res[()]
 
 # Gamma densities
 @np.vectorize
@@ -59,22 +105,184 @@ def updf(t,tmax):
     """Probability Density Function (cdf) of a Uniform distribution between 0 and tmax)."""
     return 1./tmax if t<tmax else 0.
 
+def gcdf(t,c,tau):
+    """Cumulative Density Function of a Gamma distribution (c,tau), as st.gamma.cdf. Broadcasts over all arguments."""
+    return sp.gammainc(c,np.divide(t,tau))
+
 # Gamma*Uniform densities
-@np.vectorize
 def kpdf(t,c,tau,k):
-    """Probability Density Function (cdf) of a mixture of a time-independent Uniform distribution [0,1/k] and a Gamma distribution (c,tau)."""
+    """Probability Density Function (cdf) of a mixture of a time-independent Uniform distribution [0,1/k] and a Gamma distribution (c,tau). Broadcasts over all arguments."""
+    t=np.asarray(t,float)
     return k*(1-st.gamma.cdf(t,c,loc=0,scale=tau))+(1-k*t)*st.gamma.pdf(t,c,loc=0,scale=tau)
 
-@np.vectorize
+def ksf(t,cg,tau,k):
+    """Survival function of a mixture of a time-independent Uniform distribution [0,1/k] and a Gamma distribution (c,tau), i.e. the probability of no event up to t."""
+    return (1-k*np.asarray(t))*sp.gammaincc(cg,np.divide(t,tau))
+
 def kpdfInt(t1,t2,cg,tau,k):
-    """Probability of an event between t1 and t2 of a mixture of a time-independent Uniform distribution [0,1/k] and a Gamma distribution (c,tau)."""
-    return k*((t2-t1)-(quad(lambda t: sp.gammainc(cg,t/tau),t1,t2)[0]))+sp.gammainc(cg,t2/tau)-sp.gammainc(cg,t1/tau)-k*cg*tau*(sp.gammainc(cg+1,t2/tau)-sp.gammainc(cg+1,t1/tau))
+    """Probability of an event between t1 and t2 of a mixture of a time-independent Uniform distribution [0,1/k] and a Gamma distribution (c,tau). Broadcasts over all arguments."""
+    ins.count('kpdfInt calls')
+    return ksf(t1,cg,tau,k)-ksf(t2,cg,tau,k)
+
+# Log-space kernels, used by the likelihoods: the probabilities of the tails (survival
+# of infected hosts to tmax, deaths of uninfected hosts early on) underflow to 0 in 
+# linear space, which rejects the parameters as if they had a zero probability.
+def logGammaincc(a,x):
+    """Log of the regularized upper incomplete gamma function, log(sp.gammaincc(a,x)), 
+also where gammaincc underflows (from the continued fraction of Gamma(a,x), which 
+converges for x>a+1). Broadcasts over all arguments."""
+    a,x=np.broadcast_arrays(np.asarray(a,float),np.asarray(x,float))
+    with np.errstate(divide='ignore'):
+        res=np.array(np.log(sp.gammaincc(a,x)))
+    tail=(res<-700)&(x>a+1)
+    if tail.any():
+        res[tail]=_logGammainccCF(a[tail],x[tail])
+    return res if res.ndim else res[()]
+
+def _logGammainccCF(a,x,tol=1e-15,maxiter=200):
+    """log(Gamma(a,x)/Gamma(a)) from the continued fraction of Gamma(a,x), evaluated 
+with the modified Lentz method, for x>a+1."""
+    tiny=1e-300
+    b=x+1-a
+    c=np.full(x.shape,1/tiny)
+    d=1/b
+    h=d.copy()
+    for i in xrange(1,maxiter+1):
+        an=-i*(i-a)
+        b=b+2
+        d=an*d+b
+        d[np.abs(d)<tiny]=tiny
+        c=b+an/c
+        c[np.abs(c)<tiny]=tiny
+        d=1/d
+        delta=d*c
+        h*=delta
+        if np.all(np.abs(delta-1)<tol):
+            break
+    return -x+a*np.log(x)-sp.gammaln(a)+np.log(h)
+
+def logKsf(t,cg,tau,k):
+    """Log of ksf, the probability of no event up to t (-inf from t=1/k). Broadcasts over all arguments."""
+    t=np.asarray(t,float)
+    kt=np.multiply(k,t)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        res=np.where(kt<1,np.log1p(-kt)+logGammaincc(cg,np.divide(t,tau)),-np.inf)
+    return res if res.ndim else res[()]
+
+def logKpdfInt(t1,t2,cg,tau,k):
+    """Log of kpdfInt, the probability of an event between t1 and t2 (computed from the 
+log-survival at t1 and t2, log(S1-S2)=log(S1)+log(1-S2/S1)). Broadcasts over all arguments."""
+    ins.count('kpdfInt calls')
+    l1=logKsf(t1,cg,tau,k)
+    l2=logKsf(t2,cg,tau,k)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        res=np.where(l2<l1,l1+np.log(-np.expm1(l2-l1)),-np.inf)
+    return res if res.ndim else res[()]
+
+def logMixture(f,logA,logB):
+    """Log of the probability f*A+(1-f)*B of an event for a mixture of two kinds of hosts
+(e.g. infected and uninfected), in a fraction f and 1-f, for which the event has a 
+probability A and B, from logA and logB. Broadcasts over all arguments."""
+    with np.errstate(divide='ignore'):
+        return np.logaddexp(np.log(f)+logA,np.log1p(-np.asarray(f,float))+logB)
+
+class KernelCache(object):
+    """Least recently used cache of mortality kernels (kpdfInt, kpdf, gcdf...) over 
+fixed time grids, keyed by the kernel, the values of its parameters (e.g. s, tau, k) 
+and the time grid.
+
+During sampling, the kernels of the likelihoods are only recomputed when their own
+parameters change: the values of the other nodes that use the same kernel (logprobdU 
+and logprobsU, the potentials...), and those of parameter values visited again (rejected
+proposals, mortality parameters that did not move while the sampler updates the 
+infection parameters) are read from the cache. In the posterior calculations, each 
+distinct sample of the parameters is computed once (Metropolis traces repeat values).
+
+The hits and misses are counted in the attributes hits and misses, and in the 
+counters of the run report (see instrument.py).
+
+Input:
+- maxsize (int): number of kernel vectors kept, the least recently used are evicted.
+"""
+    def __init__(self,maxsize=4096):
+        self.maxsize=maxsize
+        self.hits=0
+        self.misses=0
+        self._values=OrderedDict()
+    
+    def clear(self):
+        """Empties the cache (the counters are kept)."""
+        self._values.clear()
+    
+    def get(self,func,grid,*params):
+        """Returns func(*(grid+params)), e.g. get(kpdfInt,(t1,t2),s,tau,k), for the
+scalar parameters params. The result is read-only."""
+        key=(func.__name__,tuple([float(p) for p in params]),_gridKey(grid))
+        res=self._values.pop(key,None)
+        if res is None:
+            self.misses+=1
+            ins.count('kernel cache misses')
+            res=np.asarray(func(*(tuple(grid)+params)))
+            res.flags.writeable=False
+        else:
+            self.hits+=1
+            ins.count('kernel cache hits')
+        self._store(key,res)
+        return res
+    
+    def columns(self,func,grid,*params):
+        """Returns func over grid for each sample of the parameters (arrays of the 
+same length, e.g. the traces of s, tau and k), as an array of samples x grid: 
+columns(kpdfInt,(0,ts),sUs,tauUs,ks)[i] is kpdfInt(0,ts,sUs[i],tauUs[i],ks[i]). 
+Distinct samples missing from the cache are computed at once."""
+        params=[np.asarray(p,float) for p in params]
+        rows,inverse=np.unique(np.array(params).T,axis=0,return_inverse=True)
+        gkey=_gridKey(grid)
+        keys=[(func.__name__,tuple(r),gkey) for r in rows.tolist()]
+        found=[self._values.pop(key,None) for key in keys]
+        missing=[i for i,v in enumerate(found) if v is None]
+        self.hits+=len(keys)-len(missing)
+        self.misses+=len(missing)
+        ins.count('kernel cache hits',len(keys)-len(missing))
+        ins.count('kernel cache misses',len(missing))
+        if missing:
+            shape=(-1,)+(1,)*max([np.ndim(g) for g in grid])
+            values=np.asarray(func(*(list(grid)+[rows[missing,j].reshape(shape) for j in range(rows.shape[1])])))
+            for i,v in zip(missing,values):
+                v=np.asarray(v)
+                v.flags.writeable=False
+                found[i]=v
+        for key,v in zip(keys,found):
+            self._store(key,v)
+        return np.array(found)[inverse.ravel()]
+    
+    def _store(self,key,value):
+        self._values[key]=value
+        while len(self._values)>self.maxsize:
+            self._values.popitem(last=False)
+
+def _gridKey(grid):
+    return tuple([(np.shape(g),np.asarray(g,float).tobytes()) for g in grid])
+
+# Kernels shared by the likelihoods and the posterior calculations
+kernels=KernelCache()
 
-def hpd(data, level=0.95) :
+def hpd(data, level=0.95, weights=None) :
     """ The Highest Posterior Density (credible) interval of data at level level.
 :param data: sequence of real values
 :param level: (0 < level < 1)
+:param weights: importance weights of the values (e.g. after reweighting to a new prior), defaults to equal weights
     """ 
+    if weights is not None:
+        order=np.argsort(data)
+        d=np.asarray(data,float)[order]
+        cw=np.cumsum(np.asarray(weights,float)[order])
+        cw/=cw[-1]
+        # Shortest interval [d[i],d[j]] with at least level of the weight
+        j=np.searchsorted(cw,np.concatenate(([0],cw[:-1]))+level-1e-12)
+        ok=j<len(d)
+        i=np.arange(len(d))[ok][(d[j[ok]]-d[ok]).argmin()]
+        return (d[i], d[j[i]])
     d = list(data)
     d.sort()
     nData = len(data)
@@ -89,14 +297,35 @@ def hpd(data, level=0.95) :
     assert 0 <= i <= i+nIn-1 < len(d)
     return (d[i], d[i+nIn-1])
 
-def confint(arr):
-    """Returns the median in between the 95% HPD interval of the array.
+def wpercentile(arr,q,weights=None):
+    """Percentiles q (in %) of arr along the first axis, with importance weights of the rows (if not None)."""
+    arr=np.asarray(arr,float)
+    if weights is None:
+        return np.percentile(arr,q,axis=0)
+    order=np.argsort(arr,axis=0)
+    cw=np.cumsum(np.asarray(weights,float)[order],axis=0)
+    cw/=cw[-1]
+    srt=np.take_along_axis(arr,order,0)
+    res=[]
+    for qi in np.atleast_1d(q):
+        idx=np.minimum((cw<qi/100.).sum(0),len(arr)-1)
+        res.append(np.take_along_axis(srt,idx[None],0)[0])
+    return np.array(res)
+
+def confint(arr,weights=None):
+    """Returns the mean in between the 95% equal-tailed credible interval of the
+samples in arr (along the first axis), optionally with importance weights of the
+samples (see mf.Models.reweight).
     """
+    arr=np.asarray(arr,float)
     res=[[],[],[]]
-    #r=hpd(arr)
-    r=(sap(arr,2.5),sap(arr,97.5))
+    r=wpercentile(arr,[2.5,97.5],weights)
+    if weights is None:
+        res[1]=arr.mean(0)
+    else:
+        w=np.asarray(weights,float)/np.sum(weights)
+        res[1]=np.tensordot(w,arr,(0,0))
     res[0]=r[0]
-    res[1]=arr.mean(0)
     res[2]=r[1]
     return np.array(res)
 
@@ -118,12 +347,14 @@ Returns:
     return call+')'
 
 class ProgressBar(object):
-    """ Prints a progress bar in terminal. """
+    """ Prints a progress bar in terminal. Each bar is also timed as a stage of the run 
+    (see instrument.py), from start to finish. """
     def __init__(self,startText):
         self.start(startText)
     
     def start(self,text):
         print text
+        ins.start(text)
         self.width=40
         sys.stdout.write("[%s]" % (" " * self.width))
         sys.stdout.flush()
@@ -145,6 +376,7 @@ class ProgressBar(object):
         if self.printed<self.width:
             sys.stdout.write("-"*int(self.width-self.printed))
         print ""
+        ins.stop()
 
         def hpd(data, level=0.95) :
             """ The Highest Posterior Density (credible) interval of data at level level.
@@ -167,26 +399,9 @@ class ProgressBar(object):
 
 
 def initializeFolder(savePath,name,bOverWrite):
-    """Creates a folder identified by user preferences or a mixture of a data descriptor and a model descriptor. If folder already exists, creates, inside the existing folder, a folder called Run 2. If Run 2 exists already, it checks if Run 3 exists, and so on. """
-    if savePath==None:
-        savePath=os.path.join('.','results')
-    path=os.path.join(savePath,name)
-    path_copy=deepcopy(path)
-    if not bOverWrite:
-        if os.path.exists(path_copy):
-            fi=2
-            poss_path=os.path.join(path_copy,'Run (%i)'%fi)
-            while os.path.exists(poss_path):
-                fi+=1
-                poss_path=os.path.join(path_copy,'Run (%i)'%fi)
-            path=poss_path
-        
-        os.makedirs(path)
-    
-    bexisted=True
-    if not os.path.exists(path):
-        os.makedirs(path)
-        bexisted=False
+    """Creates a folder identified by user preferences or a mixture of a data descriptor and a model descriptor. If folder already exists, creates, inside the existing folder, a folder called Run (2). If Run (2) exists already, Run (3), and so on. The number of the next run is found in the index of the runs of savePath (see runIndex.allocate). """
+    import runIndex
+    path,bexisted=runIndex.allocate(savePath,name,bOverWrite)
     
     if path[-1]!=os.path.sep:
         path+=os.path.sep
@@ -259,19 +474,86 @@ dose (list of arrays).
 - ndoses (int): number of doses.
 - nhosts (int arr): number of challenged hosts per dose.
 """
-    reader=csv.reader(open(dataPath))
-    l=np.array(list(reader))
-    times=l[0,1:].astype(int)
-    tmax=times[-1]
-    doses=l[1:,0].astype(float)
-    ndoses=len(doses)
-    survivalOverTime=l[1:,1:].astype(int)
-    survivors=survivalOverTime[:,-1]
-    nhosts=survivalOverTime[:,0]
-    timesDeath=['']*ndoses
-    for di in xrange(ndoses):
-        surv=survivalOverTime[di,:]
-        deaths=surv[:-1]-surv[1:]
-        timesDeath[di]=np.array([item for sublist in [[times[ti+1]]*deaths[ti] for ti in xrange(tmax)] for item in sublist])
-    
-    return (timesDeath,survivors,tmax,times,doses,ndoses,nhosts)
+    f=open(dataPath)
+    # First line: empty cell, then the days of observation
+    times=np.array(f.readline().strip().split(',')[1:],float).astype(int)
+    l=np.loadtxt(f,delimiter=',',ndmin=2)
+    f.close()
+    doses=l[:,0]
+    survivalOverTime=l[:,1:].astype(int)
+    timesDeath=deathTimes(times,survivalOverTime)
+    return (timesDeath,survivalOverTime[:,-1],times[-1],times,doses,len(doses),survivalOverTime[:,0])
+
+def deathTimes(times,survivalOverTime):
+    """Returns the observed times of deaths for each dose (list of int arrays), from the
+number of hosts alive at each day of observation (doses x times). Deaths are counted
+at the first day at which hosts were observed dead."""
+    deaths=np.maximum(-np.diff(survivalOverTime,axis=1),0)
+    return [np.repeat(times[1:],deaths[di]) for di in xrange(len(survivalOverTime))]
+
+def readTable(dataPath,columns):
+    """Reads a csv file with a header line into typed columns.
+
+Input:
+- dataPath (str): path to csv file (',' delimiter).
+- columns (list of (str, type)): name and type of each expected column, e.g. 
+[('dose',float),('nhosts',int)].
+
+Returns a dictionnary with an array for each column, and the list of column names 
+in the file. Columns are taken by name, or in the order of columns (with a warning)
+if the labels are not the expected ones."""
+    # DataError is defined in dataFunctions, which imports utils
+    from dataFunctions import DataError
+    f=open(dataPath)
+    names=[n.strip() for n in f.readline().strip().split(',')]
+    try:
+        table=np.genfromtxt(f,delimiter=',',dtype=None,names=names,autostrip=True,encoding=None)
+    except ValueError, e:
+        raise DataError("Cannot read %s: %s"%(dataPath,e))
+    finally:
+        f.close()
+    table=np.atleast_1d(table)
+    dtypes=dict(columns)
+    if set(names)!=set(dtypes):
+        print "The column labels do not correspond exactly to {%s}. Please check that order of the data in the columns is correct."%', '.join([c[0] for c in columns])
+        names=[c[0] for c in columns]
+    if table.dtype.names==None or len(table.dtype.names)<len(names):
+        raise DataError("%s should have the columns %s"%(dataPath,', '.join([c[0] for c in columns])))
+    res={}
+    for i,n in enumerate(names):
+        if n in dtypes:
+            try:
+                res[n]=table[table.dtype.names[i]].astype(dtypes[n])
+            except ValueError, e:
+                raise DataError("Column %s of %s should be of type %s: %s"%(n,dataPath,dtypes[n].__name__,e))
+    return res,names
+
+def readLong(dataPath):
+    """Reads a long-format data file of survival over time, with one line per count of
+hosts alive and columns experiment, group, dose, day, alive (in any order, with a 
+header line). 
+
+Returns a list of (experiment, groups, doses, times, alive) for each experiment (in
+order of first appearance), with alive the number of hosts alive (groups x doses x
+times). Day 0 should give the number of challenged hosts. Raises a DataError if a
+count is missing or given more than once."""
+    from dataFunctions import DataError
+    cols,names=readTable(dataPath,[('experiment',str),('group',int),('dose',float),('day',int),('alive',int)])
+    experiments,first,iexp=np.unique(cols['experiment'],return_index=True,return_inverse=True)
+    res=[]
+    for ei in np.argsort(first):
+        sel=iexp==ei
+        groups,ig=np.unique(cols['group'][sel],return_inverse=True)
+        doses,idose=np.unique(cols['dose'][sel],return_inverse=True)
+        times,itime=np.unique(cols['day'][sel],return_inverse=True)
+        cell=(ig*len(doses)+idose)*len(times)+itime
+        cells,counts=np.unique(cell,return_counts=True)
+        if np.any(counts>1):
+            g,d,t=np.unravel_index(cells[counts>1][0],(len(groups),len(doses),len(times)))
+            raise DataError("Duplicate counts in experiment %s of %s for group %i, dose %g, day %i."%(experiments[ei],dataPath,groups[g],doses[d],times[t]))
+        alive=-np.ones((len(groups),len(doses),len(times)),int)
+        alive[ig,idose,itime]=cols['alive'][sel]
+        if np.any(alive<0):
+            raise DataError("Missing counts in experiment %s of %s, each group and dose should be observed at every day."%(experiments[ei],dataPath))
+        res.append((experiments[ei],groups,doses,times,alive))
+    return res